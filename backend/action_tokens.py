@@ -0,0 +1,57 @@
+"""HMAC-signed, expiring tokens for the admin email links.
+
+A token binds an appointment id, an action and an expiry time. It is
+verified without touching the database: any change to the payload, a token
+for another action, or an expired token is rejected.
+"""
+import base64
+import hashlib
+import hmac
+import time
+from typing import Optional
+
+
+class InvalidActionToken(Exception):
+    pass
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+class ActionTokenSigner:
+    def __init__(self, secret: str, ttl_seconds: int):
+        self._key = secret.encode()
+        self.ttl_seconds = ttl_seconds
+
+    def _signature(self, payload: bytes) -> bytes:
+        return hmac.new(self._key, payload, hashlib.sha256).digest()
+
+    def sign(self, appointment_id: str, action: str, now: Optional[float] = None) -> str:
+        expires = int((now or time.time()) + self.ttl_seconds)
+        payload = f"{appointment_id}|{action}|{expires}".encode()
+        return f"{_b64encode(payload)}.{_b64encode(self._signature(payload))}"
+
+    def verify(self, token: str, appointment_id: str, action: str, now: Optional[float] = None):
+        """Raise InvalidActionToken unless the token authorizes this action on this appointment"""
+        try:
+            encoded_payload, encoded_signature = token.split(".")
+            payload = _b64decode(encoded_payload)
+            signature = _b64decode(encoded_signature)
+        except ValueError:
+            raise InvalidActionToken("malformed token")
+        if not hmac.compare_digest(signature, self._signature(payload)):
+            raise InvalidActionToken("bad signature")
+        try:
+            token_id, token_action, expires = payload.decode().rsplit("|", 2)
+            expires = int(expires)
+        except ValueError:
+            raise InvalidActionToken("malformed token")
+        if token_id != appointment_id or token_action != action:
+            raise InvalidActionToken("token issued for another action")
+        if expires < (now or time.time()):
+            raise InvalidActionToken("token expired")
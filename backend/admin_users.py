@@ -0,0 +1,68 @@
+"""Grant and revoke access to the /api/admin endpoints.
+
+Admin rights are the ``is_admin`` flag on the user document. Registration
+never sets it, so it is only granted from here, against the database the
+server uses::
+
+    python admin_users.py grant USERNAME
+    python admin_users.py revoke USERNAME
+    python admin_users.py list
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+
+async def set_admin(db, username: str, is_admin: bool) -> bool:
+    """Set the flag on an existing account; False if there is no such username"""
+    result = await db.users.update_one({"username": username}, {"$set": {"is_admin": is_admin}})
+    return result.matched_count == 1
+
+
+async def list_admins(db) -> List[str]:
+    cursor = db.users.find({"is_admin": True}, {"_id": 0, "username": 1}).sort("username", 1)
+    return [user["username"] async for user in cursor]
+
+
+async def _main(args) -> int:
+    from database import Database
+
+    db = Database.from_env(os.environ, tz_aware=True)
+    await db.connect()
+    try:
+        if args.command == "list":
+            for username in await list_admins(db):
+                print(username)
+            return 0
+        if not await set_admin(db, args.username, args.command == "grant"):
+            logger.error(f"No user named {args.username}")
+            return 1
+        logger.info(f"{'Granted' if args.command == 'grant' else 'Revoked'} admin access for {args.username}")
+        return 0
+    finally:
+        db.close()
+
+
+def main(argv=None) -> int:
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Manage Spaziopratiche admin accounts")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for command in ("grant", "revoke"):
+        commands.add_parser(command, help=f"{command} admin access").add_argument("username")
+    commands.add_parser("list", help="list the admin accounts")
+    args = parser.parse_args(argv)
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
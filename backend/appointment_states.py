@@ -0,0 +1,110 @@
+"""Appointment state machine.
+
+Every status change goes through one conditional ``find_one_and_update``:
+the filter only matches documents in one of the allowed source states, so a
+double click or a confirm racing a cancel changes the document at most once.
+The same update appends the transition to the document's ``history``.
+
+Appointments also carry due times for the scheduled jobs (see ``DueTimes``):
+when to remind the client, when to remind the admin of a request still
+pending and when a pending request stops holding its slot.
+"""
+from datetime import datetime, timezone, timedelta
+from typing import Mapping, Optional
+
+from pymongo import ReturnDocument
+
+PENDING = "pending"
+CONFIRMED = "confirmed"
+REJECTED = "rejected"
+CANCELLED = "cancelled"
+
+# action -> (allowed source states, target state, whether the slot is released)
+TRANSITIONS = {
+    "confirm": ({PENDING}, CONFIRMED, False),
+    "reject": ({PENDING}, REJECTED, False),
+    "cancel": ({PENDING, CONFIRMED, REJECTED}, CANCELLED, True),
+    # Nobody reviewed the request in time; frees the slot like a cancellation
+    "expire": ({PENDING}, CANCELLED, True),
+}
+
+
+def appointment_start(date: str, time: str) -> datetime:
+    """Start of an appointment as an aware datetime; dates and times are in the server's local time"""
+    return datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M").astimezone(timezone.utc)
+
+
+class DueTimes:
+    """Due-time fields polled by the scheduled jobs; a setting of 0 hours turns that job off"""
+
+    def __init__(self, reminder_lead_hours: float = 24, admin_reping_hours: float = 12, pending_hold_hours: float = 48):
+        self.reminder_lead = timedelta(hours=reminder_lead_hours)
+        self.admin_reping = timedelta(hours=admin_reping_hours)
+        self.pending_hold = timedelta(hours=pending_hold_hours)
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str]) -> "DueTimes":
+        return cls(
+            reminder_lead_hours=float(env.get('REMINDER_LEAD_HOURS', '24')),
+            admin_reping_hours=float(env.get('PENDING_REPING_HOURS', '12')),
+            pending_hold_hours=float(env.get('PENDING_HOLD_HOURS', '48')),
+        )
+
+    def for_appointment(self, date: str, time: str, held_since: datetime) -> dict:
+        """reminder_at for the client, admin_ping_at and expires_at while the request is pending"""
+        starts_at = appointment_start(date, time)
+        due = {}
+        if self.reminder_lead:
+            due["reminder_at"] = starts_at - self.reminder_lead
+        if self.admin_reping:
+            due["admin_ping_at"] = held_since + self.admin_reping
+        if self.pending_hold:
+            # Holding a slot past its start frees nothing
+            due["expires_at"] = min(held_since + self.pending_hold, starts_at)
+        return due
+
+
+class TransitionRejected(Exception):
+    """The appointment is missing (status None) or not in an allowed source state"""
+
+    def __init__(self, status: Optional[str]):
+        super().__init__(status)
+        self.status = status
+
+
+def transition_filter(action: str, appointment_id: str, extra_filter: Optional[dict] = None) -> dict:
+    sources, _, _ = TRANSITIONS[action]
+    return {**(extra_filter or {}), "id": appointment_id, "status": {"$in": sorted(sources)}}
+
+
+def transition_update(action: str, actor: str, extra_set: Optional[dict] = None) -> list:
+    """Pipeline update that sets the new status and records where it came from"""
+    _, target, release_slot = TRANSITIONS[action]
+    now = datetime.now(timezone.utc)
+    entry = {"from": "$status", "to": target, "action": action, "actor": actor, "at": now}
+    # Within one $set stage "$status" still refers to the value before the update
+    pipeline = [{"$set": {
+        **(extra_set or {}),
+        "status": target,
+        "updated_at": now,
+        "history": {"$concatArrays": [{"$ifNull": ["$history", []]}, [entry]]},
+    }}]
+    if release_slot:
+        pipeline.append({"$unset": ["slot_key", "user_slot_key"]})
+    return pipeline
+
+
+async def transition(collection, appointment_id: str, action: str, actor: str, extra_filter: Optional[dict] = None) -> dict:
+    """Apply a transition in one round trip and return the updated appointment"""
+    doc = await collection.find_one_and_update(
+        transition_filter(action, appointment_id, extra_filter),
+        transition_update(action, actor),
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if doc is not None:
+        return doc
+
+    # Only on the failure path: tell "not found" apart from "wrong state"
+    current = await collection.find_one({**(extra_filter or {}), "id": appointment_id}, {"_id": 0, "status": 1})
+    raise TransitionRejected(current.get("status") if current else None)
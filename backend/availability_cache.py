@@ -0,0 +1,64 @@
+"""In-process TTL + LRU cache of per-date slot capacity.
+
+Only the part of availability that depends on the database is cached: for
+each operator working that day, the bitmask of the slots they still have
+free. The 24-hour cutoff is applied on every read, so a cached day never goes
+stale just because time passes. Write handlers call ``invalidate(date)``
+after any change to an appointment on that date; the TTL only bounds
+staleness from writes made by other replicas.
+"""
+import itertools
+from datetime import date as Date
+from typing import Callable, Dict, Optional
+
+from ttl_cache import TTLCache
+
+
+class AvailabilityCache(TTLCache):
+    def __init__(self, max_size: int = 512, ttl_seconds: float = 30.0,
+                 today: Callable[[], str] = lambda: Date.today().isoformat(), **kwargs):
+        super().__init__("availability", max_size, ttl_seconds, **kwargs)
+        self.today = today
+        # Bumped by every invalidation; a load that started before one must not be stored.
+        # Values come from one counter, so no date's generation ever repeats an earlier one.
+        self._counter = itertools.count(1)
+        self._generations: Dict[str, int] = {}
+        # Generation of every date not in _generations
+        self._floor = 0
+        self._pruned_on: Optional[str] = None
+
+    def generation(self, date: str) -> int:
+        """Read before querying; pass to ``set`` so a concurrent write wins over the stale load"""
+        return self._generations.get(date, self._floor)
+
+    def set(self, date: str, free: Dict[str, int], generation: int):
+        if self.generation(date) != generation:
+            return
+        super().set(date, free)
+
+    def invalidate(self, *dates: str):
+        for date in dates:
+            super().invalidate(date)
+            self._generations[date] = next(self._counter)
+        self._prune()
+
+    def _prune(self):
+        """Once a day, forget the generations of past dates so the dict only holds dates still bookable.
+
+        Raising the floor past every pruned value keeps loads that read one
+        of them (or the old floor) from being stored.
+        """
+        today = self.today()
+        if today == self._pruned_on:
+            return
+        self._pruned_on = today
+        past = [d for d in self._generations if d < today]
+        if past:
+            for d in past:
+                del self._generations[d]
+            self._floor = next(self._counter)
+
+    def clear(self):
+        super().clear()
+        self._generations.clear()
+        self._floor = next(self._counter)
@@ -0,0 +1,110 @@
+"""MongoDB client lifecycle.
+
+``Database`` is created at import time but only connects in ``connect()``,
+which the app lifespan (and the migrations CLI) awaits before serving: it
+opens the Motor client with the configured pool, pings the server and warms
+``minPoolSize`` connections so the first requests don't pay for handshakes.
+Once connected, collections are reached as attributes (``db.users``) exactly
+like on a Motor database.
+"""
+import asyncio
+import logging
+import time
+from typing import Mapping, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+logger = logging.getLogger(__name__)
+
+# env var -> (client option, parser, default); options without a default are left to the driver
+CLIENT_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": ("maxPoolSize", int, 50),
+    "MONGO_MIN_POOL_SIZE": ("minPoolSize", int, 5),
+    "MONGO_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int, 300000),
+    "MONGO_CONNECT_TIMEOUT_MS": ("connectTimeoutMS", int, 5000),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int, 5000),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int, 5000),
+    "MONGO_SOCKET_TIMEOUT_MS": ("socketTimeoutMS", int, None),
+    "MONGO_WRITE_CONCERN": ("w", lambda v: int(v) if v.isdigit() else v, None),
+    "MONGO_READ_CONCERN": ("readConcernLevel", str, None),
+    "MONGO_READ_PREFERENCE": ("readPreference", str, None),
+}
+
+
+class DatabaseNotConnected(RuntimeError):
+    pass
+
+
+class Database:
+    def __init__(self, url: Optional[str], name: Optional[str], **client_options):
+        self.url = url
+        self.name = name
+        self.client_options = client_options
+        self.client: Optional[AsyncIOMotorClient] = None
+        self._database = None
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str], **client_options) -> "Database":
+        options = {}
+        for var, (option, parse, default) in CLIENT_OPTIONS.items():
+            value = env.get(var)
+            if value:
+                options[option] = parse(value)
+            elif default is not None:
+                options[option] = default
+        options.update(client_options)
+        return cls(env.get('MONGO_URL'), env.get('DB_NAME'), **options)
+
+    @property
+    def connected(self) -> bool:
+        return self._database is not None
+
+    def __getattr__(self, collection: str):
+        # Only reached for names that are not attributes of Database itself
+        if collection.startswith("_"):
+            raise AttributeError(collection)
+        return self[collection]
+
+    def __getitem__(self, collection: str):
+        if self._database is None:
+            raise DatabaseNotConnected(f"Database not connected (accessing '{collection}')")
+        return self._database[collection]
+
+    async def connect(self):
+        """Open the client, check the server answers and warm the connection pool"""
+        if not self.url or not self.name:
+            raise DatabaseNotConnected("MONGO_URL and DB_NAME must be set")
+        start = time.perf_counter()
+        self.client = AsyncIOMotorClient(self.url, **self.client_options)
+        try:
+            await self.client.admin.command("ping")
+            # Concurrent pings each need their own connection, so this opens minPoolSize of them
+            warm = self.client_options.get("minPoolSize", 0)
+            if warm > 1:
+                await asyncio.gather(*(self.client.admin.command("ping") for _ in range(warm)))
+        except Exception:
+            self.client.close()
+            self.client = None
+            raise
+        self._database = self.client[self.name]
+        logger.info(
+            f"Connected to MongoDB database '{self.name}' "
+            f"(pool {warm}-{self.client_options.get('maxPoolSize', 100)}) in {time.perf_counter() - start:.2f}s"
+        )
+
+    async def ping(self, timeout: float = 2.0) -> bool:
+        """True if the server answered within ``timeout``; used by the readiness probe"""
+        if self.client is None:
+            return False
+        try:
+            await asyncio.wait_for(self.client.admin.command("ping"), timeout)
+            return True
+        except Exception as e:
+            logger.warning(f"MongoDB ping failed: {e}")
+            return False
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        self.client = None
+        self._database = None
@@ -0,0 +1,225 @@
+"""Background email dispatch: a MongoDB outbox drained by a pool of asyncio workers.
+
+Request handlers only insert a document into the outbox; delivery to Resend
+happens out of band, over a shared keep-alive HTTP client, with retries and
+exponential backoff.
+"""
+import asyncio
+import logging
+import random
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import List, Optional
+
+import httpx
+from pymongo import ReturnDocument
+
+from metrics import EMAIL_DISPATCH_SECONDS, EMAIL_DISPATCH_TOTAL
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = "pending"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+
+class EmailOutbox:
+    """Persistent email queue with an asyncio worker pool"""
+
+    def __init__(
+        self,
+        collection,
+        api_url: str,
+        api_key: str,
+        from_email: str,
+        workers: int = 4,
+        max_attempts: int = 6,
+        base_backoff: float = 2.0,
+        max_backoff: float = 600.0,
+        poll_interval: float = 5.0,
+        lease_seconds: int = 60,
+        timeout: float = 10.0,
+    ):
+        self.collection = collection
+        self.api_url = api_url
+        self.api_key = api_key
+        self.from_email = from_email
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+
+    # ---------------------
+    # Producer side
+    # ---------------------
+
+    def _build_message(self, to_email: str, subject: str, html_content: str, text_content: Optional[str] = None) -> dict:
+        now = datetime.now(timezone.utc)
+        return {
+            "id": str(uuid.uuid4()),
+            "to": to_email,
+            "subject": subject,
+            "html": html_content,
+            "text": text_content,
+            "status": STATUS_PENDING,
+            "attempts": 0,
+            "next_attempt_at": now,
+            "lease_expires_at": None,
+            "last_error": None,
+            "created_at": now,
+            "sent_at": None,
+        }
+
+    async def enqueue(self, to_email: str, subject: str, html_content: str, text_content: Optional[str] = None) -> str:
+        """Store an email in the outbox and wake up a worker"""
+        doc = self._build_message(to_email, subject, html_content, text_content)
+        await self.collection.insert_one(doc)
+        self._wakeup.set()
+        return doc["id"]
+
+    async def enqueue_many(self, messages: List[dict]) -> List[str]:
+        """Store several emails with one insert_many; each message holds enqueue()'s arguments"""
+        if not messages:
+            return []
+        docs = [self._build_message(**message) for message in messages]
+        await self.collection.insert_many(docs, ordered=False)
+        self._wakeup.set()
+        return [doc["id"] for doc in docs]
+
+    # ---------------------
+    # Worker pool
+    # ---------------------
+
+    async def start(self):
+        """Open the shared HTTP client and spawn the workers"""
+        if self._tasks:
+            return
+        self._stopping.clear()
+        self._client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.workers, max_keepalive_connections=self.workers),
+            headers={"Authorization": f"Bearer {self.api_key}"},
+        )
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        logger.info(f"Email outbox started with {self.workers} workers -> {self.api_url}")
+
+    async def stop(self, grace_seconds: float = 10.0):
+        """Let in-flight deliveries finish, then cancel idle workers and close the client"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=grace_seconds)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _claim(self) -> Optional[dict]:
+        """Atomically lease the next due message (or one whose lease has expired)"""
+        now = datetime.now(timezone.utc)
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": STATUS_PENDING, "next_attempt_at": {"$lte": now}},
+                {"status": STATUS_SENDING, "lease_expires_at": {"$lte": now}},
+            ]},
+            {
+                "$set": {"status": STATUS_SENDING, "lease_expires_at": now + timedelta(seconds=self.lease_seconds)},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("next_attempt_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _worker(self, n: int):
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            try:
+                job = await self._claim()
+            except Exception as e:
+                logger.error(f"Email worker {n}: failed to claim message: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._deliver(job)
+            except Exception as e:
+                # The lease will expire and the message will be retried
+                logger.error(f"Email worker {n}: unexpected error delivering {job['id']}: {e}")
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.max_backoff, self.base_backoff * (2 ** max(attempts - 1, 0)))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _deliver(self, job: dict):
+        payload = {
+            "from": self.from_email,
+            "to": [job["to"]],
+            "subject": job["subject"],
+            "html": job["html"],
+        }
+        if job.get("text"):
+            payload["text"] = job["text"]
+
+        retryable = True
+        start = time.perf_counter()
+        try:
+            response = await self._client.post(self.api_url, json=payload)
+            if response.status_code in [200, 202]:
+                EMAIL_DISPATCH_SECONDS.observe(time.perf_counter() - start, outcome="sent")
+                EMAIL_DISPATCH_TOTAL.inc(outcome="sent")
+                logger.info(f"Email sent to {job['to']}")
+                # The bodies are only needed to send; sent records expire through a TTL index on sent_at
+                await self.collection.update_one(
+                    {"id": job["id"]},
+                    {"$set": {
+                        "status": STATUS_SENT,
+                        "sent_at": datetime.now(timezone.utc),
+                        "lease_expires_at": None,
+                        "last_error": None,
+                    }, "$unset": {"html": "", "text": ""}}
+                )
+                return
+            error = f"{response.status_code} - {response.text}"
+            # 4xx means the message itself is wrong; only 429 is worth retrying
+            retryable = response.status_code == 429 or response.status_code >= 500
+        except httpx.HTTPError as e:
+            error = f"{type(e).__name__}: {e}"
+        EMAIL_DISPATCH_SECONDS.observe(time.perf_counter() - start, outcome="error")
+
+        attempts = job.get("attempts", 1)
+        final = not retryable or attempts >= self.max_attempts
+        EMAIL_DISPATCH_TOTAL.inc(outcome="failed" if final else "retry")
+        if final:
+            logger.error(f"Failed to send email to {job['to']} after {attempts} attempts: {error}")
+            update = {"status": STATUS_FAILED, "lease_expires_at": None, "last_error": error}
+        else:
+            delay = self._backoff(attempts)
+            logger.warning(f"Email to {job['to']} failed ({error}), retrying in {delay:.1f}s")
+            update = {
+                "status": STATUS_PENDING,
+                "next_attempt_at": datetime.now(timezone.utc) + timedelta(seconds=delay),
+                "lease_expires_at": None,
+                "last_error": error,
+            }
+        try:
+            await self.collection.update_one({"id": job["id"]}, {"$set": update})
+        except Exception as e:
+            # The lease will expire and another worker will pick the message up again
+            logger.error(f"Email worker: failed to record delivery result for {job['id']}: {e}")
@@ -0,0 +1,155 @@
+"""Idempotency-Key support for retried POSTs.
+
+The first request with a key inserts an ``in_progress`` record (the key is
+the ``_id``, so the insert itself decides who runs the handler), runs the
+handler and stores the response on the record. A retry with the same key
+costs one lookup by ``_id`` and gets the stored response back without
+running anything. A duplicate that arrives while the first request is still
+running waits for its result: on the same replica through a shared future,
+on another one by polling the record. Records expire through a TTL index on
+``expires_at``.
+
+Client errors (4xx) are stored and replayed like successes; anything else
+removes the record so the retry runs the handler again.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+IN_PROGRESS = "in_progress"
+DONE = "done"
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a request with a different body"""
+
+
+class IdempotencyInProgress(Exception):
+    """The first request with this key is still running elsewhere"""
+
+
+class StoredResponse(NamedTuple):
+    status_code: int
+    body: Any
+
+
+class IdempotencyStore:
+    def __init__(
+        self,
+        collection,
+        ttl_seconds: float = 86400.0,
+        lock_seconds: float = 30.0,
+        wait_seconds: float = 10.0,
+        poll_interval: float = 0.1,
+    ):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        # An in_progress record older than this belongs to a crashed request and may be taken over
+        self.lock_seconds = lock_seconds
+        self.wait_seconds = wait_seconds
+        self.poll_interval = poll_interval
+        # key -> (fingerprint, future) of the requests this process is running
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+    async def execute(
+        self, key: str, fingerprint: str, handler: Callable[[], Awaitable[Any]]
+    ) -> Tuple[StoredResponse, bool]:
+        """The response for ``key`` and whether it is a replay; runs ``handler`` at most once per key"""
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            if inflight[0] != fingerprint:
+                raise IdempotencyConflict(key)
+            return await asyncio.shield(inflight[1]), True
+
+        deadline = asyncio.get_running_loop().time() + self.wait_seconds
+        while True:
+            record = await self.collection.find_one({"_id": key})
+            if record is None:
+                if await self._lock(key, fingerprint):
+                    return await self._run(key, fingerprint, handler), False
+                continue
+            if record["fingerprint"] != fingerprint:
+                raise IdempotencyConflict(key)
+            if record["status"] == DONE:
+                return StoredResponse(record["status_code"], record["body"]), True
+            if record["locked_until"] <= datetime.now(timezone.utc) and await self._take_over(key, record):
+                return await self._run(key, fingerprint, handler), False
+            if asyncio.get_running_loop().time() >= deadline:
+                raise IdempotencyInProgress(key)
+            await asyncio.sleep(self.poll_interval)
+
+    async def _lock(self, key: str, fingerprint: str) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.insert_one({
+                "_id": key,
+                "fingerprint": fingerprint,
+                "status": IN_PROGRESS,
+                "locked_until": now + timedelta(seconds=self.lock_seconds),
+                "created_at": now,
+                "expires_at": now + timedelta(seconds=self.ttl_seconds),
+            })
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def _take_over(self, key: str, record: dict) -> bool:
+        now = datetime.now(timezone.utc)
+        result = await self.collection.update_one(
+            {"_id": key, "status": IN_PROGRESS, "locked_until": record["locked_until"]},
+            {"$set": {"locked_until": now + timedelta(seconds=self.lock_seconds)}},
+        )
+        if result.modified_count:
+            logger.warning(f"Taking over idempotency key {key} from a request that never finished")
+        return bool(result.modified_count)
+
+    async def _run(self, key: str, fingerprint: str, handler: Callable[[], Awaitable[Any]]) -> StoredResponse:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (fingerprint, future)
+        try:
+            try:
+                response = StoredResponse(200, jsonable_encoder(await handler()))
+            except HTTPException as e:
+                if e.status_code >= 500:
+                    raise
+                response = StoredResponse(e.status_code, {"detail": e.detail})
+                await self._store(key, response)
+                future.set_result(response)
+                raise
+            await self._store(key, response)
+            future.set_result(response)
+            return response
+        except Exception as e:
+            if not future.done():
+                # Not stored: let the next retry run the handler again
+                await self._release(key)
+                future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            if not future.done():
+                # Cancelled mid-handler: same as a failure, without an exception to hand on
+                future.cancel()
+                await self._release(key)
+            elif not future.cancelled():
+                # Waiters retrieve the outcome; don't warn about an exception nobody awaited
+                future.exception()
+
+    async def _store(self, key: str, response: StoredResponse):
+        await self.collection.update_one(
+            {"_id": key},
+            {"$set": {"status": DONE, "status_code": response.status_code, "body": response.body}},
+        )
+
+    async def _release(self, key: str):
+        try:
+            await self.collection.delete_one({"_id": key, "status": IN_PROGRESS})
+        except Exception as e:
+            logger.error(f"Failed to release idempotency key {key}: {e}")
@@ -0,0 +1,532 @@
+"""Load generator and benchmark for the booking API.
+
+Pure asyncio + httpx: ``--concurrency`` virtual users run one scenario in a
+loop for ``--duration`` seconds and every request is timed per operation.
+The summary (RPS, p50/p95/p99, error rate and mean response size per
+operation, the server's event loop lag during the run, plus the git commit)
+is written as JSON so runs can be compared between commits::
+
+    python loadtest.py calendar-browse --start-server --output before.json
+    python loadtest.py calendar-browse --start-server --compare before.json
+
+With ``--start-server`` the API is launched under uvicorn against
+``--mongo-url``/``--db-name`` (a local mongod and a throwaway database), with
+rate limiting off and emails sent to a stub Resend server run by this
+process, so no real email leaves the machine. Without it, point
+``--base-url`` at a running server whose RESEND_API_URL points at
+``--stub-resend-port`` and whose rate limits are off or generous.
+admin-review grants its admin account with ``admin_users.py``, so there
+``--mongo-url``/``--db-name`` must name the server's database either way.
+
+Scenarios:
+  calendar-browse  month availability, single days, /auth/me and /appointments/my
+  booking-rush     every user races for the same few free slots
+  login-storm      repeated logins (bcrypt bound; watch event_loop_lag for stalls)
+  admin-review     an admin lists pending appointments and reviews them in batches
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger("loadtest")
+
+ROOT_DIR = Path(__file__).parent
+PASSWORD = "bench-password"
+ADMIN_USERNAME = "bench_admin"
+
+
+# ---------------------
+# Measurements
+# ---------------------
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(q / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.rejected: Dict[str, int] = {}
+        self.response_bytes: Dict[str, int] = {}
+
+    def record(self, operation: str, seconds: float, ok: bool, rejected: bool = False):
+        """``rejected`` marks expected refusals (a slot already taken), counted apart from errors"""
+        self.latencies.setdefault(operation, []).append(seconds)
+        if rejected:
+            self.rejected[operation] = self.rejected.get(operation, 0) + 1
+        elif not ok:
+            self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    async def request(self, client: httpx.AsyncClient, operation: str, method: str, url: str,
+                      expected_rejections=(), **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.record(operation, time.perf_counter() - start, ok=False)
+            return None
+        # Body size per operation; the API sends uncompressed JSON
+        self.response_bytes[operation] = self.response_bytes.get(operation, 0) + len(response.content)
+        self.record(
+            operation, time.perf_counter() - start,
+            ok=response.status_code < 400,
+            rejected=response.status_code in expected_rejections,
+        )
+        return response
+
+    def summary(self, elapsed: float) -> dict:
+        operations = {}
+        for operation, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            errors = self.errors.get(operation, 0)
+            operations[operation] = {
+                "count": len(values),
+                "errors": errors,
+                "rejected": self.rejected.get(operation, 0),
+                "error_rate": round(errors / len(values), 4),
+                "rps": round(len(values) / elapsed, 2),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2),
+                "mean_bytes": round(self.response_bytes.get(operation, 0) / len(values)),
+            }
+        total = sum(op["count"] for op in operations.values())
+        total_errors = sum(op["errors"] for op in operations.values())
+        return {
+            "operations": operations,
+            "total": {
+                "count": total,
+                "errors": total_errors,
+                "error_rate": round(total_errors / total, 4) if total else 0.0,
+                "rps": round(total / elapsed, 2),
+            },
+        }
+
+
+# The server samples how late its event loop wakes up (metrics.monitor_event_loop_lag)
+LOOP_LAG_METRIC = "event_loop_lag_seconds"
+HISTOGRAM_LINE = re.compile(r'^(\w+?)_(bucket\{le="([^"]+)"\}|sum|count) (\S+)$')
+
+
+async def scrape_histogram(client: httpx.AsyncClient, name: str) -> dict:
+    """Cumulative bucket counts ({upper bound: count}) and sum of an unlabelled histogram on /metrics"""
+    response = await client.get("/metrics")
+    response.raise_for_status()
+    histogram = {"buckets": {}, "sum": 0.0}
+    for line in response.text.splitlines():
+        match = HISTOGRAM_LINE.match(line)
+        if not match or match.group(1) != name:
+            continue
+        if match.group(3) is not None:
+            histogram["buckets"][float(match.group(3))] = int(float(match.group(4)))
+        elif match.group(2) == "sum":
+            histogram["sum"] = float(match.group(4))
+    return histogram
+
+
+def histogram_delta(before: dict, after: dict) -> dict:
+    """What was observed between two scrapes; quantiles are bucket upper bounds (None: above the last one)"""
+    counts = {le: after["buckets"][le] - before["buckets"].get(le, 0) for le in sorted(after["buckets"])}
+    count = counts.get(float("inf"), 0)
+    if not count:
+        return {"count": 0}
+
+    def bound_ms(q: float) -> Optional[float]:
+        # Upper bound of the first bucket holding the observation of rank q * count
+        le = next(le for le, c in counts.items() if c >= q * count)
+        return None if le == float("inf") else le * 1000
+
+    return {
+        "count": count,
+        "mean_ms": round((after["sum"] - before["sum"]) / count * 1000, 3),
+        "p50_le_ms": bound_ms(0.50),
+        "p99_le_ms": bound_ms(0.99),
+        "max_le_ms": bound_ms(1.0),
+    }
+
+
+# ---------------------
+# Stub Resend
+# ---------------------
+
+class StubResend:
+    """Minimal HTTP/1.1 server accepting every POST like Resend's /emails"""
+
+    def __init__(self, port: int, latency: float = 0.0):
+        self.port = port
+        self.latency = latency
+        self.received = 0
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/emails"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n")[1:]:
+                    name, _, value = line.partition(b":")
+                    if name.strip().lower() == b"content-length":
+                        length = int(value)
+                if length:
+                    await reader.readexactly(length)
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                self.received += 1
+                body = json.dumps({"id": str(uuid.uuid4())}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+# ---------------------
+# Users and fixtures
+# ---------------------
+
+def user_payload(username: str) -> dict:
+    return {
+        "first_name": "Bench",
+        "last_name": username,
+        "email": f"{username}@bench.invalid",
+        "agency_name": f"Agenzia {username}",
+        "agency_address": "Via del Benchmark 1, Roma",
+        "partita_iva": "01234567890",
+        "sede_legale": "Via del Benchmark 1, Roma",
+        "codice_univoco": "ABC1234",
+        "username": username,
+        "password": PASSWORD,
+    }
+
+
+def booking_payload(day: str, slot: str) -> dict:
+    return {
+        "date": day,
+        "time": slot,
+        "appointment_address": "Via del Benchmark 2, Roma",
+        "contact_person": "Referente Bench",
+        "contact_phone": "0600000000",
+    }
+
+
+async def login(client: httpx.AsyncClient, username: str) -> dict:
+    """Register the user if needed and return auth headers"""
+    response = await client.post("/api/auth/login", json={"username": username, "password": PASSWORD})
+    if response.status_code == 401:
+        (await client.post("/api/auth/register", json=user_payload(username))).raise_for_status()
+        response = await client.post("/api/auth/login", json={"username": username, "password": PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def free_slots(client: httpx.AsyncClient, headers: dict, days: int = 60) -> List[tuple]:
+    """(date, time) of every free slot from the day after tomorrow, in calendar order"""
+    start = date.today() + timedelta(days=2)
+    end = start + timedelta(days=days - 1)
+    response = await client.get(
+        "/api/appointments/availability",
+        params={"from": start.isoformat(), "to": end.isoformat()}, headers=headers,
+    )
+    response.raise_for_status()
+    return [(d["date"], s["time"]) for d in response.json()["days"] for s in d["slots"] if s["available"]]
+
+
+# ---------------------
+# Scenarios
+# ---------------------
+
+async def calendar_browse(client, recorder, user, state):
+    today = date.today()
+    await recorder.request(
+        client, "availability_month", "GET", "/api/appointments/availability",
+        params={"from": today.isoformat(), "to": (today + timedelta(days=30)).isoformat()},
+        headers=user["headers"],
+    )
+    day = today + timedelta(days=random.randint(1, 30))
+    await recorder.request(
+        client, "availability_day", "GET", f"/api/appointments/availability/{day.isoformat()}",
+        headers=user["headers"],
+    )
+    await recorder.request(client, "auth_me", "GET", "/api/auth/me", headers=user["headers"])
+    await recorder.request(client, "my_appointments", "GET", "/api/appointments/my", headers=user["headers"])
+
+
+async def booking_rush(client, recorder, user, state):
+    # Everyone goes for the same handful of slots; each slot takes one booking per operator
+    if not state["slots"]:
+        await asyncio.sleep(0.1)
+        return
+    day, slot = random.choice(state["slots"][:state["rush_width"]])
+    response = await recorder.request(
+        client, "book", "POST", "/api/appointments",
+        json=booking_payload(day, slot), headers=user["headers"], expected_rejections=(400,),
+    )
+    if response is not None and response.status_code == 200:
+        state["booked"] += 1
+        if (day, slot) in state["slots"]:
+            state["slots"].remove((day, slot))
+
+
+async def login_storm(client, recorder, user, state):
+    await recorder.request(
+        client, "login", "POST", "/api/auth/login",
+        json={"username": user["username"], "password": PASSWORD},
+    )
+
+
+async def admin_review(client, recorder, user, state):
+    admin = state["admin_headers"]
+    response = await recorder.request(
+        client, "admin_list", "GET", "/api/admin/appointments", params={"limit": 50}, headers=admin,
+    )
+    if response is None or response.status_code != 200:
+        return
+    ids = [apt["id"] for apt in response.json()]
+    if not ids:
+        await asyncio.sleep(0.1)
+        return
+    # Concurrent reviewers overlap on purpose: items handled by another one come back as already_handled
+    half = len(ids) // 2
+    await recorder.request(
+        client, "admin_review", "POST", "/api/admin/appointments/review",
+        json={"confirm": ids[:half], "reject": ids[half:]}, headers=admin,
+    )
+
+
+async def seed_pending(client: httpx.AsyncClient, users: List[dict], count: int) -> int:
+    """Book up to ``count`` appointments, one day per user so same-day bookings stay consecutive"""
+    slots = await free_slots(client, users[0]["headers"])
+    days = sorted({d for d, _ in slots})
+    owner = {day: users[i % len(users)] for i, day in enumerate(days)}
+    semaphore = asyncio.Semaphore(16)
+    booked = 0
+
+    async def book_day(day: str, times: List[str]):
+        nonlocal booked
+        async with semaphore:
+            for slot in times:
+                if booked >= count:
+                    return
+                response = await client.post(
+                    "/api/appointments", json=booking_payload(day, slot), headers=owner[day]["headers"]
+                )
+                if response.status_code == 200:
+                    booked += 1
+
+    await asyncio.gather(*(book_day(day, [t for d, t in slots if d == day]) for day in days))
+    return booked
+
+
+SCENARIOS = {
+    "calendar-browse": calendar_browse,
+    "booking-rush": booking_rush,
+    "login-storm": login_storm,
+    "admin-review": admin_review,
+}
+
+
+# ---------------------
+# Runner
+# ---------------------
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health/ready")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("Server did not become ready")
+
+
+def start_server(args, resend_url: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "MONGO_URL": args.mongo_url,
+        "DB_NAME": args.db_name,
+        "RESEND_API_URL": resend_url,
+        "RESEND_API_KEY": "bench",
+        "RATE_LIMIT_ENABLED": "false",
+    }
+    port = args.base_url.rsplit(":", 1)[-1].strip("/")
+    command = [sys.executable, "-m", "uvicorn", "server:app", "--port", port, "--workers", str(args.server_workers)]
+    return subprocess.Popen(command, cwd=ROOT_DIR, env=env)
+
+
+def grant_admin(args, username: str):
+    """Give the account admin access the way an operator would, straight in the database"""
+    env = {**os.environ, "MONGO_URL": args.mongo_url, "DB_NAME": args.db_name}
+    subprocess.run([sys.executable, "admin_users.py", "grant", username], cwd=ROOT_DIR, env=env, check=True)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    stub = StubResend(args.stub_resend_port or 8025, latency=args.resend_latency_ms / 1000)
+    server = None
+    if args.start_server or args.stub_resend_port:
+        await stub.start()
+    if args.start_server:
+        server = start_server(args, stub.url)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30.0) as client:
+            await wait_until_ready(client)
+
+            users = []
+            for i in range(min(args.users, args.concurrency)):
+                username = f"bench_user_{i:04d}"
+                users.append({"username": username, "headers": await login(client, username)})
+
+            state = {"booked": 0}
+            if args.scenario == "booking-rush":
+                state["slots"] = await free_slots(client, users[0]["headers"])
+                state["rush_width"] = args.rush_width
+            elif args.scenario == "admin-review":
+                state["admin_headers"] = await login(client, ADMIN_USERNAME)
+                grant_admin(args, ADMIN_USERNAME)
+                seeded = await seed_pending(client, users, args.seed)
+                logger.info(f"Seeded {seeded} pending appointments")
+
+            recorder = Recorder()
+            step = SCENARIOS[args.scenario]
+            deadline = time.monotonic() + args.duration
+
+            async def virtual_user(n: int):
+                user = users[n % len(users)]
+                while time.monotonic() < deadline:
+                    await step(client, recorder, user, state)
+
+            logger.info(f"Running {args.scenario}: {args.concurrency} users for {args.duration}s")
+            # With several server workers /metrics answers from one of them, so this samples that worker
+            lag_before = await scrape_histogram(client, LOOP_LAG_METRIC)
+            started_at = datetime.now(timezone.utc)
+            start = time.perf_counter()
+            await asyncio.gather(*(virtual_user(n) for n in range(args.concurrency)))
+            elapsed = time.perf_counter() - start
+            loop_lag = histogram_delta(lag_before, await scrape_histogram(client, LOOP_LAG_METRIC))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        await stub.stop()
+
+    return {
+        "scenario": args.scenario,
+        "commit": git_commit(),
+        "started_at": started_at.isoformat(),
+        "duration_seconds": round(elapsed, 2),
+        "concurrency": args.concurrency,
+        "emails_received": stub.received,
+        **({"booked": state["booked"]} if args.scenario == "booking-rush" else {}),
+        **recorder.summary(elapsed),
+        "event_loop_lag": loop_lag,
+    }
+
+
+def compare(result: dict, baseline: dict) -> List[str]:
+    """One line per operation: RPS and p95 relative to the baseline run"""
+    lines = [f"vs {baseline.get('commit') or 'baseline'} ({baseline.get('scenario')})"]
+    for operation, current in result["operations"].items():
+        before = baseline.get("operations", {}).get(operation)
+        if not before:
+            lines.append(f"  {operation}: new")
+            continue
+
+        def change(key):
+            return f"{(current[key] - before[key]) / before[key] * 100:+.1f}%" if before[key] else "n/a"
+
+        lines.append(
+            f"  {operation}: rps {before['rps']} -> {current['rps']} ({change('rps')}), "
+            f"p95 {before['p95_ms']}ms -> {current['p95_ms']}ms ({change('p95_ms')}), "
+            f"errors {before['error_rate']:.2%} -> {current['error_rate']:.2%}"
+            + (f", bytes {before['mean_bytes']} -> {current['mean_bytes']}" if 'mean_bytes' in before else "")
+        )
+    lag, lag_before = result.get("event_loop_lag", {}), baseline.get("event_loop_lag", {})
+    if lag.get("count") and lag_before.get("count"):
+        lines.append(
+            f"  event loop lag: mean {lag_before['mean_ms']}ms -> {lag['mean_ms']}ms, "
+            f"p99 <= {lag_before['p99_le_ms']}ms -> <= {lag['p99_le_ms']}ms"
+        )
+    return lines
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the Spaziopratiche booking API")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--base-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users")
+    parser.add_argument("--users", type=int, default=20, help="distinct accounts shared by the virtual users")
+    parser.add_argument("--rush-width", type=int, default=5, help="booking-rush: slots contended at once")
+    parser.add_argument("--seed", type=int, default=500, help="admin-review: pending appointments to create")
+    parser.add_argument("--start-server", action="store_true", help="launch uvicorn with benchmark settings")
+    parser.add_argument("--server-workers", type=int, default=1)
+    parser.add_argument("--mongo-url", default="mongodb://127.0.0.1:27017")
+    parser.add_argument("--db-name", default="spaziopratiche_bench")
+    parser.add_argument("--stub-resend-port", type=int, help="run the stub Resend here (default 8025 with --start-server)")
+    parser.add_argument("--resend-latency-ms", type=float, default=50.0, help="stub Resend response delay")
+    parser.add_argument("--output", help="write the JSON summary here instead of stdout")
+    parser.add_argument("--compare", help="JSON summary of a previous run to compare against")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    result = asyncio.run(run(args))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2) + "\n")
+    else:
+        print(json.dumps(result, indent=2))
+    if args.compare:
+        for line in compare(result, json.loads(Path(args.compare).read_text())):
+            print(line, file=sys.stderr)
+    return 1 if result["total"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""Minimal in-process metrics with Prometheus text exposition.
+
+Counters, gauges and histograms are plain Python objects guarded by a lock,
+because PyMongo command listeners and the bcrypt pool report from worker
+threads. Recording is a dict lookup plus a few additions, which keeps it
+cheap enough to leave on in production. ``render()`` produces the body
+served at ``/metrics``.
+"""
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts (last one is +Inf), sum]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, (list(counts), total)) for k, (counts, total) in self._values.items()]
+        lines = self.header()
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames + ("le",), key + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# ---------------------
+# Application metrics
+# ---------------------
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status")
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served", ("method",))
+MONGO_COMMAND_SECONDS = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ("collection", "command"),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+MONGO_COMMAND_FAILURES = Counter("mongodb_command_failures_total", "Failed MongoDB commands", ("collection", "command"))
+EMAIL_DISPATCH_SECONDS = Histogram("email_dispatch_duration_seconds", "Resend API call latency", ("outcome",))
+EMAIL_DISPATCH_TOTAL = Counter("email_dispatch_total", "Email delivery attempts by outcome", ("outcome",))
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_duration_seconds", "bcrypt time per operation, excluding queueing", ("operation",)
+)
+PASSWORD_HASH_REJECTED = Counter("password_hash_rejected_total", "Password operations refused because the pool was full")
+RATE_LIMITED_TOTAL = Counter("rate_limited_total", "Requests refused by a rate limit", ("policy",))
+SCHEDULER_IS_LEADER = Gauge("scheduler_is_leader", "1 while this process holds the job scheduler lease")
+SCHEDULER_JOB_SECONDS = Histogram("scheduler_job_duration_seconds", "Scheduled job run time", ("job", "outcome"))
+SCHEDULER_JOB_ITEMS = Counter("scheduler_job_items_total", "Items handled by scheduled jobs", ("job",))
+CACHE_LOOKUPS = Counter("cache_lookups_total", "In-process cache lookups by result (hit or miss)", ("cache", "result"))
+CACHE_EVICTIONS = Counter("cache_evictions_total", "Entries evicted from an in-process cache to stay in size", ("cache",))
+CACHE_ENTRIES = Gauge("cache_entries", "Entries held by an in-process cache, expired ones included", ("cache",))
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds", "Delay of the event loop in running a scheduled callback",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and in-flight requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(method=method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec(method=method)
+            # The router stores the matched route in the scope; label by template, not raw path
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=method,
+                route=getattr(route, "path", "unmatched"),
+                status=str(status["code"]),
+            )
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times every MongoDB command by collection and command name"""
+
+    def __init__(self):
+        self._collections: Dict[int, str] = {}
+
+    def started(self, event):
+        # getMore names its collection separately; the command value is the cursor id
+        target = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        self._collections[event.request_id] = target if isinstance(target, str) else event.database_name
+
+    def succeeded(self, event):
+        collection = self._collections.pop(event.request_id, "")
+        MONGO_COMMAND_SECONDS.observe(
+            event.duration_micros / 1e6, collection=collection, command=event.command_name
+        )
+
+    def failed(self, event):
+        collection = self._collections.pop(event.request_id, "")
+        MONGO_COMMAND_SECONDS.observe(
+            event.duration_micros / 1e6, collection=collection, command=event.command_name
+        )
+        MONGO_COMMAND_FAILURES.inc(collection=collection, command=event.command_name)
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """Sleep for ``interval`` repeatedly and record how late each wake-up is"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - interval))
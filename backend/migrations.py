@@ -0,0 +1,466 @@
+"""MongoDB index bootstrap and schema migrations.
+
+Migrations are applied in version order and recorded in the
+``schema_migrations`` collection, so running them again is a no-op.
+They run at application startup and can also be run by hand:
+
+    python migrations.py            # apply pending migrations
+    python migrations.py --dry-run  # list what would be applied
+    python migrations.py --check    # explain hot queries, fail on collection scans
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from appointment_states import DueTimes
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_COLLECTION = "schema_migrations"
+
+# How long sent emails stay in the outbox; read when migration 12 creates the TTL
+# index, so changing it afterwards needs a collMod on email_outbox_sent_at_ttl
+EMAIL_OUTBOX_RETENTION_DAYS = float(os.environ.get('EMAIL_OUTBOX_RETENTION_DAYS', '30'))
+
+
+async def dedupe_users(db):
+    """Set aside accounts that would break the unique username and email indexes.
+
+    Registration used to check before inserting, so two concurrent sign-ups
+    could share a username or an email. For each such value the verified
+    (then the oldest) account stays; the others move to ``users_duplicates``
+    with the id of the account kept, to be merged or restored by hand.
+    """
+    moved = 0
+    for field in ("username", "email"):
+        groups = db.users.aggregate([
+            {"$group": {
+                "_id": f"${field}",
+                "accounts": {"$push": {"_id": "$_id", "id": "$id", "is_verified": "$is_verified"}},
+                "count": {"$sum": 1},
+            }},
+            {"$match": {"count": {"$gt": 1}}},
+        ])
+        async for group in groups:
+            kept, *duplicates = sorted(group["accounts"], key=lambda u: (not u.get("is_verified"), u["_id"]))
+            for account in duplicates:
+                doc = await db.users.find_one({"_id": account["_id"]})
+                if doc is None:
+                    continue
+                logger.warning(
+                    f"User {doc.get('id')} repeats {field} {group['_id']!r} of user {kept.get('id')}; "
+                    "moving it to users_duplicates"
+                )
+                # Replace rather than insert, in case an interrupted run already copied it
+                await db.users_duplicates.replace_one(
+                    {"_id": doc["_id"]},
+                    {**doc, "duplicate_of": kept.get("id"), "duplicate_field": field,
+                     "set_aside_at": datetime.now(timezone.utc)},
+                    upsert=True,
+                )
+                await db.users.delete_one({"_id": doc["_id"]})
+                moved += 1
+    logger.info(f"Moved {moved} duplicate users to users_duplicates")
+
+
+async def backfill_slot_keys(db):
+    """Give every non-cancelled appointment the slot key that new bookings claim.
+
+    If legacy data already double-books a slot, only the oldest booking gets the key.
+    """
+    seen = set()
+    updates = []
+    cursor = db.appointments.find(
+        {"status": {"$ne": "cancelled"}, "slot_key": {"$exists": False}},
+        {"_id": 0, "id": 1, "date": 1, "time": 1}
+    ).sort("created_at", ASCENDING)
+    async for apt in cursor:
+        key = f"{apt['date']}|{apt['time']}"
+        if key in seen:
+            logger.warning(f"Appointment {apt['id']} double-books slot {key}; leaving it unclaimed")
+            continue
+        seen.add(key)
+        updates.append(UpdateOne({"id": apt["id"]}, {"$set": {"slot_key": key}}))
+    if updates:
+        await db.appointments.bulk_write(updates, ordered=False)
+    logger.info(f"Backfilled slot_key on {len(updates)} appointments")
+
+
+async def backfill_user_slot_keys(db):
+    """Give every appointment holding a slot the per-user key that new bookings claim.
+
+    If legacy data already has a user in one slot twice (on two operators),
+    only the oldest booking gets the key.
+    """
+    seen = set()
+    updates = []
+    cursor = db.appointments.find(
+        {"slot_key": {"$exists": True}, "user_slot_key": {"$exists": False}},
+        {"_id": 0, "id": 1, "user_id": 1, "date": 1, "time": 1}
+    ).sort("created_at", ASCENDING)
+    async for apt in cursor:
+        key = f"{apt['user_id']}|{apt['date']}|{apt['time']}"
+        if key in seen:
+            logger.warning(f"Appointment {apt['id']} repeats user slot {key}; leaving it unclaimed")
+            continue
+        seen.add(key)
+        updates.append(UpdateOne({"id": apt["id"]}, {"$set": {"user_slot_key": key}}))
+    if updates:
+        await db.appointments.bulk_write(updates, ordered=False)
+    logger.info(f"Backfilled user_slot_key on {len(updates)} appointments")
+
+
+# (collection, field) pairs that used to be written as ISO strings
+STRING_DATE_FIELDS = [
+    ("contact_requests", "created_at"),
+    ("status_checks", "timestamp"),
+    ("users", "created_at"),
+    ("appointments", "created_at"),
+]
+
+
+async def convert_string_dates(db, batch_size: int = 500):
+    """Rewrite ISO-string timestamps as BSON dates, one batch at a time.
+
+    Batches walk the collection in _id order, so unparseable values are
+    skipped rather than read again. Converted documents no longer match the
+    $type filter, so an interrupted run simply resumes where it stopped.
+    """
+    for collection, field in STRING_DATE_FIELDS:
+        converted = 0
+        last_id = None
+        while True:
+            query = {field: {"$type": "string"}}
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            batch = await db[collection].find(
+                query, {"_id": 1, field: 1}
+            ).sort("_id", ASCENDING).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+            updates = []
+            for doc in batch:
+                try:
+                    value = datetime.fromisoformat(doc[field])
+                except ValueError:
+                    logger.warning(f"{collection} {doc['_id']}: unparseable {field} {doc[field]!r}, leaving it as is")
+                    continue
+                if value.tzinfo is None:
+                    value = value.replace(tzinfo=timezone.utc)
+                # Only rewrite the value we read, in case the document changed meanwhile
+                updates.append(UpdateOne({"_id": doc["_id"], field: doc[field]}, {"$set": {field: value}}))
+            if updates:
+                await db[collection].bulk_write(updates, ordered=False)
+                converted += len(updates)
+            await asyncio.sleep(0)
+        logger.info(f"Converted {converted} {collection}.{field} values to BSON dates")
+
+
+async def backfill_due_times(db):
+    """Give upcoming pending and confirmed appointments the due times new bookings get.
+
+    Requests that were already pending are treated as held since now, so the
+    admin gets a reminder and a full hold window before any of them expire.
+    """
+    due_times = DueTimes.from_env(os.environ)
+    now = datetime.now(timezone.utc)
+    today = datetime.now().strftime("%Y-%m-%d")
+    updates = []
+    cursor = db.appointments.find(
+        {"status": {"$in": ["pending", "confirmed"]}, "date": {"$gte": today}, "expires_at": {"$exists": False}},
+        {"_id": 0, "id": 1, "date": 1, "time": 1}
+    )
+    async for apt in cursor:
+        due = due_times.for_appointment(apt["date"], apt["time"], now)
+        if due:
+            updates.append(UpdateOne({"id": apt["id"]}, {"$set": due}))
+    if updates:
+        await db.appointments.bulk_write(updates, ordered=False)
+    logger.info(f"Backfilled due times on {len(updates)} appointments")
+
+
+# Each migration declares the indexes it creates as (collection, keys, options)
+# and may provide an async "run" step for data changes, executed before the indexes.
+# "background" migrations may be deferred to a task so they don't delay startup.
+MIGRATIONS = [
+    {
+        "version": 1,
+        "name": "users_indexes",
+        "run": dedupe_users,
+        "indexes": [
+            ("users", [("id", ASCENDING)], {"name": "users_id", "unique": True}),
+            ("users", [("username", ASCENDING)], {"name": "users_username", "unique": True}),
+            ("users", [("email", ASCENDING)], {"name": "users_email", "unique": True}),
+            ("users", [("verification_token", ASCENDING)], {"name": "users_verification_token"}),
+        ],
+    },
+    {
+        "version": 2,
+        "name": "appointments_indexes",
+        "indexes": [
+            ("appointments", [("id", ASCENDING)], {"name": "appointments_id", "unique": True}),
+            ("appointments", [("date", ASCENDING), ("time", ASCENDING), ("status", ASCENDING)],
+             {"name": "appointments_date_time_status"}),
+            ("appointments", [("user_id", ASCENDING), ("date", ASCENDING)], {"name": "appointments_user_date"}),
+        ],
+    },
+    {
+        "version": 3,
+        "name": "email_outbox_indexes",
+        "indexes": [
+            ("email_outbox", [("id", ASCENDING)], {"name": "email_outbox_id", "unique": True}),
+            ("email_outbox", [("status", ASCENDING), ("next_attempt_at", ASCENDING)],
+             {"name": "email_outbox_status_due"}),
+        ],
+    },
+    {
+        "version": 4,
+        "name": "appointments_slot_claim",
+        "run": backfill_slot_keys,
+        "indexes": [
+            # Only non-cancelled appointments carry a slot_key, so the index enforces
+            # one active booking per slot while leaving cancelled history alone.
+            ("appointments", [("slot_key", ASCENDING)],
+             {"name": "appointments_slot_key_unique", "unique": True,
+              "partialFilterExpression": {"slot_key": {"$exists": True}}}),
+        ],
+    },
+    {
+        "version": 5,
+        "name": "keyset_pagination_indexes",
+        "indexes": [
+            ("contact_requests", [("created_at", DESCENDING), ("id", DESCENDING)],
+             {"name": "contact_requests_created"}),
+            ("contact_requests", [("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+             {"name": "contact_requests_status_created"}),
+            ("contact_requests", [("service", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+             {"name": "contact_requests_service_created"}),
+            ("status_checks", [("timestamp", DESCENDING), ("id", DESCENDING)],
+             {"name": "status_checks_timestamp"}),
+        ],
+    },
+    {
+        "version": 6,
+        "name": "timestamps_to_bson_dates",
+        "run": convert_string_dates,
+        "background": True,
+    },
+    {
+        "version": 7,
+        "name": "appointments_review_index",
+        "indexes": [
+            ("appointments", [("status", ASCENDING), ("date", ASCENDING), ("time", ASCENDING)],
+             {"name": "appointments_status_date_time"}),
+        ],
+    },
+    {
+        "version": 8,
+        "name": "appointments_capacity_index",
+        "indexes": [
+            # Covers the availability query, which now also reads each booking's operator
+            ("appointments", [("date", ASCENDING), ("status", ASCENDING), ("time", ASCENDING),
+                              ("operator_id", ASCENDING)],
+             {"name": "appointments_date_status_time_operator"}),
+        ],
+    },
+    {
+        "version": 9,
+        "name": "appointments_due_times",
+        "run": backfill_due_times,
+        "indexes": [
+            # Each scheduled job polls "status X and due before now", soonest first
+            ("appointments", [("status", ASCENDING), ("reminder_at", ASCENDING)],
+             {"name": "appointments_status_reminder_at"}),
+            ("appointments", [("status", ASCENDING), ("admin_ping_at", ASCENDING)],
+             {"name": "appointments_status_admin_ping_at"}),
+            ("appointments", [("status", ASCENDING), ("expires_at", ASCENDING)],
+             {"name": "appointments_status_expires_at"}),
+        ],
+    },
+    {
+        "version": 10,
+        "name": "idempotency_keys_ttl",
+        "indexes": [
+            # Records are looked up by _id; this only removes them once expired
+            ("idempotency_keys", [("expires_at", ASCENDING)],
+             {"name": "idempotency_keys_expires_at", "expireAfterSeconds": 0}),
+        ],
+    },
+    {
+        "version": 11,
+        "name": "appointments_user_slot_claim",
+        "run": backfill_user_slot_keys,
+        "indexes": [
+            # One slot per user and time across operators; released together with slot_key
+            ("appointments", [("user_slot_key", ASCENDING)],
+             {"name": "appointments_user_slot_key_unique", "unique": True,
+              "partialFilterExpression": {"user_slot_key": {"$exists": True}}}),
+        ],
+    },
+    {
+        "version": 12,
+        "name": "email_outbox_sent_ttl",
+        "indexes": [
+            # sent_at is null until a message is sent, and TTL skips non-dates: failed ones stay for inspection
+            ("email_outbox", [("sent_at", ASCENDING)],
+             {"name": "email_outbox_sent_at_ttl",
+              "expireAfterSeconds": int(EMAIL_OUTBOX_RETENTION_DAYS * 86400)}),
+        ],
+    },
+]
+
+# Queries issued on hot request paths; --check asserts each one is served by an index
+HOT_QUERIES = [
+    ("users", {"id": "check"}),
+    ("users", {"username": "check"}),
+    ("users", {"email": "check"}),
+    ("users", {"verification_token": "check"}),
+    ("appointments", {"date": "2000-01-03", "status": {"$ne": "cancelled"}}),
+    ("appointments", {"date": {"$gte": "2000-01-01", "$lte": "2000-01-31"}, "status": {"$ne": "cancelled"}}),
+    ("appointments", {"date": {"$in": ["2000-01-03", "2000-01-04"]}, "status": {"$ne": "cancelled"}}),
+    ("appointments", {"date": "2000-01-03", "time": "09:00", "status": {"$ne": "cancelled"}}),
+    ("appointments", {"date": "2000-01-03", "user_id": "check", "status": {"$ne": "cancelled"}}),
+    ("appointments", {"user_id": "check", "status": {"$ne": "cancelled"}}),
+    ("appointments", {"id": "check"}),
+    ("appointments", {"status": "confirmed", "reminder_at": {"$lte": datetime(2000, 1, 1, tzinfo=timezone.utc)}}),
+    ("appointments", {"status": "pending", "admin_ping_at": {"$lte": datetime(2000, 1, 1, tzinfo=timezone.utc)}}),
+    ("appointments", {"status": "pending", "expires_at": {"$lte": datetime(2000, 1, 1, tzinfo=timezone.utc)}}),
+]
+
+
+async def pending_migrations(db) -> List[dict]:
+    """Return the migrations not yet recorded in the versioned collection"""
+    applied = set()
+    async for doc in db[MIGRATIONS_COLLECTION].find({}, {"_id": 0, "version": 1}):
+        applied.add(doc["version"])
+    return [m for m in sorted(MIGRATIONS, key=lambda m: m["version"]) if m["version"] not in applied]
+
+
+async def apply_migration(db, migration: dict):
+    logger.info(f"Applying migration {migration['version']:03d}_{migration['name']}")
+    if migration.get("run"):
+        await migration["run"](db)
+    # create_index is idempotent, so a migration interrupted half way can simply be re-run
+    for collection, keys, options in migration.get("indexes", []):
+        await db[collection].create_index(keys, **options)
+
+    await db[MIGRATIONS_COLLECTION].update_one(
+        {"version": migration["version"]},
+        {"$setOnInsert": {
+            "version": migration["version"],
+            "name": migration["name"],
+            "applied_at": datetime.now(timezone.utc),
+        }},
+        upsert=True
+    )
+
+
+async def _apply_in_background(db, migrations: List[dict]):
+    for migration in migrations:
+        try:
+            await apply_migration(db, migration)
+        except Exception as e:
+            # Not recorded as applied, so it resumes on the next startup
+            logger.error(f"Background migration {migration['name']} failed: {e}")
+            return
+
+
+_background_tasks = set()
+
+
+async def run_migrations(db, dry_run: bool = False, defer_background: bool = False) -> List[dict]:
+    """Apply pending migrations in order; with dry_run only report them.
+
+    With defer_background, migrations flagged "background" run in a task
+    after the others instead of blocking the caller.
+    """
+    await db[MIGRATIONS_COLLECTION].create_index([("version", ASCENDING)], name="version_unique", unique=True)
+    pending = await pending_migrations(db)
+    deferred = []
+
+    for migration in pending:
+        label = f"{migration['version']:03d}_{migration['name']}"
+        if dry_run:
+            logger.info(f"[dry-run] Would apply migration {label}")
+            for collection, keys, options in migration.get("indexes", []):
+                logger.info(f"[dry-run]   create index {options.get('name')} on {collection} {keys}")
+            continue
+        if defer_background and migration.get("background"):
+            deferred.append(migration)
+            continue
+        await apply_migration(db, migration)
+
+    if deferred:
+        task = asyncio.create_task(_apply_in_background(db, deferred))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    return pending
+
+
+def _plan_stages(plan: dict) -> List[str]:
+    """Flatten the stage names of an explain() winning plan"""
+    stages = [plan.get("stage")] if plan.get("stage") else []
+    if "queryPlan" in plan:
+        stages += _plan_stages(plan["queryPlan"])
+    if "inputStage" in plan:
+        stages += _plan_stages(plan["inputStage"])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return stages
+
+
+async def check_query_plans(db) -> List[str]:
+    """Explain every hot query; return a description of each one that scans a whole collection"""
+    failures = []
+    for collection, query in HOT_QUERIES:
+        explain = await db[collection].find(query).explain()
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        logger.info(f"{collection} {query}: {' <- '.join(stages)}")
+        if "COLLSCAN" in stages:
+            failures.append(f"{collection} {query}")
+    return failures
+
+
+async def _main(args) -> int:
+    from database import Database
+
+    db = Database.from_env(os.environ, tz_aware=True)
+    await db.connect()
+    try:
+        pending = await run_migrations(db, dry_run=args.dry_run)
+        if not pending:
+            logger.info("No pending migrations")
+        if args.check:
+            failures = await check_query_plans(db)
+            for failure in failures:
+                logger.error(f"Collection scan: {failure}")
+            return 1 if failures else 0
+        return 0
+    finally:
+        db.close()
+
+
+def main(argv=None) -> int:
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Apply Spaziopratiche MongoDB migrations")
+    parser.add_argument("--dry-run", action="store_true", help="list pending migrations without applying them")
+    parser.add_argument("--check", action="store_true", help="explain hot queries and fail on collection scans")
+    args = parser.parse_args(argv)
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""Keyset (cursor) pagination and NDJSON streaming over Motor cursors.
+
+Pages are ordered newest first by ``(sort_field, id)``. The opaque cursor
+encodes the sort key of the last row returned, so each page is a single
+index range scan no matter how deep the client has paged.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+from pymongo import DESCENDING
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode_cursor(doc: dict, sort_field: str) -> str:
+    value = doc[sort_field]
+    # Dates are tagged so the cursor compares against BSON dates, not strings
+    key = [value.isoformat(), doc["id"], "date"] if isinstance(value, datetime) else [value, doc["id"]]
+    raw = json.dumps(key)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[object, str]:
+    """Inverse of encode_cursor; raises ValueError on a malformed cursor.
+
+    The decoded key goes straight into a query, so only scalar sort values
+    are accepted: anything else (an object such as ``{"$ne": null}``) could
+    smuggle in an operator.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("invalid cursor")
+    if not isinstance(key, list) or len(key) not in (2, 3):
+        raise ValueError("invalid cursor")
+    value, last_id = key[0], key[1]
+    if not isinstance(last_id, str):
+        raise ValueError("invalid cursor")
+    if len(key) == 3:
+        if key[2] != "date" or not isinstance(value, str):
+            raise ValueError("invalid cursor")
+        return datetime.fromisoformat(value), last_id
+    # bool is an int subclass, but never a sort key of ours
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError("invalid cursor")
+    return value, last_id
+
+
+def after_cursor(query: dict, sort_field: str, cursor: Optional[str]) -> dict:
+    """Restrict a query to the rows that come after the cursor"""
+    if not cursor:
+        return query
+    value, last_id = decode_cursor(cursor)
+    return {"$and": [query, {"$or": [
+        {sort_field: {"$lt": value}},
+        {sort_field: value, "id": {"$lt": last_id}},
+    ]}]}
+
+
+async def fetch_page(collection, query: dict, sort_field: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """Return one page of documents and the cursor of the next page (None on the last page)"""
+    docs = await collection.find(
+        after_cursor(query, sort_field, cursor), {"_id": 0}
+    ).sort([(sort_field, DESCENDING), ("id", DESCENDING)]).limit(limit + 1).to_list(limit + 1)
+    next_cursor = encode_cursor(docs[limit - 1], sort_field) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+async def stream_ndjson(collection, query: dict, sort_field: str, batch_size: int = 500) -> AsyncIterator[bytes]:
+    """Yield every matching document as one JSON line, holding a single batch in memory"""
+    cursor = collection.find(query, {"_id": 0}).sort(
+        [(sort_field, DESCENDING), ("id", DESCENDING)]
+    ).batch_size(batch_size)
+    async for doc in cursor:
+        yield (json.dumps(doc, default=_json_default, ensure_ascii=False) + "\n").encode()
@@ -0,0 +1,59 @@
+"""Password hashing on a bounded thread pool, off the event loop.
+
+bcrypt releases the GIL while it works, so a small thread pool lets several
+hashes run in parallel while the event loop keeps serving other requests.
+When more than ``max_pending`` operations are queued, new ones are refused
+with ``PasswordHasherBusy`` instead of growing the queue without bound.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from metrics import PASSWORD_HASH_REJECTED, PASSWORD_HASH_SECONDS
+
+
+def _timed(operation: str, fn, *args):
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        PASSWORD_HASH_SECONDS.observe(time.perf_counter() - start, operation=operation)
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the password pool queue is full"""
+
+
+class PasswordHasher:
+    def __init__(self, context, workers: int = 2, max_pending: int = 16):
+        self.context = context
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def _run(self, operation: str, fn, *args):
+        if self._pending >= self.max_pending:
+            PASSWORD_HASH_REJECTED.inc()
+            raise PasswordHasherBusy()
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, _timed, operation, fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password; also return a new hash when the stored one uses outdated settings"""
+        return await self._run("verify", self.context.verify_and_update, password, hashed_password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,185 @@
+"""Token-bucket rate limiting for the abuse-prone public endpoints.
+
+Each key (a client IP, a username, ...) owns a bucket of ``limit`` tokens
+refilled continuously over ``period`` seconds; a request takes one token or
+is refused with the number of seconds until one is available. Buckets live
+in a store: ``MemoryBucketStore`` keeps them in this process (with an
+injectable clock, so tests can drive it without sleeping) and
+``RedisBucketStore`` shares them between replicas through any client that
+speaks the Redis ``EVAL`` command.
+"""
+import json
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from metrics import RATE_LIMITED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+class Rate(NamedTuple):
+    name: str
+    limit: int
+    period: float
+
+    @property
+    def refill_per_second(self) -> float:
+        return self.limit / self.period
+
+
+def parse_rate(name: str, value: str) -> Rate:
+    """Parse ``"10/minute"`` (or ``"10/30"`` for a period in seconds)"""
+    count, _, period = value.partition("/")
+    seconds = PERIODS.get(period.strip()) or float(period)
+    if int(count) < 1 or seconds <= 0:
+        raise ValueError(f"Invalid rate for {name}: {value!r}")
+    return Rate(name, int(count), seconds)
+
+
+class RateLimited(Exception):
+    def __init__(self, rate: Rate, retry_after: float):
+        super().__init__(rate.name)
+        self.rate = rate
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class MemoryBucketStore:
+    """Buckets in a bounded LRU dict; the least recently used key goes first when full"""
+
+    def __init__(self, max_keys: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, rate: Rate) -> float:
+        """Take one token; return 0 on success, else the seconds until a token is available"""
+        now = self.clock()
+        tokens, updated = self._buckets.pop(key, (rate.limit, now))
+        tokens = min(rate.limit, tokens + (now - updated) * rate.refill_per_second)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate.refill_per_second
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        self._buckets.clear()
+
+
+# Same algorithm as MemoryBucketStore, run atomically on the server with the server's clock
+_TAKE_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or limit
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(limit, tokens + (now - updated) * refill)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / refill
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], ttl)
+return tostring(wait)
+"""
+
+
+class RedisBucketStore:
+    """Buckets shared between replicas; ``client`` is e.g. a ``redis.asyncio.Redis``"""
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def take(self, key: str, rate: Rate) -> float:
+        # An idle bucket is full again after one period, so it can expire then
+        ttl = max(1, math.ceil(rate.period))
+        wait = await self.client.eval(
+            _TAKE_SCRIPT, 1, self.prefix + key, rate.limit, rate.refill_per_second, ttl
+        )
+        return float(wait)
+
+
+class RateLimiter:
+    def __init__(self, store):
+        self.store = store
+
+    async def hit(self, key: str, rate: Rate):
+        """Consume one request for ``key``; raise RateLimited if its bucket is empty"""
+        try:
+            wait = await self.store.take(f"{rate.name}:{key}", rate)
+        except Exception as e:
+            # A broken shared store must not take login down with it
+            logger.error(f"Rate limit store unavailable, allowing request: {e}")
+            return
+        if wait > 0:
+            RATE_LIMITED_TOTAL.inc(policy=rate.name)
+            raise RateLimited(rate, wait)
+
+
+def client_ip(scope, trust_forwarded: bool = False) -> str:
+    """Caller address; behind a proxy, the last X-Forwarded-For hop is the one the proxy saw"""
+    if trust_forwarded:
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                hops = [h.strip() for h in value.decode("latin-1").split(",") if h.strip()]
+                if hops:
+                    return hops[-1]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying per-IP rates to specific (method, path) pairs"""
+
+    def __init__(self, app, limiter: RateLimiter, policies: Dict[Tuple[str, str], List[Rate]],
+                 trust_forwarded: bool = False):
+        self.app = app
+        self.limiter = limiter
+        self.policies = policies
+        self.trust_forwarded = trust_forwarded
+
+    async def __call__(self, scope, receive, send):
+        rates: Optional[List[Rate]] = None
+        if scope["type"] == "http":
+            rates = self.policies.get((scope["method"], scope["path"].rstrip("/") or "/"))
+        if rates:
+            ip = client_ip(scope, self.trust_forwarded)
+            try:
+                for rate in rates:
+                    await self.limiter.hit(ip, rate)
+            except RateLimited as e:
+                await self._reject(send, e)
+                return
+        await self.app(scope, receive, send)
+
+    async def _reject(self, send, e: RateLimited):
+        body = json.dumps({"detail": "Troppe richieste, riprova più tardi"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", e.retry_after_header.encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,396 @@
+"""Render cost of the email and admin page templates.
+
+Runs offline (no server, no MongoDB) on the sample contexts below and
+reports the one-off cost of compiling every template, as TemplateRenderer
+does at import, and for each template the CPU time per render, both
+precompiled and compiled on every call (inlining included), which is what
+precompiling saves. Templates that replaced an f-string in server.py are
+also timed against that f-string, kept below as it was. The f-strings
+escaped nothing and had no plain-text part, so they set the floor rather
+than an equivalent::
+
+    python render_bench.py
+    python render_bench.py --iterations 5000 --output render.json
+
+The same samples render the golden files in ``tests/golden``.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Dict
+
+from templating import TemplateRenderer
+
+TEMPLATES_DIR = Path(__file__).parent / "templates"
+
+
+# ---------------------
+# Sample contexts, shaped like the ones server.py passes
+# ---------------------
+
+def appointment(n: int = 0) -> dict:
+    return {
+        "id": f"apt-{n}",
+        "user_name": "Giulia Bianchi",
+        # Markup in user input must come out escaped in the HTML variants
+        "agency_name": "Rossi & Figli <Immobiliare>",
+        "date": "2026-03-05",
+        "time": ["09:00", "09:45", "10:30"][n % 3],
+        "duration_minutes": 45,
+        "appointment_address": f"Corso Buenos Aires {n + 1}, 20124 Milano",
+        "contact_person": "Marco Rossi",
+        "contact_phone": "3381234567",
+        "intercom_name": None if n % 2 else "Rossi",
+        "expires_at": datetime(2026, 3, 3, 17, 30, tzinfo=timezone.utc),
+    }
+
+
+def links(appointments) -> dict:
+    return {
+        apt["id"]: (f"https://example.test/api/appointments/{apt['id']}/confirm?token=t",
+                    f"https://example.test/api/appointments/{apt['id']}/reject?token=t")
+        for apt in appointments
+    }
+
+
+def email_samples() -> Dict[str, dict]:
+    block = [appointment(n) for n in range(3)]
+    return {
+        "admin_notification": {
+            "appointment": appointment(),
+            "user_email": "giulia@example.it",
+            "confirm_url": "https://example.test/api/appointments/apt-0/confirm?token=t",
+            "reject_url": "https://example.test/api/appointments/apt-0/reject?token=t",
+        },
+        "admin_block_notification": {
+            "appointments": block, "first": block[0], "user_email": "giulia@example.it", "links": links(block),
+        },
+        "admin_pending_reminder": {"appointments": block, "links": links(block)},
+        "appointment_confirmed": {"appointment": appointment()},
+        "appointment_rejected": {"appointment": appointment()},
+        "appointment_reminder": {"appointment": appointment(1)},
+        "appointment_expired": {"appointment": appointment()},
+        "contact_request": {"contact": {
+            "name": "Luca <script>alert(1)</script>", "email": "luca@example.it", "phone": None,
+            "service": "visura", "message": "Vorrei un preventivo per una visura & una planimetria.",
+        }},
+    }
+
+
+def samples() -> Dict[str, dict]:
+    """Template name -> context, for every template in TEMPLATES_DIR"""
+    contexts = {}
+    for name, context in email_samples().items():
+        contexts[f"emails/{name}.html"] = context
+        contexts[f"emails/{name}.txt"] = context
+    contexts["pages/action_prompt.html"] = {
+        "title": "Confermare l'appuntamento?", "message": "Il cliente riceverà una email con l'esito.",
+        "button": "✓ SÌ, CONFERMA", "color": "#22c55e", "token": "t",
+        "action_url": "https://example.test/api/appointments/apt-0/confirm",
+    }
+    contexts["pages/appointment_result.html"] = {
+        "appointment": appointment(), "title": "Appuntamento confermato", "note": "Il cliente è stato avvisato.",
+        "color": "#22c55e", "background": "#f0fdf4",
+    }
+    contexts["pages/message.html"] = {
+        "title": "Link scaduto", "message": "Il link non è più valido.", "color": "#ef4444",
+    }
+    return contexts
+
+
+# ---------------------
+# Baseline: the f-string bodies server.py built before the templates (451ced5), verbatim
+# ---------------------
+
+BACKEND_URL = "https://spaziopratiche-production.up.railway.app"
+
+
+def old_date(appointment: dict) -> str:
+    return datetime.strptime(appointment['date'], "%Y-%m-%d").strftime("%d/%m/%Y")
+
+
+def old_admin_notification(appointment: dict, user_email: str, **_) -> str:
+    date_formatted = old_date(appointment)
+    intercom_info = appointment.get('intercom_name', '') or 'Non specificato'
+    return f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <style>
+            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
+            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+            .header {{ background: linear-gradient(135deg, #0f172a, #0369a1); color: white; padding: 20px; border-radius: 10px 10px 0 0; }}
+            .content {{ background: #f8fafc; padding: 20px; border: 1px solid #e2e8f0; }}
+            .info-row {{ padding: 10px 0; border-bottom: 1px solid #e2e8f0; }}
+            .label {{ font-weight: bold; color: #64748b; }}
+            .highlight {{ background: #fef3c7; padding: 15px; border-radius: 8px; margin: 15px 0; border-left: 4px solid #f59e0b; }}
+            .buttons {{ padding: 20px; text-align: center; background: #f1f5f9; border-radius: 0 0 10px 10px; }}
+            .btn {{ display: inline-block; padding: 15px 40px; margin: 10px; text-decoration: none; border-radius: 25px; font-weight: bold; font-size: 16px; }}
+            .btn-yes {{ background: #22c55e; color: white; }}
+            .btn-no {{ background: #ef4444; color: white; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h2 style="margin:0;">📅 Nuova Richiesta Appuntamento</h2>
+            </div>
+            <div class="content">
+                <div class="info-row">
+                    <span class="label">Agenzia:</span> {appointment['agency_name']}
+                </div>
+                <div class="info-row">
+                    <span class="label">Referente:</span> {appointment['user_name']}
+                </div>
+                <div class="info-row">
+                    <span class="label">Email:</span> {user_email}
+                </div>
+                <div class="info-row">
+                    <span class="label">📅 Data:</span> <strong>{date_formatted}</strong>
+                </div>
+                <div class="info-row">
+                    <span class="label">🕐 Ora:</span> <strong>{appointment['time']}</strong> ({appointment['duration_minutes']} min)
+                </div>
+                
+                <div class="highlight">
+                    <h3 style="margin: 0 0 10px 0; color: #92400e;">📍 Dettagli Appuntamento</h3>
+                    <div class="info-row" style="border: none;">
+                        <span class="label">Indirizzo:</span> {appointment.get('appointment_address', 'N/A')}
+                    </div>
+                    <div class="info-row" style="border: none;">
+                        <span class="label">Presente:</span> {appointment.get('contact_person', 'N/A')}
+                    </div>
+                    <div class="info-row" style="border: none;">
+                        <span class="label">Telefono:</span> {appointment.get('contact_phone', 'N/A')}
+                    </div>
+                    <div class="info-row" style="border: none;">
+                        <span class="label">Citofono:</span> {intercom_info}
+                    </div>
+                </div>
+            </div>
+            <div class="buttons">
+                <p style="margin-bottom: 15px; color: #64748b;">Vuoi confermare questo appuntamento?</p>
+                <a href="{BACKEND_URL}/api/appointments/{appointment['id']}/confirm" class="btn btn-yes">✓ SÌ, CONFERMA</a>
+                <a href="{BACKEND_URL}/api/appointments/{appointment['id']}/reject" class="btn btn-no">✗ NO, RIFIUTA</a>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+
+def old_appointment_confirmed(appointment: dict, **_) -> str:
+    date_formatted = old_date(appointment)
+    return f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <style>
+            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
+            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+            .header {{ background: linear-gradient(135deg, #22c55e, #16a34a); color: white; padding: 30px; border-radius: 10px 10px 0 0; text-align: center; }}
+            .content {{ background: #f8fafc; padding: 30px; border: 1px solid #e2e8f0; border-radius: 0 0 10px 10px; }}
+            .highlight {{ background: white; padding: 20px; border-radius: 10px; margin: 20px 0; border-left: 4px solid #22c55e; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h1 style="margin:0;">✓ Appuntamento Confermato!</h1>
+            </div>
+            <div class="content">
+                <p>Gentile <strong>{appointment['user_name']}</strong>,</p>
+                
+                <p>Il tuo appuntamento del giorno <strong>{date_formatted}</strong> alle ore <strong>{appointment['time']}</strong> è confermato.</p>
+                
+                <div class="highlight">
+                    <strong>📍 Ci vediamo lì!</strong><br>
+                    Via Belfiore 9, 20149 Milano
+                </div>
+                
+                <p>Per qualsiasi necessità, contattaci ai numeri <strong>338/4071025</strong> o <strong>334/7077175</strong></p>
+                
+                <p>A presto,<br>
+                <strong>Il team di Spaziopratiche</strong></p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+
+def old_appointment_rejected(appointment: dict, **_) -> str:
+    date_formatted = old_date(appointment)
+    return f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <style>
+            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
+            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+            .header {{ background: linear-gradient(135deg, #f97316, #ea580c); color: white; padding: 30px; border-radius: 10px 10px 0 0; text-align: center; }}
+            .content {{ background: #f8fafc; padding: 30px; border: 1px solid #e2e8f0; border-radius: 0 0 10px 10px; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h1 style="margin:0;">Appuntamento Non Disponibile</h1>
+            </div>
+            <div class="content">
+                <p>Gentile <strong>{appointment['user_name']}</strong>,</p>
+                
+                <p>Siamo spiacenti, ma l'appuntamento richiesto per il giorno <strong>{date_formatted}</strong> alle ore <strong>{appointment['time']}</strong> non è disponibile.</p>
+                
+                <p>Ti invitiamo a selezionare un'altra data o orario dalla nostra piattaforma di prenotazione.</p>
+                
+                <p>Per qualsiasi necessità, contattaci ai numeri <strong>338/4071025</strong> o <strong>334/7077175</strong></p>
+                
+                <p>Ci scusiamo per il disagio,<br>
+                <strong>Il team di Spaziopratiche</strong></p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+
+def old_contact_request(contact: dict, **_) -> str:
+    # The f-string read the attributes of the request model
+    input = SimpleNamespace(**contact)
+    return f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <style>
+                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
+                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+                .header {{ background: linear-gradient(135deg, #0f172a, #0369a1); color: white; padding: 20px; border-radius: 10px 10px 0 0; }}
+                .content {{ background: #f8fafc; padding: 20px; border: 1px solid #e2e8f0; border-radius: 0 0 10px 10px; }}
+                .info-row {{ padding: 10px 0; border-bottom: 1px solid #e2e8f0; }}
+                .label {{ font-weight: bold; color: #64748b; }}
+            </style>
+        </head>
+        <body>
+            <div class="container">
+                <div class="header">
+                    <h2 style="margin:0;">📩 Nuova Richiesta dal Sito</h2>
+                </div>
+                <div class="content">
+                    <div class="info-row">
+                        <span class="label">Nome:</span> {input.name}
+                    </div>
+                    <div class="info-row">
+                        <span class="label">Email:</span> {input.email}
+                    </div>
+                    <div class="info-row">
+                        <span class="label">Telefono:</span> {input.phone or 'Non specificato'}
+                    </div>
+                    <div class="info-row">
+                        <span class="label">Servizio richiesto:</span> {input.service}
+                    </div>
+                    <div class="info-row">
+                        <span class="label">Messaggio:</span><br>{input.message}
+                    </div>
+                </div>
+            </div>
+        </body>
+        </html>
+        """
+
+
+def old_appointment_result(appointment: dict, **_) -> str:
+    apt = appointment
+    date_formatted = old_date(apt)
+    return f"""
+        <html>
+        <head>
+            <style>
+                body {{ font-family: Arial, sans-serif; text-align: center; padding: 50px; background: #f0fdf4; }}
+                .container {{ max-width: 500px; margin: 0 auto; background: white; padding: 40px; border-radius: 20px; box-shadow: 0 10px 40px rgba(0,0,0,0.1); }}
+                h1 {{ color: #22c55e; }}
+            </style>
+        </head>
+        <body>
+            <div class="container">
+                <h1>✓ Appuntamento Confermato!</h1>
+                <p><strong>{apt['agency_name']}</strong></p>
+                <p>📅 {date_formatted} alle {apt['time']}</p>
+                <p style="color: #64748b; margin-top: 20px;">Email di conferma inviata al cliente.</p>
+            </div>
+        </body>
+        </html>
+    """
+
+
+# Template -> the f-string it replaced; the other templates have no f-string predecessor
+FSTRING_BASELINE: Dict[str, Callable[..., str]] = {
+    "emails/admin_notification.html": old_admin_notification,
+    "emails/appointment_confirmed.html": old_appointment_confirmed,
+    "emails/appointment_rejected.html": old_appointment_rejected,
+    "emails/contact_request.html": old_contact_request,
+    "pages/appointment_result.html": old_appointment_result,
+}
+
+
+# ---------------------
+# Timing
+# ---------------------
+
+def cpu_per_call(fn: Callable, iterations: int) -> float:
+    fn()  # warm up
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations
+
+
+def run(iterations: int) -> dict:
+    start = time.process_time()
+    renderer = TemplateRenderer(TEMPLATES_DIR)
+    compile_ms = (time.process_time() - start) * 1e3
+
+    renders = {}
+    for name, context in samples().items():
+        template = renderer.env.get_template(name)
+
+        def compile_and_render():
+            source = renderer.env.loader.get_source(renderer.env, name)[0]
+            return renderer.env.from_string(source).render(**context)
+
+        renders[name] = {
+            "bytes": len(template.render(**context).encode()),
+            "cpu_us_compiling": round(cpu_per_call(compile_and_render, iterations) * 1e6, 1),
+            "cpu_us": round(cpu_per_call(lambda: template.render(**context), iterations) * 1e6, 1),
+        }
+        fstring = FSTRING_BASELINE.get(name)
+        if fstring is not None:
+            renders[name]["fstring_bytes"] = len(fstring(**context).encode())
+            renders[name]["cpu_us_fstring"] = round(cpu_per_call(lambda: fstring(**context), iterations) * 1e6, 1)
+    return {"compile_all_ms": round(compile_ms, 1), "templates": renders}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Render cost of the email and admin page templates")
+    parser.add_argument("--iterations", type=int, default=2000, help="renders timed per template")
+    parser.add_argument("--output", help="write the JSON results here as well")
+    args = parser.parse_args(argv)
+
+    results = run(args.iterations)
+    print(f"compile all templates: {results['compile_all_ms']} ms")
+    for name, r in results["templates"].items():
+        line = f"{name}: {r['cpu_us_compiling']} -> {r['cpu_us']} us/render, {r['bytes']} B"
+        if "cpu_us_fstring" in r:
+            line += f" (f-string: {r['cpu_us_fstring']} us, {r['fstring_bytes']} B)"
+        print(line)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""Precompiled slot schedule.
+
+The bookable grid of a day is built once per distinct set of opening hours
+and then shared: slot times, their minute offsets from midnight and an O(1)
+time -> index map. Availability and the consecutive-slot rule are computed on
+integer bitmasks where bit ``i`` stands for slot ``i`` of the day.
+
+Several operators can take appointments in parallel. They share the day's
+slot grid; each one works the slots that fall inside their own hours, so the
+capacity of a slot is the number of operators working it.
+"""
+from bisect import bisect_left
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+MINUTES_PER_DAY = 24 * 60
+WEEKDAYS = {"mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6}
+
+
+def parse_hhmm(value: str) -> int:
+    """'09:45' -> 585"""
+    hours, minutes = value.strip().split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def format_hhmm(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def parse_ranges(value: str) -> List[Tuple[int, int]]:
+    """'13:00-14:00,16:00-16:30' -> [(780, 840), (960, 990)]"""
+    ranges = []
+    for part in value.split(","):
+        if part.strip():
+            start, end = part.split("-")
+            ranges.append((parse_hhmm(start), parse_hhmm(end)))
+    return ranges
+
+
+def easter_sunday(year: int) -> date:
+    """Gregorian Easter (anonymous Gregorian algorithm)"""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+@lru_cache(maxsize=None)
+def italian_holidays(year: int) -> FrozenSet[date]:
+    """National public holidays in Italy"""
+    fixed = [(1, 1), (1, 6), (4, 25), (5, 1), (6, 2), (8, 15), (11, 1), (12, 8), (12, 25), (12, 26)]
+    days = {date(year, month, day) for month, day in fixed}
+    days.add(easter_sunday(year) + timedelta(days=1))  # Lunedì dell'Angelo
+    return frozenset(days)
+
+
+class DaySchedule:
+    """The slot table for one set of opening hours"""
+
+    def __init__(self, open_minute: int, close_minute: int, slot_minutes: int, breaks: Sequence[Tuple[int, int]] = ()):
+        offsets = []
+        current = open_minute
+        while current + slot_minutes <= close_minute:
+            end = current + slot_minutes
+            overlapping = [b_end for b_start, b_end in breaks if current < b_end and b_start < end]
+            if overlapping:
+                # Resume right after the break
+                current = max(overlapping)
+                continue
+            offsets.append(current)
+            current = end
+
+        self.slot_minutes = slot_minutes
+        self.offsets: List[int] = offsets
+        self.times: List[str] = [format_hhmm(offset) for offset in offsets]
+        self.index: Dict[str, int] = {t: i for i, t in enumerate(self.times)}
+        self.full_mask = (1 << len(offsets)) - 1
+        # Slots that touch slot i end-to-start (a lunch break separates index neighbours)
+        self.neighbours: List[int] = []
+        for i, offset in enumerate(offsets):
+            mask = 0
+            if i > 0 and offsets[i - 1] + slot_minutes == offset:
+                mask |= 1 << (i - 1)
+            if i + 1 < len(offsets) and offset + slot_minutes == offsets[i + 1]:
+                mask |= 1 << (i + 1)
+            self.neighbours.append(mask)
+
+    def mask_of(self, times: Iterable[str]) -> int:
+        """Bitmask of the given slot times (times outside the table are ignored)"""
+        mask = 0
+        for t in times:
+            i = self.index.get(t)
+            if i is not None:
+                mask |= 1 << i
+        return mask
+
+    def bookable_from(self, minute: float) -> int:
+        """Bitmask of the slots starting at or after the given minute of the day"""
+        first = bisect_left(self.offsets, minute)
+        return self.full_mask & ~((1 << first) - 1)
+
+    def is_adjacent(self, mask: int, i: int) -> bool:
+        return bool(self.neighbours[i] & mask)
+
+    def run(self, start: int, count: int) -> Optional[int]:
+        """Bitmask of ``count`` back-to-back slots from index ``start``; None past closing or across a break"""
+        if start + count > len(self.offsets):
+            return None
+        last = self.offsets[start] + (count - 1) * self.slot_minutes
+        if self.offsets[start + count - 1] != last:
+            return None
+        return ((1 << count) - 1) << start
+
+    def touches(self, mask: int, block: int) -> bool:
+        """True if any slot of ``block`` is adjacent to a slot of ``mask``"""
+        return any(self.neighbours[i] & mask for i in range(len(self.offsets)) if block >> i & 1)
+
+    def slots(self, available_mask: int) -> List[Tuple[str, bool]]:
+        return [(t, bool(available_mask >> i & 1)) for i, t in enumerate(self.times)]
+
+
+class Operator:
+    """Someone taking appointments on ``weekdays`` (default: every open day) within ``hours`` (default: all day)"""
+
+    def __init__(self, id: str, hours: Sequence[Tuple[int, int]] = (), weekdays: Optional[Iterable[int]] = None):
+        self.id = id
+        self.hours = tuple(hours)
+        self.weekdays = frozenset(weekdays) if weekdays is not None else None
+        self._masks: Dict[int, int] = {}
+
+    def working_mask(self, table: DaySchedule, day: date) -> int:
+        """Bitmask of the slots of ``table`` this operator works on ``day``"""
+        if self.weekdays is not None and day.weekday() not in self.weekdays:
+            return 0
+        if not self.hours:
+            return table.full_mask
+        # Tables are shared and live as long as the engine, so their id is a stable key
+        mask = self._masks.get(id(table))
+        if mask is None:
+            mask = 0
+            for i, offset in enumerate(table.offsets):
+                if any(start <= offset and offset + table.slot_minutes <= end for start, end in self.hours):
+                    mask |= 1 << i
+            self._masks[id(table)] = mask
+        return mask
+
+    @classmethod
+    def parse(cls, entry: str) -> "Operator":
+        """'anna', 'marco=09:00-13:00' or 'luca=14:00-18:00@mon,wed'"""
+        entry, _, days = entry.partition("@")
+        operator_id, _, hours = entry.partition("=")
+        weekdays = [WEEKDAYS[d.strip().lower()] for d in days.split(",")] if days.strip() else None
+        return cls(operator_id.strip(), parse_ranges(hours), weekdays)
+
+
+class ScheduleEngine:
+    """Resolves the slot table of any date: weekdays, holidays and per-day overrides"""
+
+    def __init__(
+        self,
+        open_minute: int = 9 * 60,
+        close_minute: int = 18 * 60,
+        slot_minutes: int = 45,
+        breaks: Sequence[Tuple[int, int]] = (),
+        working_weekdays: Iterable[int] = (0, 1, 2, 3, 4),
+        national_holidays: bool = True,
+        closed_dates: Iterable[date] = (),
+        overrides: Optional[Dict[date, Optional[Tuple[int, int]]]] = None,
+        operators: Sequence[Operator] = (),
+    ):
+        self.slot_minutes = slot_minutes
+        self.breaks = tuple(breaks)
+        self.working_weekdays = frozenset(working_weekdays)
+        self.national_holidays = national_holidays
+        self.closed_dates = frozenset(closed_dates)
+        self._tables: Dict[Tuple[int, int], DaySchedule] = {}
+        self.default = self._table(open_minute, close_minute)
+        # date -> (open, close), or None to close that day
+        self.overrides: Dict[date, Optional[DaySchedule]] = {
+            day: (self._table(*hours) if hours else None) for day, hours in (overrides or {}).items()
+        }
+        # The first operator also owns appointments booked before operators existed
+        self.operators: List[Operator] = list(operators) or [Operator("default")]
+        self.primary = self.operators[0]
+
+    def _table(self, open_minute: int, close_minute: int) -> DaySchedule:
+        key = (open_minute, close_minute)
+        if key not in self._tables:
+            self._tables[key] = DaySchedule(open_minute, close_minute, self.slot_minutes, self.breaks)
+        return self._tables[key]
+
+    def for_day(self, day: date) -> Optional[DaySchedule]:
+        """The slot table of a date, or None when the office is closed"""
+        if day in self.overrides:
+            return self.overrides[day]
+        if day.weekday() not in self.working_weekdays or day in self.closed_dates:
+            return None
+        if self.national_holidays and day in italian_holidays(day.year):
+            return None
+        return self.default
+
+    def staff(self, day: date, table: DaySchedule) -> List[Tuple[Operator, int]]:
+        """Operators working on ``day``, each with the bitmask of the slots they work"""
+        masks = ((operator, operator.working_mask(table, day)) for operator in self.operators)
+        return [(operator, mask) for operator, mask in masks if mask]
+
+    @classmethod
+    def from_env(cls, env) -> "ScheduleEngine":
+        """Build the engine from SCHEDULE_* environment variables.
+
+        SCHEDULE_OVERRIDES uses ``YYYY-MM-DD=HH:MM-HH:MM`` or ``YYYY-MM-DD=closed``
+        entries separated by ``;``. SCHEDULE_OPERATORS lists operators the same
+        way, see ``Operator.parse``; unset means a single operator.
+        """
+        overrides = {}
+        for entry in env.get('SCHEDULE_OVERRIDES', '').split(';'):
+            if entry.strip():
+                day, hours = entry.split('=')
+                overrides[date.fromisoformat(day.strip())] = (
+                    None if hours.strip().lower() == 'closed' else parse_ranges(hours)[0]
+                )
+        return cls(
+            open_minute=parse_hhmm(env.get('SCHEDULE_OPEN', '09:00')),
+            close_minute=parse_hhmm(env.get('SCHEDULE_CLOSE', '18:00')),
+            slot_minutes=int(env.get('SCHEDULE_SLOT_MINUTES', '45')),
+            breaks=parse_ranges(env.get('SCHEDULE_BREAKS', '')),
+            national_holidays=env.get('SCHEDULE_NATIONAL_HOLIDAYS', 'true').lower() == 'true',
+            closed_dates=[
+                date.fromisoformat(d.strip()) for d in env.get('SCHEDULE_CLOSED_DATES', '').split(',') if d.strip()
+            ],
+            overrides=overrides,
+            operators=[Operator.parse(e) for e in env.get('SCHEDULE_OPERATORS', '').split(';') if e.strip()],
+        )
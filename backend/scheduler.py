@@ -0,0 +1,128 @@
+"""Leader-elected periodic jobs.
+
+Every replica runs a ``JobScheduler``, but only the one holding the lease
+document in ``scheduler_leases`` runs jobs. The lease is taken with a
+conditional upsert and renewed on every tick; if the leader dies, another
+replica takes over once the lease expires. Jobs claim their work with
+conditional updates of their own, so a tick overlapping a handover still
+handles every item once.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from metrics import SCHEDULER_IS_LEADER, SCHEDULER_JOB_ITEMS, SCHEDULER_JOB_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLease:
+    """One named lease, held by at most one owner until ``expires_at``"""
+
+    def __init__(self, collection, name: str, ttl_seconds: float = 60.0, owner: Optional[str] = None):
+        self.collection = collection
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held = False
+
+    async def acquire(self) -> bool:
+        """Take the lease if it is free or expired, or renew it if we hold it"""
+        now = datetime.now(timezone.utc)
+        try:
+            # When someone else holds a live lease the filter misses and the upsert
+            # collides with their document on _id
+            await self.collection.update_one(
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.ttl_seconds)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            if self.held:
+                logger.warning(f"Lost scheduler lease {self.name}")
+            self.held = False
+            return False
+        if not self.held:
+            logger.info(f"Acquired scheduler lease {self.name} as {self.owner}")
+        self.held = True
+        return True
+
+    async def release(self):
+        """Give the lease up so another replica can take over without waiting for it to expire"""
+        if self.held:
+            await self.collection.delete_one({"_id": self.name, "owner": self.owner})
+            self.held = False
+
+
+class Job(NamedTuple):
+    name: str
+    run: Callable[[], Awaitable[int]]  # returns the number of items handled
+    interval_seconds: float
+
+
+class JobScheduler:
+    def __init__(self, lease: LeaderLease, jobs: List[Job], tick_seconds: float = 15.0):
+        self.lease = lease
+        self.jobs = jobs
+        self.tick_seconds = tick_seconds
+        self._next_run: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            logger.info(f"Job scheduler started: {', '.join(job.name for job in self.jobs)}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.lease.release()
+        except Exception as e:
+            logger.error(f"Failed to release scheduler lease: {e}")
+        SCHEDULER_IS_LEADER.set(0)
+
+    async def _run(self, job: Job):
+        start = time.perf_counter()
+        try:
+            handled = await job.run()
+        except Exception as e:
+            logger.error(f"Scheduled job {job.name} failed: {e}")
+            SCHEDULER_JOB_SECONDS.observe(time.perf_counter() - start, job=job.name, outcome="error")
+            return
+        SCHEDULER_JOB_SECONDS.observe(time.perf_counter() - start, job=job.name, outcome="ok")
+        if handled:
+            SCHEDULER_JOB_ITEMS.inc(handled, job=job.name)
+            logger.info(f"Scheduled job {job.name} handled {handled} items")
+
+    async def tick(self):
+        """Renew the lease and, while leader, run the jobs that are due"""
+        try:
+            leader = await self.lease.acquire()
+        except Exception as e:
+            logger.error(f"Scheduler lease check failed: {e}")
+            leader = False
+        SCHEDULER_IS_LEADER.set(1 if leader else 0)
+        if not leader:
+            # A replica that becomes leader later runs every job straight away
+            self._next_run.clear()
+            return
+        for job in self.jobs:
+            now = time.monotonic()
+            if self._next_run.get(job.name, 0.0) <= now:
+                self._next_run[job.name] = now + job.interval_seconds
+                await self._run(job)
+
+    async def _loop(self):
+        while True:
+            await self.tick()
+            await asyncio.sleep(self.tick_seconds)
@@ -0,0 +1,225 @@
+"""Serialization cost of the hot JSON responses, before and after projected reads.
+
+Runs offline on representative documents (no server, no MongoDB) and
+reports for each response: the bytes MongoDB sends for the documents read
+(BSON), the bytes of the response body, and the CPU time per request spent
+turning documents into that body.
+
+"before" is what the handlers did until they read with projections: the
+whole document is fetched, validated into its model, and FastAPI validates
+the return value again against response_model, serializes it and encodes it
+with the stdlib json module. "after" calls the helpers the handlers use now
+(``projection``, ``documents_response``, ``model_response``)::
+
+    python serialization_bench.py
+    python serialization_bench.py --iterations 2000 --output serialization.json
+
+Pair it with ``loadtest.py calendar-browse``, whose summary includes the mean
+response size per operation, for the end-to-end picture.
+"""
+import argparse
+import json
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, List
+
+import bson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, TypeAdapter
+
+import server
+from server import (
+    AdminAppointment, Appointment, AvailabilityRange, CurrentUser, DayAvailability, TimeSlot, User, UserResponse,
+    documents_response, model_response, projection,
+)
+
+
+# ---------------------
+# Sample documents, shaped like the ones the API writes
+# ---------------------
+
+def user_doc() -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "first_name": "Giulia",
+        "last_name": "Bianchi",
+        "email": "giulia.bianchi@example.it",
+        "agency_name": "Immobiliare Navigli",
+        "agency_address": "Via Vigevano 18, 20144 Milano",
+        "partita_iva": "12345678901",
+        "sede_legale": "Via Vigevano 18, 20144 Milano",
+        "codice_univoco": "M5UXCR1",
+        "username": "navigli_giulia",
+        "hashed_password": "$2b$12$" + "x" * 53,
+        "is_verified": True,
+        "verification_token": None,
+        "created_at": datetime(2025, 3, 1, 9, 30, tzinfo=timezone.utc),
+    }
+
+
+def appointment_doc(n: int, user: dict) -> dict:
+    day = (date(2026, 1, 5) + timedelta(days=n // 8)).isoformat()
+    slot = server.schedule.default.times[n % len(server.schedule.default.times)]
+    created_at = datetime(2025, 12, 1, 10, 0, tzinfo=timezone.utc) + timedelta(minutes=n)
+    doc = {
+        "id": str(uuid.uuid4()),
+        "user_id": user["id"],
+        "user_name": f"{user['first_name']} {user['last_name']}",
+        "agency_name": user["agency_name"],
+        "date": day,
+        "time": slot,
+        "duration_minutes": 45,
+        "appointment_address": f"Corso Buenos Aires {n + 1}, 20124 Milano",
+        "contact_person": "Marco Rossi",
+        "contact_phone": "3381234567",
+        "intercom_name": "Rossi",
+        "status": "confirmed" if n % 3 else "pending",
+        "operator_id": server.schedule.primary.id,
+        "block_id": None,
+        "created_at": created_at,
+        "user_email": user["email"],
+        "slot_key": f"{day}|{slot}",
+        "user_slot_key": f"{user['id']}|{day}|{slot}",
+        "review_batch": str(uuid.uuid4()),
+        "history": [
+            {"from": None, "to": "pending", "action": "create", "actor": f"user:{user['id']}", "at": created_at},
+            {"from": "pending", "to": "confirmed", "action": "confirm", "actor": "admin:email",
+             "at": created_at + timedelta(hours=3)},
+        ],
+        "updated_at": created_at + timedelta(hours=3),
+    }
+    doc.update(server.due_times.for_appointment(day, slot, created_at))
+    return doc
+
+
+def project(doc: dict, fields: dict) -> dict:
+    """What MongoDB returns for ``doc`` read with ``fields``"""
+    return {k: v for k, v in doc.items() if fields.get(k)}
+
+
+# ---------------------
+# The two response paths
+# ---------------------
+
+@lru_cache(maxsize=None)
+def response_adapter(response_type) -> TypeAdapter:
+    # FastAPI builds these once per route, so they stay out of the timings
+    return TypeAdapter(response_type)
+
+
+def fastapi_body(response_type, content: Any) -> bytes:
+    """What FastAPI does with a handler's return value when response_model is set (pydantic v2)"""
+    adapter = response_adapter(response_type)
+    if isinstance(content, BaseModel):
+        content = content.model_dump()
+    elif isinstance(content, list):
+        content = [c.model_dump() if isinstance(c, BaseModel) else c for c in content]
+    return JSONResponse(adapter.dump_python(adapter.validate_python(content), mode="json")).body
+
+
+def availability_days(build_slot: Callable, build_day: Callable) -> List[DayAvailability]:
+    """A month as compute_availability builds it, with the given constructors"""
+    table = server.schedule.default
+    days = []
+    for n in range(31):
+        day = date(2026, 3, 1) + timedelta(days=n)
+        if day.weekday() >= 5:
+            days.append(build_day(date=day.isoformat(), slots=[]))
+            continue
+        days.append(build_day(date=day.isoformat(), slots=[
+            build_slot(time=t, available=i % 3 != 0, remaining=int(i % 3 != 0)) for i, t in enumerate(table.times)
+        ]))
+    return days
+
+
+def cases():
+    user = user_doc()
+    appointments = [appointment_doc(n, user) for n in range(100)]
+    pending = [appointment_doc(n, user) for n in range(200)]
+
+    def auth_me_before():
+        found = User(**user)
+        return fastapi_body(UserResponse, UserResponse(**{f: getattr(found, f) for f in UserResponse.model_fields}))
+
+    def auth_me_after():
+        return model_response(CurrentUser.model_construct(**project(user, projection(CurrentUser)))).body
+
+    def my_appointments_after():
+        fields = projection(Appointment)
+        return documents_response(Appointment, [project(doc, fields) for doc in appointments]).body
+
+    def admin_appointments_after():
+        fields = projection(AdminAppointment)
+        return documents_response(AdminAppointment, [project(doc, fields) for doc in pending]).body
+
+    def availability_before():
+        days = availability_days(TimeSlot, DayAvailability)
+        return fastapi_body(AvailabilityRange, AvailabilityRange(start_date="2026-03-01", end_date="2026-03-31", days=days))
+
+    def availability_after():
+        days = availability_days(TimeSlot.model_construct, DayAvailability.model_construct)
+        return model_response(AvailabilityRange.model_construct(
+            start_date="2026-03-01", end_date="2026-03-31", days=days
+        )).body
+
+    return {
+        # name: (docs read before, docs read after, before, after)
+        "auth_me": ([user], [project(user, projection(CurrentUser))], auth_me_before, auth_me_after),
+        "my_appointments": (
+            appointments, [project(doc, projection(Appointment)) for doc in appointments],
+            lambda: fastapi_body(List[Appointment], appointments), my_appointments_after,
+        ),
+        "admin_appointments": (
+            pending, [project(doc, projection(AdminAppointment)) for doc in pending],
+            lambda: fastapi_body(List[AdminAppointment], pending), admin_appointments_after,
+        ),
+        "availability_month": ([], [], availability_before, availability_after),
+    }
+
+
+def cpu_per_call(fn: Callable, iterations: int) -> float:
+    fn()  # warm up adapters and caches
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations
+
+
+def run(iterations: int) -> dict:
+    results = {}
+    for name, (docs_before, docs_after, before, after) in cases().items():
+        results[name] = {
+            "mongo_bytes_before": sum(len(bson.encode(doc)) for doc in docs_before),
+            "mongo_bytes_after": sum(len(bson.encode(doc)) for doc in docs_after),
+            "body_bytes_before": len(before()),
+            "body_bytes_after": len(after()),
+            "cpu_us_before": round(cpu_per_call(before, iterations) * 1e6, 1),
+            "cpu_us_after": round(cpu_per_call(after, iterations) * 1e6, 1),
+        }
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Serialization cost of the hot API responses, before and after")
+    parser.add_argument("--iterations", type=int, default=500, help="calls timed per response and path")
+    parser.add_argument("--output", help="write the JSON results here as well")
+    args = parser.parse_args(argv)
+
+    results = run(args.iterations)
+    for name, r in results.items():
+        print(
+            f"{name}: mongo {r['mongo_bytes_before']} -> {r['mongo_bytes_after']} B, "
+            f"body {r['body_bytes_before']} -> {r['body_bytes_after']} B, "
+            f"cpu {r['cpu_us_before']} -> {r['cpu_us_after']} us/request"
+        )
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
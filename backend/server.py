@@ -1,34 +1,53 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Form, Header, Query, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import asyncio
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, TypeAdapter
+from typing import List, Optional, Tuple, Type
+import hashlib
 import uuid
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 import secrets
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import requests
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from database import Database
+from email_outbox import EmailOutbox
+from idempotency import IdempotencyConflict, IdempotencyInProgress, IdempotencyStore
+from migrations import run_migrations
+from user_cache import UserCache
+from availability_cache import AvailabilityCache
+from password_hasher import PasswordHasher, PasswordHasherBusy
+from schedule import MINUTES_PER_DAY, DaySchedule, ScheduleEngine
+from travel import TravelPlanner
+from pagination import fetch_page, stream_ndjson
+from templating import TemplateRenderer
+import metrics
+from action_tokens import ActionTokenSigner, InvalidActionToken
+from rate_limit import MemoryBucketStore, RateLimited, RateLimiter, RateLimitMiddleware, RedisBucketStore, parse_rate
+import appointment_states
+from appointment_states import DueTimes, TransitionRejected, appointment_start
+from scheduler import Job, JobScheduler, LeaderLease
+from slot_events import SlotEventBroker, SLOT_CLAIMED, SLOT_RELEASED, CONFIRMED, REJECTED
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connection: configured here, opened by the app lifespan (pool settings in database.py)
+# tz_aware: timestamps are stored as BSON dates and read back as UTC-aware datetimes
+db = Database.from_env(os.environ, tz_aware=True, event_listeners=[metrics.MongoCommandListener()])
 
-# Create the main app without a prefix
-app = FastAPI()
+# Stored responses for retried POSTs carrying an Idempotency-Key; created by the lifespan
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+idempotency_store: Optional[IdempotencyStore] = None
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -38,203 +57,212 @@ SECRET_KEY = os.environ.get('JWT_SECRET', secrets.token_hex(32))
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes stored with a different cost are upgraded on the next successful login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 security = HTTPBearer()
 
+# bcrypt runs on a small dedicated pool so logins don't stall the event loop
+password_hasher = PasswordHasher(
+    pwd_context,
+    workers=int(os.environ.get('PASSWORD_HASH_WORKERS', '2')),
+    max_pending=int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '16')),
+)
+
+# Resolved users are cached per process so authenticated requests skip the users lookup
+user_cache = UserCache(
+    max_size=int(os.environ.get('USER_CACHE_MAX_SIZE', '1024')),
+    ttl_seconds=float(os.environ.get('USER_CACHE_TTL_SECONDS', '60')),
+)
+
+# Free slots per operator and date, invalidated by every appointment write (see appointment_changed)
+availability_cache = AvailabilityCache(
+    max_size=int(os.environ.get('AVAILABILITY_CACHE_MAX_SIZE', '512')),
+    ttl_seconds=float(os.environ.get('AVAILABILITY_CACHE_TTL_SECONDS', '30')),
+)
+
+# Opening hours, slot length, breaks, holidays and per-day overrides (see schedule.py)
+schedule = ScheduleEngine.from_env(os.environ)
+
+# Drops slots an operator can't reach from neighbouring bookings; on when TRAVEL_GAZETTEER_PATH is set
+travel_planner = TravelPlanner.from_env(os.environ, schedule.slot_minutes)
+
+# Client reminders, admin re-pings and expiry of unreviewed requests (see SCHEDULED JOBS)
+due_times = DueTimes.from_env(os.environ)
+
+# Live slot changes pushed to the booking calendar; SLOT_EVENTS_SOURCE=changestream on a replica set
+slot_events = SlotEventBroker(source=os.environ.get('SLOT_EVENTS_SOURCE', 'local'))
+
+# Email and admin page templates, compiled once at import
+templates = TemplateRenderer(ROOT_DIR / 'templates')
+
+# Signed, expiring tokens embedded in the admin confirm/reject links
+action_tokens = ActionTokenSigner(
+    os.environ.get('ACTION_TOKEN_SECRET', SECRET_KEY),
+    ttl_seconds=int(os.environ.get('ACTION_TOKEN_TTL_HOURS', '168')) * 3600,
+)
+
+# Token-bucket limits for the endpoints a scripted client could abuse ("count/period")
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+LOGIN_IP_RATE = parse_rate("login_ip", os.environ.get('RATE_LIMIT_LOGIN_IP', '20/minute'))
+LOGIN_USER_RATE = parse_rate("login_user", os.environ.get('RATE_LIMIT_LOGIN_USER', '5/minute'))
+REGISTER_IP_RATE = parse_rate("register_ip", os.environ.get('RATE_LIMIT_REGISTER_IP', '5/hour'))
+CONTACT_IP_RATE = parse_rate("contact_ip", os.environ.get('RATE_LIMIT_CONTACT_IP', '5/hour'))
+
+def rate_limit_store():
+    """Buckets are per process unless RATE_LIMIT_REDIS_URL points all replicas at one Redis"""
+    redis_url = os.environ.get('RATE_LIMIT_REDIS_URL')
+    if not redis_url:
+        return MemoryBucketStore(max_keys=int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000')))
+    import redis.asyncio as redis  # optional dependency, only needed for a shared store
+    return RedisBucketStore(redis.from_url(redis_url))
+
+rate_limiter = RateLimiter(rate_limit_store())
+
 # Email Configuration - Resend
 RESEND_API_KEY = os.environ.get('RESEND_API_KEY', '')
 ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL', 'info@spaziopratiche.it')
 FROM_EMAIL = "Spaziopratiche <noreply@spaziopratiche.it>"
 BACKEND_URL = "https://spaziopratiche-production.up.railway.app"
+RESEND_API_URL = os.environ.get('RESEND_API_URL', 'https://api.resend.com/emails')
+EMAIL_WORKERS = int(os.environ.get('EMAIL_WORKERS', '4'))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', '6'))
+EMAIL_TIMEOUT_SECONDS = float(os.environ.get('EMAIL_TIMEOUT_SECONDS', '10'))
+
+def create_email_outbox() -> EmailOutbox:
+    return EmailOutbox(
+        db.email_outbox,
+        api_url=RESEND_API_URL,
+        api_key=RESEND_API_KEY,
+        from_email=FROM_EMAIL,
+        workers=EMAIL_WORKERS,
+        max_attempts=EMAIL_MAX_ATTEMPTS,
+        timeout=EMAIL_TIMEOUT_SECONDS,
+    )
+
+# Created by the lifespan once the database is connected
+email_outbox: Optional[EmailOutbox] = None
 
 # =====================
 # EMAIL FUNCTIONS
 # =====================
 
-def send_email(to_email: str, subject: str, html_content: str):
-    """Send an email using Resend API"""
-    try:
-        logging.info(f"Attempting to send email to {to_email}")
-        response = requests.post(
-            "https://api.resend.com/emails",
-            headers={
-                "Authorization": f"Bearer {RESEND_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "from": FROM_EMAIL,
-                "to": [to_email],
-                "subject": subject,
-                "html": html_content
-            }
-        )
-        
-        logging.info(f"Resend response: {response.status_code} - {response.text}")
-        
-        if response.status_code in [200, 202]:
-            logging.info(f"Email sent to {to_email}")
-            return True
-        else:
-            logging.error(f"Failed to send email: {response.text}")
-            return False
-    except Exception as e:
-        logging.error(f"Failed to send email: {e}")
-        return False
+async def send_email(to_email: str, subject: str, html_content: str, text_content: Optional[str] = None) -> str:
+    """Queue an email for background delivery through Resend"""
+    logging.info(f"Queueing email to {to_email}")
+    return await email_outbox.enqueue(to_email, subject, html_content, text_content)
 
-def send_admin_notification(appointment: dict, user_email: str):
+def action_url(appointment_id: str, action: str) -> str:
+    """Admin email link for an action, carrying its signed token"""
+    token = action_tokens.sign(appointment_id, action)
+    return f"{BACKEND_URL}/api/appointments/{appointment_id}/{action}?token={token}"
+
+async def send_admin_notification(appointment: dict, user_email: str):
     """Send notification to admin with approve/reject buttons"""
-    date_formatted = datetime.strptime(appointment['date'], "%Y-%m-%d").strftime("%d/%m/%Y")
-    intercom_info = appointment.get('intercom_name', '') or 'Non specificato'
-    
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-            .header {{ background: linear-gradient(135deg, #0f172a, #0369a1); color: white; padding: 20px; border-radius: 10px 10px 0 0; }}
-            .content {{ background: #f8fafc; padding: 20px; border: 1px solid #e2e8f0; }}
-            .info-row {{ padding: 10px 0; border-bottom: 1px solid #e2e8f0; }}
-            .label {{ font-weight: bold; color: #64748b; }}
-            .highlight {{ background: #fef3c7; padding: 15px; border-radius: 8px; margin: 15px 0; border-left: 4px solid #f59e0b; }}
-            .buttons {{ padding: 20px; text-align: center; background: #f1f5f9; border-radius: 0 0 10px 10px; }}
-            .btn {{ display: inline-block; padding: 15px 40px; margin: 10px; text-decoration: none; border-radius: 25px; font-weight: bold; font-size: 16px; }}
-            .btn-yes {{ background: #22c55e; color: white; }}
-            .btn-no {{ background: #ef4444; color: white; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h2 style="margin:0;">📅 Nuova Richiesta Appuntamento</h2>
-            </div>
-            <div class="content">
-                <div class="info-row">
-                    <span class="label">Agenzia:</span> {appointment['agency_name']}
-                </div>
-                <div class="info-row">
-                    <span class="label">Referente:</span> {appointment['user_name']}
-                </div>
-                <div class="info-row">
-                    <span class="label">Email:</span> {user_email}
-                </div>
-                <div class="info-row">
-                    <span class="label">📅 Data:</span> <strong>{date_formatted}</strong>
-                </div>
-                <div class="info-row">
-                    <span class="label">🕐 Ora:</span> <strong>{appointment['time']}</strong> ({appointment['duration_minutes']} min)
-                </div>
-                
-                <div class="highlight">
-                    <h3 style="margin: 0 0 10px 0; color: #92400e;">📍 Dettagli Appuntamento</h3>
-                    <div class="info-row" style="border: none;">
-                        <span class="label">Indirizzo:</span> {appointment.get('appointment_address', 'N/A')}
-                    </div>
-                    <div class="info-row" style="border: none;">
-                        <span class="label">Presente:</span> {appointment.get('contact_person', 'N/A')}
-                    </div>
-                    <div class="info-row" style="border: none;">
-                        <span class="label">Telefono:</span> {appointment.get('contact_phone', 'N/A')}
-                    </div>
-                    <div class="info-row" style="border: none;">
-                        <span class="label">Citofono:</span> {intercom_info}
-                    </div>
-                </div>
-            </div>
-            <div class="buttons">
-                <p style="margin-bottom: 15px; color: #64748b;">Vuoi confermare questo appuntamento?</p>
-                <a href="{BACKEND_URL}/api/appointments/{appointment['id']}/confirm" class="btn btn-yes">✓ SÌ, CONFERMA</a>
-                <a href="{BACKEND_URL}/api/appointments/{appointment['id']}/reject" class="btn btn-no">✗ NO, RIFIUTA</a>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    
-    send_email(ADMIN_EMAIL, f"🗓️ Nuova richiesta appuntamento - {appointment['agency_name']}", html)
+    html, text = templates.render_email(
+        "admin_notification",
+        appointment=appointment,
+        user_email=user_email,
+        confirm_url=action_url(appointment['id'], "confirm"),
+        reject_url=action_url(appointment['id'], "reject"),
+    )
+    await send_email(ADMIN_EMAIL, f"🗓️ Nuova richiesta appuntamento - {appointment['agency_name']}", html, text)
+
+async def send_block_admin_notification(appointments: List[dict], user_email: str):
+    """One email for a whole block, with confirm/reject links for each appointment"""
+    if len(appointments) == 1:
+        await send_admin_notification(appointments[0], user_email)
+        return
+    html, text = templates.render_email(
+        "admin_block_notification",
+        appointments=appointments,
+        first=appointments[0],
+        user_email=user_email,
+        links={
+            apt['id']: (action_url(apt['id'], "confirm"), action_url(apt['id'], "reject"))
+            for apt in appointments
+        },
+    )
+    await send_email(
+        ADMIN_EMAIL,
+        f"🗓️ Nuova richiesta di {len(appointments)} appuntamenti - {appointments[0]['agency_name']}",
+        html, text
+    )
 
-def send_confirmation_email(appointment: dict, user_email: str):
+def confirmation_message(appointment: dict, user_email: str) -> dict:
+    html, text = templates.render_email("appointment_confirmed", appointment=appointment)
+    return {
+        "to_email": user_email,
+        "subject": "✓ Appuntamento Confermato - Spaziopratiche",
+        "html_content": html,
+        "text_content": text,
+    }
+
+def rejection_message(appointment: dict, user_email: str) -> dict:
+    html, text = templates.render_email("appointment_rejected", appointment=appointment)
+    return {
+        "to_email": user_email,
+        "subject": "Appuntamento Non Disponibile - Spaziopratiche",
+        "html_content": html,
+        "text_content": text,
+    }
+
+async def send_confirmation_email(appointment: dict, user_email: str):
     """Send confirmation email to client"""
-    date_formatted = datetime.strptime(appointment['date'], "%Y-%m-%d").strftime("%d/%m/%Y")
-    
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-            .header {{ background: linear-gradient(135deg, #22c55e, #16a34a); color: white; padding: 30px; border-radius: 10px 10px 0 0; text-align: center; }}
-            .content {{ background: #f8fafc; padding: 30px; border: 1px solid #e2e8f0; border-radius: 0 0 10px 10px; }}
-            .highlight {{ background: white; padding: 20px; border-radius: 10px; margin: 20px 0; border-left: 4px solid #22c55e; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1 style="margin:0;">✓ Appuntamento Confermato!</h1>
-            </div>
-            <div class="content">
-                <p>Gentile <strong>{appointment['user_name']}</strong>,</p>
-                
-                <p>Il tuo appuntamento del giorno <strong>{date_formatted}</strong> alle ore <strong>{appointment['time']}</strong> è confermato.</p>
-                
-                <div class="highlight">
-                    <strong>📍 Ci vediamo lì!</strong><br>
-                    Via Belfiore 9, 20149 Milano
-                </div>
-                
-                <p>Per qualsiasi necessità, contattaci ai numeri <strong>338/4071025</strong> o <strong>334/7077175</strong></p>
-                
-                <p>A presto,<br>
-                <strong>Il team di Spaziopratiche</strong></p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    
-    send_email(user_email, "✓ Appuntamento Confermato - Spaziopratiche", html)
+    await send_email(**confirmation_message(appointment, user_email))
 
-def send_rejection_email(appointment: dict, user_email: str):
+async def send_rejection_email(appointment: dict, user_email: str):
     """Send rejection email to client"""
-    date_formatted = datetime.strptime(appointment['date'], "%Y-%m-%d").strftime("%d/%m/%Y")
-    
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-            .header {{ background: linear-gradient(135deg, #f97316, #ea580c); color: white; padding: 30px; border-radius: 10px 10px 0 0; text-align: center; }}
-            .content {{ background: #f8fafc; padding: 30px; border: 1px solid #e2e8f0; border-radius: 0 0 10px 10px; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1 style="margin:0;">Appuntamento Non Disponibile</h1>
-            </div>
-            <div class="content">
-                <p>Gentile <strong>{appointment['user_name']}</strong>,</p>
-                
-                <p>Siamo spiacenti, ma l'appuntamento richiesto per il giorno <strong>{date_formatted}</strong> alle ore <strong>{appointment['time']}</strong> non è disponibile.</p>
-                
-                <p>Ti invitiamo a selezionare un'altra data o orario dalla nostra piattaforma di prenotazione.</p>
-                
-                <p>Per qualsiasi necessità, contattaci ai numeri <strong>338/4071025</strong> o <strong>334/7077175</strong></p>
-                
-                <p>Ci scusiamo per il disagio,<br>
-                <strong>Il team di Spaziopratiche</strong></p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    
-    send_email(user_email, "Appuntamento Non Disponibile - Spaziopratiche", html)
+    await send_email(**rejection_message(appointment, user_email))
+
+def reminder_message(appointment: dict, user_email: str) -> dict:
+    html, text = templates.render_email("appointment_reminder", appointment=appointment)
+    return {
+        "to_email": user_email,
+        "subject": "⏰ Promemoria Appuntamento - Spaziopratiche",
+        "html_content": html,
+        "text_content": text,
+    }
+
+def expiry_message(appointment: dict, user_email: str) -> dict:
+    html, text = templates.render_email("appointment_expired", appointment=appointment)
+    return {
+        "to_email": user_email,
+        "subject": "Richiesta di appuntamento scaduta - Spaziopratiche",
+        "html_content": html,
+        "text_content": text,
+    }
+
+async def send_pending_reminder(appointments: List[dict]):
+    """One email to the admin listing requests still waiting for a decision"""
+    html, text = templates.render_email(
+        "admin_pending_reminder",
+        appointments=appointments,
+        links={
+            apt['id']: (action_url(apt['id'], "confirm"), action_url(apt['id'], "reject"))
+            for apt in appointments
+        },
+    )
+    await send_email(ADMIN_EMAIL, f"⏳ {len(appointments)} richieste di appuntamento in attesa", html, text)
+
+def message_page(title: str, message: str, color: str = "#f97316", status_code: int = 200) -> HTMLResponse:
+    """Short result page shown to the admin after clicking an email link"""
+    return HTMLResponse(
+        content=templates.render("pages/message.html", title=title, message=message, color=color),
+        status_code=status_code
+    )
+
+def appointment_result_page(apt: dict, title: str, note: str, color: str, background: str) -> HTMLResponse:
+    return HTMLResponse(content=templates.render(
+        "pages/appointment_result.html",
+        appointment=apt, title=title, note=note, color=color, background=background
+    ))
 
 class StatusCheck(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -299,6 +327,8 @@ class User(BaseModel):
     username: str
     hashed_password: str
     is_verified: bool = False
+    # Grants the /api/admin endpoints; only ever set out of band (see admin_users.py)
+    is_admin: bool = False
     verification_token: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -314,7 +344,10 @@ class UserResponse(BaseModel):
     agency_name: str
     agency_address: str
     username: str
-    is_verified: bool
+    is_verified: bool = False
+
+# The authenticated user as handlers see it: no password hash, billing data or tokens
+CurrentUser = UserResponse
 
 class TokenResponse(BaseModel):
     access_token: str
@@ -331,6 +364,14 @@ class AppointmentCreate(BaseModel):
     contact_phone: str = Field(..., min_length=6, max_length=20)
     intercom_name: Optional[str] = Field(None, max_length=100)  # A chi citofonare (opzionale)
 
+MAX_BLOCK_SLOTS = 8
+MAX_BLOCK_WEEKS = 12
+
+class BlockBookingCreate(AppointmentCreate):
+    # date/time are the first slot of the first occurrence
+    slot_count: int = Field(1, ge=1, le=MAX_BLOCK_SLOTS)  # consecutive slots per occurrence
+    repeat_weeks: int = Field(1, ge=1, le=MAX_BLOCK_WEEKS)  # same weekday and time, N weeks in a row
+
 class Appointment(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -345,25 +386,84 @@ class Appointment(BaseModel):
     contact_phone: str = ""
     intercom_name: Optional[str] = None
     status: str = "confirmed"
+    operator_id: Optional[str] = None
+    block_id: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class BlockBookingResponse(BaseModel):
+    block_id: str
+    appointments: List[Appointment]
+
 class TimeSlot(BaseModel):
     time: str
     available: bool
+    remaining: int = 0  # operators still free for this slot
 
 class DayAvailability(BaseModel):
     date: str
     slots: List[TimeSlot]
 
+class AvailabilityRange(BaseModel):
+    start_date: str
+    end_date: str
+    days: List[DayAvailability]
+
+# =====================
+# SERIALIZATION
+# =====================
+
+def projection(model: Type[BaseModel], *extra: str) -> dict:
+    """Read only the fields ``model`` (plus ``extra``) needs from Mongo"""
+    return {"_id": 0, **{name: 1 for name in model.model_fields}, **{name: 1 for name in extra}}
+
+@lru_cache(maxsize=None)
+def list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+def documents_response(model: Type[BaseModel], docs: List[dict]) -> Response:
+    """List response for documents read with ``projection(model)``.
+
+    One TypeAdapter validates the list (filling the defaults older documents
+    lack) and pydantic-core writes the JSON bytes directly, instead of
+    FastAPI's response_model pass of validate, dump to Python, then encode.
+    """
+    adapter = list_adapter(model)
+    return Response(adapter.dump_json(adapter.validate_python(docs)), media_type="application/json")
+
+def model_response(model: BaseModel, headers: Optional[dict] = None) -> Response:
+    """A model built from trusted data, serialized once by pydantic-core instead of validated again"""
+    return Response(model.model_dump_json(), media_type="application/json", headers=headers)
+
 # =====================
 # AUTH HELPERS
 # =====================
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+def password_pool_busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Server occupato, riprova tra qualche secondo",
+        headers={"Retry-After": "1"}
+    )
+
+def too_many_requests(e: RateLimited) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Troppi tentativi, riprova più tardi",
+        headers={"Retry-After": e.retry_after_header}
+    )
+
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise password_pool_busy()
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Check a password; the second item is a replacement hash if the stored one is outdated"""
+    try:
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise password_pool_busy()
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
@@ -371,21 +471,62 @@ def create_access_token(data: dict) -> str:
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
+def decode_user_id(token: str) -> str:
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Token non valido")
-        
-        user_doc = await db.users.find_one({"id": user_id}, {"_id": 0})
-        if user_doc is None:
-            raise HTTPException(status_code=401, detail="Utente non trovato")
-        
-        return User(**user_doc)
     except JWTError:
         raise HTTPException(status_code=401, detail="Token non valido")
+    user_id = payload.get("sub")
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Token non valido")
+    return user_id
+
+async def get_current_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+    """Authenticate from the signed token alone, for endpoints that need no user fields"""
+    return decode_user_id(credentials.credentials)
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> CurrentUser:
+    user_id = decode_user_id(credentials.credentials)
+    
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    
+    user_doc = await db.users.find_one({"id": user_id}, projection(CurrentUser))
+    if user_doc is None:
+        raise HTTPException(status_code=401, detail="Utente non trovato")
+    
+    # Validated when the account was registered
+    user = CurrentUser.model_construct(**user_doc)
+    user_cache.set(user_id, user)
+    return user
+
+async def get_admin_user(current_user: CurrentUser = Depends(get_current_user)) -> CurrentUser:
+    # Read fresh rather than from the user cache, so a revoked admin loses access at once
+    if await db.users.find_one({"id": current_user.id, "is_admin": True}, {"_id": 1}) is None:
+        raise HTTPException(status_code=403, detail="Accesso riservato all'amministratore")
+    return current_user
+
+# =====================
+# IDEMPOTENT POSTS
+# =====================
+
+async def idempotent(scope: str, key: Optional[str], input: BaseModel, handler):
+    """Run ``handler`` once per Idempotency-Key; retries with the same key and body get its response back"""
+    if not key:
+        return await handler()
+    fingerprint = hashlib.sha256(input.model_dump_json().encode()).hexdigest()
+    try:
+        stored, replayed = await idempotency_store.execute(f"{scope}:{key}", fingerprint, handler)
+    except IdempotencyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key già usata per una richiesta diversa")
+    except IdempotencyInProgress:
+        raise HTTPException(
+            status_code=409, detail="Richiesta ancora in elaborazione, riprova tra poco", headers={"Retry-After": "1"}
+        )
+    return JSONResponse(
+        stored.body, status_code=stored.status_code, headers={"Idempotent-Replayed": "true"} if replayed else None
+    )
 
 # =====================
 # EXISTING ROUTES
@@ -395,73 +536,56 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 async def root():
     return {"message": "Spaziopratiche API"}
 
+async def paginated(response: Response, collection, query: dict, sort_field: str, limit: int, cursor: Optional[str]) -> List[dict]:
+    """Fetch one keyset page and expose the next cursor in the X-Next-Cursor header"""
+    try:
+        docs, next_cursor = await fetch_page(collection, query, sort_field, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursore non valido")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return docs
+
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.model_dump()
     status_obj = StatusCheck(**status_dict)
     doc = status_obj.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
     await db.status_checks.insert_one(doc)
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find({}, {"_id": 0}).to_list(1000)
-    for check in status_checks:
-        if isinstance(check['timestamp'], str):
-            check['timestamp'] = datetime.fromisoformat(check['timestamp'])
-    return status_checks
+async def get_status_checks(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    admin: CurrentUser = Depends(get_admin_user)
+):
+    """Newest status checks first; pass X-Next-Cursor back as ?cursor= for the next page"""
+    return await paginated(response, db.status_checks, {}, "timestamp", limit, cursor)
+
+@api_router.get("/status/export")
+async def export_status_checks(admin: CurrentUser = Depends(get_admin_user)):
+    """Stream every status check as NDJSON"""
+    return StreamingResponse(stream_ndjson(db.status_checks, {}, "timestamp"), media_type="application/x-ndjson")
 
 @api_router.post("/contact", response_model=ContactResponse)
-async def submit_contact(input: ContactRequestCreate):
+async def submit_contact(
+    input: ContactRequestCreate,
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
+    return await idempotent("contact", idempotency_key, input, lambda: save_contact_request(input))
+
+async def save_contact_request(input: ContactRequestCreate) -> ContactResponse:
     try:
         contact_dict = input.model_dump()
         contact_obj = ContactRequest(**contact_dict)
         doc = contact_obj.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
         await db.contact_requests.insert_one(doc)
         
         # Invia email di notifica
-        html_email = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background: linear-gradient(135deg, #0f172a, #0369a1); color: white; padding: 20px; border-radius: 10px 10px 0 0; }}
-                .content {{ background: #f8fafc; padding: 20px; border: 1px solid #e2e8f0; border-radius: 0 0 10px 10px; }}
-                .info-row {{ padding: 10px 0; border-bottom: 1px solid #e2e8f0; }}
-                .label {{ font-weight: bold; color: #64748b; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h2 style="margin:0;">📩 Nuova Richiesta dal Sito</h2>
-                </div>
-                <div class="content">
-                    <div class="info-row">
-                        <span class="label">Nome:</span> {input.name}
-                    </div>
-                    <div class="info-row">
-                        <span class="label">Email:</span> {input.email}
-                    </div>
-                    <div class="info-row">
-                        <span class="label">Telefono:</span> {input.phone or 'Non specificato'}
-                    </div>
-                    <div class="info-row">
-                        <span class="label">Servizio richiesto:</span> {input.service}
-                    </div>
-                    <div class="info-row">
-                        <span class="label">Messaggio:</span><br>{input.message}
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        send_email(ADMIN_EMAIL, f"📩 Nuova richiesta dal sito - {input.name}", html_email)
+        html_email, text_email = templates.render_email("contact_request", contact=input)
+        await send_email(ADMIN_EMAIL, f"📩 Nuova richiesta dal sito - {input.name}", html_email, text_email)
         
         return ContactResponse(
             success=True,
@@ -472,13 +596,38 @@ async def submit_contact(input: ContactRequestCreate):
         logging.error(f"Error submitting contact: {e}")
         raise HTTPException(status_code=500, detail="Errore nell'invio della richiesta")
 
+def contact_filters(status: Optional[str], service: Optional[str]) -> dict:
+    query = {}
+    if status:
+        query["status"] = status
+    if service:
+        query["service"] = service
+    return query
+
 @api_router.get("/contacts", response_model=List[ContactRequest])
-async def get_contacts():
-    contacts = await db.contact_requests.find({}, {"_id": 0}).to_list(1000)
-    for contact in contacts:
-        if isinstance(contact['created_at'], str):
-            contact['created_at'] = datetime.fromisoformat(contact['created_at'])
-    return contacts
+async def get_contacts(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    service: Optional[str] = None,
+    admin: CurrentUser = Depends(get_admin_user)
+):
+    """Newest contact requests first; pass X-Next-Cursor back as ?cursor= for the next page"""
+    return await paginated(
+        response, db.contact_requests, contact_filters(status, service), "created_at", limit, cursor
+    )
+
+@api_router.get("/contacts/export")
+async def export_contacts(
+    status: Optional[str] = None, service: Optional[str] = None, admin: CurrentUser = Depends(get_admin_user)
+):
+    """Stream the full contact history as NDJSON without loading it in memory"""
+    return StreamingResponse(
+        stream_ndjson(db.contact_requests, contact_filters(status, service), "created_at"),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="contacts.ndjson"'}
+    )
 
 # =====================
 # AUTH ROUTES
@@ -508,14 +657,19 @@ async def register(input: UserCreate):
         sede_legale=input.sede_legale,
         codice_univoco=input.codice_univoco,
         username=input.username,
-        hashed_password=hash_password(input.password),
+        hashed_password=await hash_password(input.password),
         verification_token=verification_token,
         is_verified=True  # Per demo, auto-verificato
     )
     
     doc = user.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.users.insert_one(doc)
+    try:
+        await db.users.insert_one(doc)
+    except DuplicateKeyError as e:
+        # Someone registered the same username or email between the checks above and the insert
+        if "email" in (e.details or {}).get("keyPattern", {}):
+            raise HTTPException(status_code=400, detail="Email già registrata")
+        raise HTTPException(status_code=400, detail="Username già in uso")
     
     # In produzione qui invieremmo l'email di verifica
     # Per la demo, l'utente è già verificato
@@ -536,76 +690,213 @@ async def verify_email(token: str):
         {"verification_token": token},
         {"$set": {"is_verified": True, "verification_token": None}}
     )
+    user_cache.invalidate(user['id'])
     
     return {"success": True, "message": "Email verificata con successo!"}
 
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(input: UserLogin):
-    user_doc = await db.users.find_one({"username": input.username}, {"_id": 0})
+    if RATE_LIMIT_ENABLED:
+        # Per account, on top of the per-IP limit: slows guessing spread over many addresses
+        try:
+            await rate_limiter.hit(input.username.lower(), LOGIN_USER_RATE)
+        except RateLimited as e:
+            raise too_many_requests(e)
+    
+    user_doc = await db.users.find_one({"username": input.username}, projection(UserResponse, "hashed_password"))
     
     if not user_doc:
         raise HTTPException(status_code=401, detail="Credenziali non valide")
     
-    if not verify_password(input.password, user_doc['hashed_password']):
+    valid, new_hash = await verify_password(input.password, user_doc['hashed_password'])
+    if not valid:
         raise HTTPException(status_code=401, detail="Credenziali non valide")
     
+    if new_hash:
+        # The bcrypt cost changed since this hash was stored
+        await db.users.update_one({"id": user_doc['id']}, {"$set": {"hashed_password": new_hash}})
+        user_cache.invalidate(user_doc['id'])
+    
     if not user_doc.get('is_verified', False):
         raise HTTPException(status_code=401, detail="Email non verificata. Controlla la tua casella di posta.")
     
     access_token = create_access_token({"sub": user_doc['id']})
     
-    return TokenResponse(
-        access_token=access_token,
-        user=UserResponse(
-            id=user_doc['id'],
-            first_name=user_doc['first_name'],
-            last_name=user_doc['last_name'],
-            email=user_doc['email'],
-            agency_name=user_doc['agency_name'],
-            agency_address=user_doc['agency_address'],
-            username=user_doc['username'],
-            is_verified=user_doc['is_verified']
-        )
-    )
+    del user_doc['hashed_password']
+    return model_response(TokenResponse.model_construct(
+        access_token=access_token, user=UserResponse.model_construct(**user_doc)
+    ))
 
 @api_router.get("/auth/me", response_model=UserResponse)
-async def get_me(current_user: User = Depends(get_current_user)):
-    return UserResponse(
-        id=current_user.id,
-        first_name=current_user.first_name,
-        last_name=current_user.last_name,
-        email=current_user.email,
-        agency_name=current_user.agency_name,
-        agency_address=current_user.agency_address,
-        username=current_user.username,
-        is_verified=current_user.is_verified
-    )
+async def get_me(current_user: CurrentUser = Depends(get_current_user)):
+    return model_response(current_user)
 
 # =====================
 # APPOINTMENT ROUTES
 # =====================
 
-def generate_time_slots():
-    """Generate all possible time slots from 09:00 to 18:00 (45 min each)"""
-    slots = []
-    start_hour = 9
-    end_hour = 18
+# Longest window served by the range endpoint (a calendar month plus padding)
+MAX_AVAILABILITY_RANGE_DAYS = 62
+
+async def free_capacity(days: List[Tuple[str, DaySchedule]], fresh: bool = False) -> dict:
+    """Per (date, table): operator id -> bitmask of the slots that operator still has free.
+
+    Served from the cache, with one query for the dates it misses; ``fresh``
+    skips the cache lookup (but refreshes it), for the booking paths.
+    """
+    capacity, missing = {}, {}
+    for day_str, table in days:
+        free = None if fresh else availability_cache.get(day_str)
+        if free is None:
+            missing[day_str] = (table, availability_cache.generation(day_str))
+        else:
+            capacity[day_str] = free
+    if not missing:
+        return capacity
+    
+    booked = await db.appointments.find(
+        {"date": {"$in": list(missing)}, "status": {"$ne": "cancelled"}},
+        {"_id": 0, "date": 1, "time": 1, "operator_id": 1}
+    ).to_list(None)
+    booked_by_day = {}
+    for apt in booked:
+        # Appointments from before operators existed belong to the primary operator
+        operator_id = apt.get('operator_id') or schedule.primary.id
+        booked_by_day.setdefault((apt['date'], operator_id), []).append(apt['time'])
+    for day_str, (table, generation) in missing.items():
+        day = datetime.strptime(day_str, "%Y-%m-%d").date()
+        capacity[day_str] = {
+            operator.id: working & ~table.mask_of(booked_by_day.get((day_str, operator.id), ()))
+            for operator, working in schedule.staff(day, table)
+        }
+        availability_cache.set(day_str, capacity[day_str], generation)
+    return capacity
+
+async def reachable_slots(days: List[Tuple[str, DaySchedule]], address: Optional[str]) -> dict:
+    """Per date: operator id -> slots they could reach for a visit at ``address``.
+
+    Empty (no restriction) unless travel-aware scheduling is on and an address
+    is given. One query for all the dates; operators without bookings are omitted.
+    """
+    if travel_planner is None or not address:
+        return {}
+    booked = await db.appointments.find(
+        {"date": {"$in": [day_str for day_str, _ in days]}, "status": {"$ne": "cancelled"}},
+        {"_id": 0, "date": 1, "time": 1, "operator_id": 1, "appointment_address": 1}
+    ).to_list(None)
+    by_operator = {}
+    for apt in booked:
+        operator_id = apt.get('operator_id') or schedule.primary.id
+        by_operator.setdefault((apt['date'], operator_id), []).append(apt)
+    tables = dict(days)
+    reachable = {}
+    for (day_str, operator_id), apts in by_operator.items():
+        table = tables[day_str]
+        stops = [(table.index[a['time']], a.get('appointment_address') or "") for a in apts if a['time'] in table.index]
+        reachable.setdefault(day_str, {})[operator_id] = travel_planner.reachable(table, stops, address)
+    return reachable
+
+def operators_for(day_str: str, table: DaySchedule, free: dict, block: int,
+                  reachable: Optional[dict] = None) -> List[str]:
+    """Operators with every slot of ``block`` free (and reachable), least booked that day first"""
+    day = datetime.strptime(day_str, "%Y-%m-%d").date()
+    candidates = []
+    for order, (operator, working) in enumerate(schedule.staff(day, table)):
+        operator_free = free.get(operator.id, 0) & (reachable or {}).get(operator.id, table.full_mask)
+        if operator_free & block == block:
+            load = bin(working).count("1") - bin(free.get(operator.id, 0)).count("1")
+            candidates.append((load, order, operator.id))
+    return [operator_id for _, _, operator_id in sorted(candidates)]
+
+async def compute_availability(start: datetime, end: datetime, address: Optional[str] = None) -> List[DayAvailability]:
+    """Build the slot grid for every day from start to end (inclusive).
+
+    One query, plus one more when an address asks for travel-aware filtering.
+    """
+    # Weekends, holidays and closed days have no table and no slots
+    tables = []
+    for day_index in range((end - start).days + 1):
+        day = start + timedelta(days=day_index)
+        tables.append((day.strftime("%Y-%m-%d"), schedule.for_day(day.date())))
+    open_days = [(day_str, table) for day_str, table in tables if table is not None]
+    capacity = await free_capacity(open_days)
+    reachable = await reachable_slots(open_days, address)
+    
+    # RULE 1: Must book at least 24 hours in advance (minutes from the start of the window).
+    # Applied here rather than cached, so cached days stay valid as time passes.
+    cutoff_minutes = (datetime.now() + timedelta(hours=24) - start).total_seconds() / 60
+    
+    days = []
+    for day_index, (day_str, table) in enumerate(tables):
+        if table is None:
+            days.append(DayAvailability.model_construct(date=day_str, slots=[]))
+            continue
+        
+        bookable = table.bookable_from(cutoff_minutes - day_index * MINUTES_PER_DAY)
+        reach = reachable.get(day_str, {})
+        frees = [free & bookable & reach.get(op, table.full_mask) for op, free in capacity[day_str].items()]
+        # Built from our own schedule tables: nothing to validate
+        days.append(DayAvailability.model_construct(date=day_str, slots=[
+            TimeSlot.model_construct(time=time_slot, available=remaining > 0, remaining=remaining)
+            for time_slot, remaining in zip(table.times, (
+                sum(free >> i & 1 for free in frees) for i in range(len(table.times))
+            ))
+        ]))
+    
+    return days
+
+def availability_etag(days: List[DayAvailability]) -> str:
+    digest = hashlib.blake2b(digest_size=12)
+    for day in days:
+        digest.update(day.date.encode())
+        for slot in day.slots:
+            digest.update(f"{slot.time}{slot.remaining}".encode())
+    return f'W/"{digest.hexdigest()}"'
+
+def conditional(request: Request, days: List[DayAvailability], body: BaseModel) -> Response:
+    """``body`` tagged with the ETag of ``days``, or a 304 if the client already has this version"""
+    etag = availability_etag(days)
+    # no-cache: the browser keeps the body but revalidates every time, getting 304s while nothing changed
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in (tag.strip() for tag in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=headers)
+    return model_response(body, headers)
+
+@api_router.get("/appointments/availability", response_model=AvailabilityRange)
+async def get_availability_range(
+    request: Request,
+    from_date: str = Query(..., alias="from"),
+    to_date: str = Query(..., alias="to"),
+    address: Optional[str] = None,
+    current_user_id: str = Depends(get_current_user_id)
+):
+    """Get available time slots for every day in a date range (e.g. a whole calendar month)"""
+    try:
+        start = datetime.strptime(from_date, "%Y-%m-%d")
+        end = datetime.strptime(to_date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Formato data non valido. Usa YYYY-MM-DD")
     
-    current = datetime.strptime(f"{start_hour}:00", "%H:%M")
-    end = datetime.strptime(f"{end_hour}:00", "%H:%M")
+    if end < start:
+        raise HTTPException(status_code=400, detail="Intervallo di date non valido")
     
-    while current < end:
-        # Check if there's enough time for a 45 min appointment
-        end_time = current + timedelta(minutes=45)
-        if end_time <= end:
-            slots.append(current.strftime("%H:%M"))
-        current = current + timedelta(minutes=45)
+    if (end - start).days + 1 > MAX_AVAILABILITY_RANGE_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Puoi richiedere al massimo {MAX_AVAILABILITY_RANGE_DAYS} giorni alla volta"
+        )
     
-    return slots
+    days = await compute_availability(start, end, address)
+    return conditional(request, days, AvailabilityRange.model_construct(
+        start_date=from_date, end_date=to_date, days=days
+    ))
 
 @api_router.get("/appointments/availability/{date}", response_model=DayAvailability)
-async def get_availability(date: str, current_user: User = Depends(get_current_user)):
-    """Get available time slots for a specific date"""
+async def get_availability(
+    date: str, request: Request, address: Optional[str] = None,
+    current_user_id: str = Depends(get_current_user_id)
+):
+    """Get available time slots for a specific date (for a visit at ``address``, if given)"""
     # Validate date format
     try:
         date_obj = datetime.strptime(date, "%Y-%m-%d")
@@ -613,304 +904,686 @@ async def get_availability(date: str, current_user: User = Depends(get_current_u
         raise HTTPException(status_code=400, detail="Formato data non valido. Usa YYYY-MM-DD")
     
     # Don't allow past dates
-    now = datetime.now()
-    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
     if date_obj < today:
         raise HTTPException(status_code=400, detail="Non puoi prenotare date passate")
     
-    # RULE 1: Must book at least 24 hours in advance
-    min_booking_time = now + timedelta(hours=24)
-    
-    # Don't allow weekends
-    if date_obj.weekday() >= 5:
+    # Don't allow weekends, holidays and closed days
+    if schedule.for_day(date_obj.date()) is None:
         return DayAvailability(date=date, slots=[])
     
-    # Get all time slots
-    all_slots = generate_time_slots()
-    
-    # Get booked appointments for this date
-    booked = await db.appointments.find(
-        {"date": date, "status": {"$ne": "cancelled"}},
-        {"_id": 0, "time": 1}
-    ).to_list(100)
-    
-    booked_times = {apt['time'] for apt in booked}
-    
-    # Build availability response
-    slots = []
-    for time_slot in all_slots:
-        # Check if this slot is at least 24h in the future
-        slot_datetime = datetime.strptime(f"{date} {time_slot}", "%Y-%m-%d %H:%M")
-        is_24h_ahead = slot_datetime >= min_booking_time
-        
-        slots.append(TimeSlot(
-            time=time_slot,
-            available=(time_slot not in booked_times) and is_24h_ahead
-        ))
-    
-    return DayAvailability(date=date, slots=slots)
+    days = await compute_availability(date_obj, date_obj, address)
+    return conditional(request, days, days[0])
 
-@api_router.post("/appointments", response_model=Appointment)
-async def create_appointment(input: AppointmentCreate, current_user: User = Depends(get_current_user)):
-    """Create a new appointment"""
-    # Validate date
+def appointment_changed(event_type: str, appointment: dict):
+    """Every appointment write ends here: drop the cached availability of its date and tell the calendars"""
+    availability_cache.invalidate(appointment['date'])
+    slot_events.notify(event_type, appointment)
+
+def slot_key(date: str, time: str, operator_id: Optional[str] = None) -> str:
+    """Key of one operator's slot; held by at most one non-cancelled appointment.
+
+    The primary operator keeps the original date|time key, which existing
+    appointments already hold.
+    """
+    if operator_id is None or operator_id == schedule.primary.id:
+        return f"{date}|{time}"
+    return f"{date}|{time}|{operator_id}"
+
+def user_slot_key(user_id: str, date: str, time: str) -> str:
+    """Key of one user's slot: held once whichever operator takes it, so one user can't book a time twice"""
+    return f"{user_id}|{date}|{time}"
+
+def claims_own_slot(error: dict) -> bool:
+    """True if a duplicate key error (details or bulk write error) collided on the user's own slot"""
+    return "user_slot_key" in (error or {}).get("keyPattern", {})
+
+def slot_unavailable(date_str: str, table: DaySchedule, free: dict, block: int) -> HTTPException:
+    """Why no operator can take the slots: all booked, or only unreachable from their other visits"""
+    if operators_for(date_str, table, free, block):
+        return HTTPException(
+            status_code=400,
+            detail=f"Non c'è tempo per raggiungere l'indirizzo dagli appuntamenti vicini del {date_str}"
+        )
+    return HTTPException(status_code=400, detail="Questo slot è già prenotato")
+
+def plan_slots(date_str: str, time: str, count: int, user_times: List[str]) -> Tuple[DaySchedule, int]:
+    """Validate ``count`` consecutive slots from ``time`` on one day; return the table and their mask"""
     try:
-        date_obj = datetime.strptime(input.date, "%Y-%m-%d")
+        date_obj = datetime.strptime(date_str, "%Y-%m-%d")
     except ValueError:
         raise HTTPException(status_code=400, detail="Formato data non valido")
     
-    # RULE 1: Must book at least 24 hours in advance
-    now = datetime.now()
-    slot_datetime = datetime.strptime(f"{input.date} {input.time}", "%Y-%m-%d %H:%M")
-    min_booking_time = now + timedelta(hours=24)
-    
-    if slot_datetime < min_booking_time:
-        raise HTTPException(status_code=400, detail="Devi prenotare con almeno 24 ore di anticipo")
-    
-    # Check if slot is available (globally)
-    existing = await db.appointments.find_one({
-        "date": input.date,
-        "time": input.time,
-        "status": {"$ne": "cancelled"}
-    })
-    
-    if existing:
-        raise HTTPException(status_code=400, detail="Questo slot è già prenotato")
+    table = schedule.for_day(date_obj.date())
+    if table is None:
+        raise HTTPException(status_code=400, detail=f"Non è possibile prenotare in questo giorno ({date_str})")
     
     # Validate time slot
-    valid_slots = generate_time_slots()
-    if input.time not in valid_slots:
+    slot_index = table.index.get(time)
+    if slot_index is None:
         raise HTTPException(status_code=400, detail="Orario non valido")
+    block = table.run(slot_index, count)
+    if block is None:
+        raise HTTPException(
+            status_code=400, detail="Gli slot richiesti non sono consecutivi (orario di chiusura o pausa)"
+        )
     
-    # RULE 2: If user already has appointments on this day, new one must be consecutive
-    user_appointments_today = await db.appointments.find(
-        {"date": input.date, "user_id": current_user.id, "status": {"$ne": "cancelled"}},
-        {"_id": 0, "time": 1}
-    ).to_list(100)
-    
-    if user_appointments_today:
-        # Get user's booked times for this day
-        user_times = sorted([apt['time'] for apt in user_appointments_today])
-        new_slot_index = valid_slots.index(input.time)
-        
-        # Check if new slot is consecutive to any existing slot
-        is_consecutive = False
-        for existing_time in user_times:
-            existing_index = valid_slots.index(existing_time)
-            # Consecutive means immediately before or after
-            if abs(new_slot_index - existing_index) == 1:
-                is_consecutive = True
-                break
-            # Also check if it connects two existing slots
-            for other_time in user_times:
-                other_index = valid_slots.index(other_time)
-                if new_slot_index == existing_index + 1 and new_slot_index == other_index - 1:
-                    is_consecutive = True
-                    break
-        
-        if not is_consecutive:
-            raise HTTPException(
-                status_code=400, 
-                detail="Se prenoti più appuntamenti nello stesso giorno, devono essere consecutivi"
-            )
+    # RULE 1: Must book at least 24 hours in advance
+    slot_datetime = date_obj + timedelta(minutes=table.offsets[slot_index])
+    if slot_datetime < datetime.now() + timedelta(hours=24):
+        raise HTTPException(status_code=400, detail="Devi prenotare con almeno 24 ore di anticipo")
     
-    # Create appointment with PENDING status
+    # RULE 2: If user already has appointments on this day, new ones must be consecutive
+    # (and not on top of them: another operator being free doesn't make the user free)
+    held = table.mask_of(user_times)
+    if held & block:
+        raise HTTPException(status_code=400, detail="Hai già un appuntamento in questo orario")
+    if user_times and not table.touches(held, block):
+        raise HTTPException(
+            status_code=400, 
+            detail="Se prenoti più appuntamenti nello stesso giorno, devono essere consecutivi"
+        )
+    return table, block
+
+def new_appointment_doc(input: AppointmentCreate, current_user: CurrentUser, date: str, time: str,
+                        operator_id: str, block_id: Optional[str] = None) -> dict:
+    """A pending appointment document, ready to insert (its slot keys claim the slot)"""
     appointment = Appointment(
         user_id=current_user.id,
         user_name=f"{current_user.first_name} {current_user.last_name}",
         agency_name=current_user.agency_name,
-        date=input.date,
-        time=input.time,
+        date=date,
+        time=time,
         appointment_address=input.appointment_address,
         contact_person=input.contact_person,
         contact_phone=input.contact_phone,
         intercom_name=input.intercom_name,
-        status="pending"  # Pending until admin confirms
+        status="pending",  # Pending until admin confirms
+        operator_id=operator_id,
+        block_id=block_id
     )
-    
     doc = appointment.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     doc['user_email'] = current_user.email  # Store email for confirmation
-    await db.appointments.insert_one(doc)
+    doc['slot_key'] = slot_key(date, time, operator_id)
+    doc['user_slot_key'] = user_slot_key(current_user.id, date, time)
+    doc.update(due_times.for_appointment(date, time, appointment.created_at))
+    doc['history'] = [{
+        "from": None, "to": appointment.status, "action": "create",
+        "actor": f"user:{current_user.id}", "at": appointment.created_at
+    }]
+    return doc
+
+async def user_times_by_day(user_id: str, dates: List[str]) -> dict:
+    """Times the user already holds on each of the given days"""
+    booked = await db.appointments.find(
+        {"date": {"$in": dates}, "user_id": user_id, "status": {"$ne": "cancelled"}},
+        {"_id": 0, "date": 1, "time": 1}
+    ).to_list(None)
+    by_day = {}
+    for apt in booked:
+        by_day.setdefault(apt['date'], []).append(apt['time'])
+    return by_day
+
+@api_router.post("/appointments", response_model=Appointment)
+async def create_appointment(
+    input: AppointmentCreate,
+    current_user: CurrentUser = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
+    """Create a new appointment"""
+    return await idempotent(
+        f"appointments:{current_user.id}", idempotency_key, input, lambda: book_appointment(input, current_user)
+    )
+
+async def book_appointment(input: AppointmentCreate, current_user: CurrentUser) -> Appointment:
+    user_times = await user_times_by_day(current_user.id, [input.date])
+    table, block = plan_slots(input.date, input.time, 1, user_times.get(input.date, []))
+    capacity = await free_capacity([(input.date, table)], fresh=True)
+    reachable = await reachable_slots([(input.date, table)], input.appointment_address)
+    operators = operators_for(input.date, table, capacity[input.date], block, reachable.get(input.date))
+    if not operators:
+        raise slot_unavailable(input.date, table, capacity[input.date], block)
+    
+    # The unique index on slot_key makes the insert itself the claim on an operator's slot:
+    # of several concurrent bookings for it exactly one succeeds, the others try the next operator.
+    # The one on user_slot_key does the same for the user, whose concurrent requests may pick different operators.
+    for operator_id in operators:
+        doc = new_appointment_doc(input, current_user, input.date, input.time, operator_id)
+        try:
+            await db.appointments.insert_one(doc)
+            break
+        except DuplicateKeyError as e:
+            if claims_own_slot(e.details):
+                raise HTTPException(status_code=400, detail="Hai già un appuntamento in questo orario")
+            continue
+    else:
+        raise HTTPException(status_code=400, detail="Questo slot è già prenotato")
+    appointment_changed(SLOT_CLAIMED, doc)
     
     # Send notification email to admin
-    send_admin_notification(doc, current_user.email)
+    await send_admin_notification(doc, current_user.email)
     
-    return appointment
+    return Appointment(**doc)
+
+async def claim_block_occurrence(input: BlockBookingCreate, current_user: CurrentUser, date_str: str,
+                                 table: DaySchedule, block: int, operators: List[str], block_id: str) -> List[dict]:
+    """Claim one occurrence's slots for the first of ``operators`` who still has them all.
+
+    As in book_appointment, an operator whose slot was taken since capacity was
+    read is skipped for the next one, after removing what was inserted for them.
+    """
+    times = [time_slot for time_slot, in_block in table.slots(block) if in_block]
+    for operator_id in operators:
+        docs = [new_appointment_doc(input, current_user, date_str, time_slot, operator_id, block_id) for time_slot in times]
+        try:
+            await db.appointments.insert_many(docs, ordered=True)
+            return docs
+        except BulkWriteError as e:
+            await db.appointments.delete_many({"block_id": block_id, "date": date_str})
+            duplicates = [err for err in e.details.get("writeErrors", []) if err.get("code") == 11000]
+            if any(claims_own_slot(err) for err in duplicates):
+                raise HTTPException(status_code=400, detail="Hai già un appuntamento in uno degli orari richiesti")
+            if not duplicates:
+                raise
+    raise HTTPException(status_code=400, detail="Uno o più slot richiesti sono già prenotati")
+
+@api_router.post("/appointments/block", response_model=BlockBookingResponse)
+async def create_block_booking(
+    input: BlockBookingCreate,
+    current_user: CurrentUser = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
+    """Book several consecutive slots, optionally on the same weekday for several weeks: all or none"""
+    return await idempotent(
+        f"appointments_block:{current_user.id}", idempotency_key, input, lambda: book_block(input, current_user)
+    )
+
+async def book_block(input: BlockBookingCreate, current_user: CurrentUser) -> BlockBookingResponse:
+    try:
+        first_day = datetime.strptime(input.date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Formato data non valido")
+    dates = [(first_day + timedelta(weeks=w)).strftime("%Y-%m-%d") for w in range(input.repeat_weeks)]
+    
+    # Validate every occurrence before claiming anything
+    user_times = await user_times_by_day(current_user.id, dates)
+    plans = [
+        (date_str, *plan_slots(date_str, input.time, input.slot_count, user_times.get(date_str, [])))
+        for date_str in dates
+    ]
+    days = [(date_str, table) for date_str, table, _ in plans]
+    capacity = await free_capacity(days, fresh=True)
+    reachable = await reachable_slots(days, input.appointment_address)
+    
+    # Each occurrence goes to one operator: candidates are those free for all its slots, least booked first
+    candidates = []
+    for date_str, table, block in plans:
+        operators = operators_for(date_str, table, capacity[date_str], block, reachable.get(date_str))
+        if not operators:
+            raise slot_unavailable(date_str, table, capacity[date_str], block)
+        candidates.append((date_str, table, block, operators))
+    
+    block_id = str(uuid.uuid4())
+    docs = []
+    try:
+        for date_str, table, block, operators in candidates:
+            docs.extend(await claim_block_occurrence(input, current_user, date_str, table, block, operators, block_id))
+    except Exception:
+        # All or none: release the occurrences already claimed. A block that never went through leaves
+        # no appointments behind; change stream subscribers see the deletes as releases of the slots.
+        await db.appointments.delete_many({"block_id": block_id})
+        availability_cache.invalidate(*dates)
+        raise
+    for doc in docs:
+        appointment_changed(SLOT_CLAIMED, doc)
+    
+    await send_block_admin_notification(docs, current_user.email)
+    
+    return BlockBookingResponse(block_id=block_id, appointments=[Appointment(**doc) for doc in docs])
+
+@api_router.get("/appointments/stream")
+async def stream_slot_events(request: Request, token: str):
+    """Server-Sent Events feed of slot changes.
+
+    EventSource cannot send headers, so the access token travels as ?token=.
+    """
+    decode_user_id(token)
+    return StreamingResponse(
+        slot_events.stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @api_router.get("/appointments/my", response_model=List[Appointment])
-async def get_my_appointments(current_user: User = Depends(get_current_user)):
+async def get_my_appointments(current_user: CurrentUser = Depends(get_current_user)):
     """Get current user's appointments"""
     appointments = await db.appointments.find(
         {"user_id": current_user.id, "status": {"$ne": "cancelled"}},
-        {"_id": 0}
+        projection(Appointment)
     ).sort("date", 1).to_list(100)
     
-    for apt in appointments:
-        if isinstance(apt.get('created_at'), str):
-            apt['created_at'] = datetime.fromisoformat(apt['created_at'])
-    
-    return appointments
+    return documents_response(Appointment, appointments)
 
 @api_router.delete("/appointments/{appointment_id}")
-async def cancel_appointment(appointment_id: str, current_user: User = Depends(get_current_user)):
+async def cancel_appointment(appointment_id: str, current_user: CurrentUser = Depends(get_current_user)):
     """Cancel an appointment"""
-    apt = await db.appointments.find_one({"id": appointment_id, "user_id": current_user.id})
-    
-    if not apt:
-        raise HTTPException(status_code=404, detail="Appuntamento non trovato")
+    try:
+        # Cancelling also releases the slot key, freeing the slot for new bookings
+        apt = await appointment_states.transition(
+            db.appointments, appointment_id, "cancel",
+            actor=f"user:{current_user.id}", extra_filter={"user_id": current_user.id}
+        )
+    except TransitionRejected as e:
+        if e.status is None:
+            raise HTTPException(status_code=404, detail="Appuntamento non trovato")
+        # Already cancelled: nothing to do
+        return {"success": True, "message": "Appuntamento cancellato"}
     
-    await db.appointments.update_one(
-        {"id": appointment_id},
-        {"$set": {"status": "cancelled"}}
-    )
+    appointment_changed(SLOT_RELEASED, apt)
     
     return {"success": True, "message": "Appuntamento cancellato"}
 
-@api_router.get("/appointments/{appointment_id}/confirm", response_class=HTMLResponse)
-async def confirm_appointment(appointment_id: str):
-    """Confirm an appointment (called by admin via email link)"""
-    apt = await db.appointments.find_one({"id": appointment_id}, {"_id": 0})
-    
-    if not apt:
-        return HTMLResponse(content="""
-            <html><body style="font-family: Arial; text-align: center; padding: 50px;">
-                <h1 style="color: #ef4444;">❌ Appuntamento non trovato</h1>
-                <p>L'appuntamento richiesto non esiste.</p>
-            </body></html>
-        """, status_code=404)
-    
-    if apt.get('status') == 'confirmed':
-        return HTMLResponse(content="""
-            <html><body style="font-family: Arial; text-align: center; padding: 50px;">
-                <h1 style="color: #f97316;">⚠️ Già confermato</h1>
-                <p>Questo appuntamento era già stato confermato.</p>
-            </body></html>
-        """)
-    
-    if apt.get('status') == 'rejected':
-        return HTMLResponse(content="""
-            <html><body style="font-family: Arial; text-align: center; padding: 50px;">
-                <h1 style="color: #f97316;">⚠️ Già rifiutato</h1>
-                <p>Questo appuntamento era già stato rifiutato.</p>
-            </body></html>
-        """)
-    
-    # Update status to confirmed
-    await db.appointments.update_one(
-        {"id": appointment_id},
-        {"$set": {"status": "confirmed"}}
+def transition_rejected_page(e: TransitionRejected) -> HTMLResponse:
+    """Page shown when an email link no longer applies to the appointment"""
+    if e.status is None:
+        return message_page("❌ Appuntamento non trovato", "L'appuntamento richiesto non esiste.", "#ef4444", 404)
+    if e.status == appointment_states.CONFIRMED:
+        return message_page(
+            "⚠️ Già confermato",
+            "Questo appuntamento era già stato confermato. Per cancellarlo, contatta il cliente."
+        )
+    if e.status == appointment_states.REJECTED:
+        return message_page("⚠️ Già rifiutato", "Questo appuntamento era già stato rifiutato.")
+    return message_page(
+        "⚠️ Appuntamento cancellato",
+        "Questo appuntamento è stato cancellato dal cliente o è scaduto senza conferma."
+    )
+
+def invalid_link_page() -> HTMLResponse:
+    return message_page(
+        "❌ Link non valido",
+        "Il link è scaduto o non è valido. Gestisci la richiesta dal pannello di amministrazione.",
+        "#ef4444", 403
     )
+
+def action_prompt_page(appointment_id: str, action: str, token: str) -> HTMLResponse:
+    """GET target of the email links: renders a button, changes nothing.
+
+    Mail scanners that prefetch links only ever see this page; the transition
+    needs the POST that the button submits.
+    """
+    if action == "confirm":
+        title, button, color = "Confermare l'appuntamento?", "✓ SÌ, CONFERMA", "#22c55e"
+    else:
+        title, button, color = "Rifiutare l'appuntamento?", "✗ NO, RIFIUTA", "#ef4444"
+    return HTMLResponse(content=templates.render(
+        "pages/action_prompt.html",
+        title=title,
+        message="Il cliente riceverà una email con l'esito.",
+        button=button,
+        color=color,
+        token=token,
+        action_url=f"{BACKEND_URL}/api/appointments/{appointment_id}/{action}",
+    ))
+
+@api_router.get("/appointments/{appointment_id}/confirm", response_class=HTMLResponse)
+async def confirm_appointment_prompt(appointment_id: str, token: str = ""):
+    try:
+        action_tokens.verify(token, appointment_id, "confirm")
+    except InvalidActionToken:
+        return invalid_link_page()
+    return action_prompt_page(appointment_id, "confirm", token)
+
+@api_router.post("/appointments/{appointment_id}/confirm", response_class=HTMLResponse)
+async def confirm_appointment(appointment_id: str, token: str = Form("")):
+    """Confirm an appointment (submitted from the admin email link page)"""
+    try:
+        action_tokens.verify(token, appointment_id, "confirm")
+    except InvalidActionToken:
+        return invalid_link_page()
+    
+    try:
+        apt = await appointment_states.transition(db.appointments, appointment_id, "confirm", actor="admin:email")
+    except TransitionRejected as e:
+        return transition_rejected_page(e)
+    appointment_changed(CONFIRMED, apt)
     
     # Send confirmation email to client
     user_email = apt.get('user_email', '')
     if user_email:
-        send_confirmation_email(apt, user_email)
-    
-    date_formatted = datetime.strptime(apt['date'], "%Y-%m-%d").strftime("%d/%m/%Y")
-    
-    return HTMLResponse(content=f"""
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; text-align: center; padding: 50px; background: #f0fdf4; }}
-                .container {{ max-width: 500px; margin: 0 auto; background: white; padding: 40px; border-radius: 20px; box-shadow: 0 10px 40px rgba(0,0,0,0.1); }}
-                h1 {{ color: #22c55e; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>✓ Appuntamento Confermato!</h1>
-                <p><strong>{apt['agency_name']}</strong></p>
-                <p>📅 {date_formatted} alle {apt['time']}</p>
-                <p style="color: #64748b; margin-top: 20px;">Email di conferma inviata al cliente.</p>
-            </div>
-        </body>
-        </html>
-    """)
+        await send_confirmation_email(apt, user_email)
+    
+    return appointment_result_page(
+        apt, "✓ Appuntamento Confermato!", "Email di conferma inviata al cliente.", "#22c55e", "#f0fdf4"
+    )
 
 @api_router.get("/appointments/{appointment_id}/reject", response_class=HTMLResponse)
-async def reject_appointment(appointment_id: str):
-    """Reject an appointment (called by admin via email link)"""
-    apt = await db.appointments.find_one({"id": appointment_id}, {"_id": 0})
-    
-    if not apt:
-        return HTMLResponse(content="""
-            <html><body style="font-family: Arial; text-align: center; padding: 50px;">
-                <h1 style="color: #ef4444;">❌ Appuntamento non trovato</h1>
-                <p>L'appuntamento richiesto non esiste.</p>
-            </body></html>
-        """, status_code=404)
-    
-    if apt.get('status') == 'confirmed':
-        return HTMLResponse(content="""
-            <html><body style="font-family: Arial; text-align: center; padding: 50px;">
-                <h1 style="color: #f97316;">⚠️ Già confermato</h1>
-                <p>Questo appuntamento era già stato confermato. Per cancellarlo, contatta il cliente.</p>
-            </body></html>
-        """)
-    
-    if apt.get('status') == 'rejected':
-        return HTMLResponse(content="""
-            <html><body style="font-family: Arial; text-align: center; padding: 50px;">
-                <h1 style="color: #f97316;">⚠️ Già rifiutato</h1>
-                <p>Questo appuntamento era già stato rifiutato.</p>
-            </body></html>
-        """)
-    
-    # Update status to rejected
-    await db.appointments.update_one(
-        {"id": appointment_id},
-        {"$set": {"status": "rejected"}}
-    )
+async def reject_appointment_prompt(appointment_id: str, token: str = ""):
+    try:
+        action_tokens.verify(token, appointment_id, "reject")
+    except InvalidActionToken:
+        return invalid_link_page()
+    return action_prompt_page(appointment_id, "reject", token)
+
+@api_router.post("/appointments/{appointment_id}/reject", response_class=HTMLResponse)
+async def reject_appointment(appointment_id: str, token: str = Form("")):
+    """Reject an appointment (submitted from the admin email link page)"""
+    try:
+        action_tokens.verify(token, appointment_id, "reject")
+    except InvalidActionToken:
+        return invalid_link_page()
+    
+    try:
+        apt = await appointment_states.transition(db.appointments, appointment_id, "reject", actor="admin:email")
+    except TransitionRejected as e:
+        return transition_rejected_page(e)
+    appointment_changed(REJECTED, apt)
     
     # Send rejection email to client
     user_email = apt.get('user_email', '')
     if user_email:
-        send_rejection_email(apt, user_email)
-    
-    date_formatted = datetime.strptime(apt['date'], "%Y-%m-%d").strftime("%d/%m/%Y")
-    
-    return HTMLResponse(content=f"""
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; text-align: center; padding: 50px; background: #fef2f2; }}
-                .container {{ max-width: 500px; margin: 0 auto; background: white; padding: 40px; border-radius: 20px; box-shadow: 0 10px 40px rgba(0,0,0,0.1); }}
-                h1 {{ color: #ef4444; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>✗ Appuntamento Rifiutato</h1>
-                <p><strong>{apt['agency_name']}</strong></p>
-                <p>📅 {date_formatted} alle {apt['time']}</p>
-                <p style="color: #64748b; margin-top: 20px;">Email di notifica inviata al cliente.</p>
-            </div>
-        </body>
-        </html>
-    """)
+        await send_rejection_email(apt, user_email)
+    
+    return appointment_result_page(
+        apt, "✗ Appuntamento Rifiutato", "Email di notifica inviata al cliente.", "#ef4444", "#fef2f2"
+    )
+
+# =====================
+# ADMIN ROUTES
+# =====================
+
+class AdminAppointment(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    user_id: str
+    user_name: str
+    agency_name: str
+    user_email: Optional[str] = None
+    date: str
+    time: str
+    duration_minutes: int = 45
+    appointment_address: str = ""
+    contact_person: str = ""
+    contact_phone: str = ""
+    intercom_name: Optional[str] = None
+    status: str
+    created_at: datetime
+
+class ReviewRequest(BaseModel):
+    confirm: List[str] = Field(default_factory=list, max_length=500)
+    reject: List[str] = Field(default_factory=list, max_length=500)
+
+class ReviewItem(BaseModel):
+    id: str
+    action: str
+    status: Optional[str] = None
+
+class ReviewResponse(BaseModel):
+    changed: List[ReviewItem]
+    already_handled: List[ReviewItem]
+    not_found: List[ReviewItem]
+
+@api_router.get("/admin/appointments", response_model=List[AdminAppointment])
+async def list_appointments_for_review(
+    status: str = "pending",
+    from_date: Optional[str] = Query(None, alias="from"),
+    to_date: Optional[str] = Query(None, alias="to"),
+    agency: Optional[str] = None,
+    limit: int = Query(200, ge=1, le=1000),
+    admin: CurrentUser = Depends(get_admin_user)
+):
+    """Appointments awaiting review (or in any other status), soonest first"""
+    query = {"status": status}
+    if from_date or to_date:
+        query["date"] = {}
+        if from_date:
+            query["date"]["$gte"] = from_date
+        if to_date:
+            query["date"]["$lte"] = to_date
+    if agency:
+        query["agency_name"] = agency
+    
+    docs = await db.appointments.find(query, projection(AdminAppointment)).sort([("date", 1), ("time", 1)]).to_list(limit)
+    return documents_response(AdminAppointment, docs)
+
+@api_router.post("/admin/appointments/review", response_model=ReviewResponse)
+async def review_appointments(input: ReviewRequest, admin: CurrentUser = Depends(get_admin_user)):
+    """Confirm and reject many pending appointments at once.
+
+    Every transition is conditional on the appointment still being pending, so
+    items already handled (by another admin or an email link) are left alone
+    and reported back.
+    """
+    actions = {apt_id: "confirm" for apt_id in input.confirm}
+    for apt_id in input.reject:
+        if actions.get(apt_id) == "confirm":
+            raise HTTPException(status_code=400, detail=f"Appuntamento {apt_id} sia confermato che rifiutato")
+        actions[apt_id] = "reject"
+    if not actions:
+        return ReviewResponse(changed=[], already_handled=[], not_found=[])
+    
+    # The batch id marks the documents this request actually moved out of pending
+    batch_id = str(uuid.uuid4())
+    await db.appointments.bulk_write([
+        UpdateOne(
+            appointment_states.transition_filter(action, apt_id),
+            appointment_states.transition_update(action, f"admin:{admin.username}", {"review_batch": batch_id})
+        )
+        for apt_id, action in actions.items()
+    ], ordered=False)
+    
+    docs = await db.appointments.find({"id": {"$in": list(actions)}}, {"_id": 0}).to_list(None)
+    found = {doc['id']: doc for doc in docs}
+    
+    changed, already_handled, not_found, emails = [], [], [], []
+    for apt_id, action in actions.items():
+        doc = found.get(apt_id)
+        if doc is None:
+            not_found.append(ReviewItem(id=apt_id, action=action))
+        elif doc.get('review_batch') == batch_id:
+            changed.append(ReviewItem(id=apt_id, action=action, status=doc['status']))
+            appointment_changed(CONFIRMED if action == "confirm" else REJECTED, doc)
+            if doc.get('user_email'):
+                build = confirmation_message if action == "confirm" else rejection_message
+                emails.append(build(doc, doc['user_email']))
+        else:
+            already_handled.append(ReviewItem(id=apt_id, action=action, status=doc.get('status')))
+    
+    await email_outbox.enqueue_many(emails)
+    
+    return ReviewResponse(changed=changed, already_handled=already_handled, not_found=not_found)
+
+# =====================
+# SCHEDULED JOBS
+# =====================
+
+SCHEDULER_BATCH_SIZE = int(os.environ.get('SCHEDULER_BATCH_SIZE', '100'))
+
+async def claim_due(query: dict, update, due_field: str) -> List[dict]:
+    """Take up to SCHEDULER_BATCH_SIZE appointments whose ``due_field`` has passed, soonest first.
+
+    Each claim is one conditional update that also takes the appointment out
+    of the due query, so even overlapping runs handle it once.
+    """
+    now = datetime.now(timezone.utc)
+    claimed = []
+    while len(claimed) < SCHEDULER_BATCH_SIZE:
+        doc = await db.appointments.find_one_and_update(
+            {**query, due_field: {"$lte": now}},
+            update,
+            sort=[(due_field, 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            break
+        claimed.append(doc)
+    return claimed
+
+async def send_due_reminders() -> int:
+    """Remind clients of their confirmed appointments REMINDER_LEAD_HOURS ahead"""
+    sent = 0
+    while True:
+        claimed = await claim_due({"status": "confirmed"}, {"$unset": {"reminder_at": ""}}, "reminder_at")
+        now = datetime.now(timezone.utc)
+        # Reminders that fell due while no replica was running are dropped once the appointment has started
+        messages = [
+            reminder_message(apt, apt['user_email']) for apt in claimed
+            if apt.get('user_email') and appointment_start(apt['date'], apt['time']) > now
+        ]
+        await email_outbox.enqueue_many(messages)
+        sent += len(messages)
+        if len(claimed) < SCHEDULER_BATCH_SIZE:
+            return sent
+
+async def remind_admin_of_pending() -> int:
+    """Every PENDING_REPING_HOURS, one email listing the requests the admin hasn't reviewed yet"""
+    reminded = 0
+    while True:
+        claimed = await claim_due(
+            {"status": "pending"},
+            {"$set": {"admin_ping_at": datetime.now(timezone.utc) + due_times.admin_reping}},
+            "admin_ping_at"
+        )
+        if claimed:
+            await send_pending_reminder(sorted(claimed, key=lambda apt: (apt['date'], apt['time'])))
+        reminded += len(claimed)
+        if len(claimed) < SCHEDULER_BATCH_SIZE:
+            return reminded
+
+async def expire_pending_holds() -> int:
+    """Cancel requests still pending after PENDING_HOLD_HOURS, freeing their slots"""
+    expired = 0
+    while True:
+        claimed = await claim_due(
+            {"status": "pending"}, appointment_states.transition_update("expire", "scheduler"), "expires_at"
+        )
+        for apt in claimed:
+            appointment_changed(SLOT_RELEASED, apt)
+        await email_outbox.enqueue_many([
+            expiry_message(apt, apt['user_email']) for apt in claimed if apt.get('user_email')
+        ])
+        expired += len(claimed)
+        if len(claimed) < SCHEDULER_BATCH_SIZE:
+            return expired
+
+def create_job_scheduler() -> JobScheduler:
+    """Every replica runs one; the lease in scheduler_leases decides which of them does the work"""
+    jobs = []
+    if due_times.pending_hold:
+        jobs.append(Job("expire_pending_holds", expire_pending_holds, interval_seconds=60))
+    if due_times.reminder_lead:
+        jobs.append(Job("send_due_reminders", send_due_reminders, interval_seconds=300))
+    if due_times.admin_reping:
+        jobs.append(Job("remind_admin_of_pending", remind_admin_of_pending, interval_seconds=300))
+    return JobScheduler(
+        LeaderLease(
+            db.scheduler_leases, "appointment_jobs",
+            ttl_seconds=float(os.environ.get('SCHEDULER_LEASE_SECONDS', '60')),
+        ),
+        jobs,
+        tick_seconds=float(os.environ.get('SCHEDULER_TICK_SECONDS', '15')),
+    )
+
+# Created by the lifespan when SCHEDULER_ENABLED (the default)
+job_scheduler: Optional[JobScheduler] = None
 
 # =====================
 # APP SETUP
 # =====================
 
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Seconds the email workers get to finish in-flight deliveries on shutdown
+SHUTDOWN_GRACE_SECONDS = float(os.environ.get('SHUTDOWN_GRACE_SECONDS', '10'))
+
+# Long-running tasks owned by the app, cancelled on shutdown
+background_tasks = set()
+# False until startup completes and again once shutdown begins; drives the readiness probe
+accepting_traffic = False
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global email_outbox, idempotency_store, job_scheduler, accepting_traffic
+    await db.connect()
+    if os.environ.get('RUN_MIGRATIONS_ON_STARTUP', 'true').lower() == 'true':
+        # Long data migrations continue in the background while the app serves traffic
+        await run_migrations(db, defer_background=True)
+    email_outbox = create_email_outbox()
+    await email_outbox.start()
+    idempotency_store = IdempotencyStore(db.idempotency_keys, ttl_seconds=IDEMPOTENCY_KEY_TTL_HOURS * 3600)
+    background_tasks.add(asyncio.create_task(metrics.monitor_event_loop_lag()))
+    if slot_events.source == 'changestream':
+        background_tasks.add(asyncio.create_task(slot_events.watch_change_stream(db.appointments)))
+    if os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true':
+        job_scheduler = create_job_scheduler()
+        job_scheduler.start()
+    accepting_traffic = True
+    try:
+        yield
+    finally:
+        accepting_traffic = False
+        # Open event streams end first so clients reconnect to another replica
+        slot_events.close()
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        background_tasks.clear()
+        # Before the outbox: the jobs queue emails
+        if job_scheduler is not None:
+            await job_scheduler.stop()
+        await email_outbox.stop(grace_seconds=SHUTDOWN_GRACE_SECONDS)
+        password_hasher.shutdown()
+        # Last: everything above may still be writing to Mongo
+        db.close()
+
+# orjson for every JSON response; the hot endpoints also skip response_model validation (see SERIALIZATION)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.include_router(api_router)
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    """Prometheus text exposition of the in-process metrics"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/live", include_in_schema=False)
+async def liveness():
+    """The process and its event loop are responsive; Mongo state is reported, not required"""
+    return {"status": "ok", "mongo": "connected" if db.connected else "disconnected"}
+
+@app.get("/health/ready", include_in_schema=False)
+async def readiness():
+    """Ready for traffic: startup finished, not shutting down, and Mongo answers a ping"""
+    if not accepting_traffic:
+        return JSONResponse({"status": "starting or draining"}, status_code=503)
+    if not await db.ping(timeout=float(os.environ.get('READINESS_PING_TIMEOUT_SECONDS', '2'))):
+        return JSONResponse({"status": "mongo unavailable"}, status_code=503)
+    return {"status": "ready"}
+
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(
+        RateLimitMiddleware,
+        limiter=rate_limiter,
+        policies={
+            ("POST", "/api/auth/login"): [LOGIN_IP_RATE],
+            ("POST", "/api/auth/register"): [REGISTER_IP_RATE],
+            ("POST", "/api/contact"): [CONTACT_IP_RATE],
+        },
+        # Railway terminates TLS in front of us and appends the caller to X-Forwarded-For
+        trust_forwarded=os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'true').lower() == 'true',
+    )
+
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Retry-After", "Idempotent-Replayed"],
 )
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
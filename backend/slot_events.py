@@ -0,0 +1,132 @@
+"""Live slot change feed for the booking calendar (Server-Sent Events).
+
+Events are fanned out to every connected client through an in-process
+pub/sub. With ``source="changestream"`` they are derived from a MongoDB
+change stream on ``appointments`` instead (requires a replica set), so every
+replica sees bookings made through any other replica.
+
+A delete event carries only the document's ``_id``. The only appointments
+ever deleted are those of a block booking rolled back right after its
+insert, so the broker remembers the slots of recent inserts and releases
+them from there.
+"""
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Optional, Set
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+SLOT_CLAIMED = "slot_claimed"
+SLOT_RELEASED = "slot_released"
+CONFIRMED = "confirmed"
+REJECTED = "rejected"
+
+# Status written by an update -> event published for it
+STATUS_EVENTS = {
+    "cancelled": SLOT_RELEASED,
+    "confirmed": CONFIRMED,
+    "rejected": REJECTED,
+}
+
+
+class SlotEventBroker:
+    def __init__(self, source: str = "local", queue_size: int = 100, heartbeat_seconds: float = 15.0,
+                 recent_inserts: int = 10000, recent_insert_seconds: float = 600.0):
+        self.source = source
+        self.queue_size = queue_size
+        self.heartbeat_seconds = heartbeat_seconds
+        self._subscribers: Set[asyncio.Queue] = set()
+        # Change stream only: _id -> slot of appointments inserted lately, for their delete events
+        self._recent_inserts = TTLCache("slot_event_inserts", recent_inserts, recent_insert_seconds)
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def _publish(self, event_type: str, appointment: dict):
+        # Only what the calendar needs: no agency or contact details leave the server
+        message = {
+            "type": event_type,
+            "date": appointment.get("date"),
+            "time": appointment.get("time"),
+            "appointment_id": appointment.get("id"),
+        }
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # A client that can't keep up is disconnected; EventSource reconnects and refetches
+                self._disconnect(queue)
+
+    def _disconnect(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def close(self):
+        """End every open stream; used on shutdown so connections don't hold the server up"""
+        for queue in list(self._subscribers):
+            self._disconnect(queue)
+
+    def notify(self, event_type: str, appointment: dict):
+        """Called by the write handlers; a no-op when events come from the change stream"""
+        if self.source != "changestream":
+            self._publish(event_type, appointment)
+
+    async def stream(self, request) -> AsyncIterator[str]:
+        """SSE body for one client: events as they happen, comment heartbeats in between"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=self.heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if message is None:
+                    break
+                yield f"event: {message['type']}\ndata: {json.dumps(message)}\n\n"
+        finally:
+            self._subscribers.discard(queue)
+
+    def _on_change(self, change: dict):
+        operation = change["operationType"]
+        if operation == "delete":
+            slot = self._recent_inserts.get(change["documentKey"]["_id"])
+            if slot is not None:
+                self._recent_inserts.invalidate(change["documentKey"]["_id"])
+                self._publish(SLOT_RELEASED, slot)
+            return
+        doc = change.get("fullDocument") or {}
+        if operation == "insert":
+            self._recent_inserts.set(change["documentKey"]["_id"], {key: doc.get(key) for key in ("id", "date", "time")})
+            self._publish(SLOT_CLAIMED, doc)
+        else:
+            status = change["updateDescription"]["updatedFields"]["status"]
+            if status in STATUS_EVENTS:
+                self._publish(STATUS_EVENTS[status], doc)
+
+    async def watch_change_stream(self, collection, resume_after: Optional[dict] = None):
+        """Translate appointment inserts, status updates and deletes into events, forever"""
+        pipeline = [{"$match": {"$or": [
+            {"operationType": "insert"},
+            {"operationType": "update", "updateDescription.updatedFields.status": {"$exists": True}},
+            {"operationType": "delete"},
+        ]}}]
+        while True:
+            try:
+                async with collection.watch(pipeline, full_document="updateLookup", resume_after=resume_after) as stream:
+                    async for change in stream:
+                        resume_after = change["_id"]
+                        self._on_change(change)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Appointment change stream interrupted: {e}; resuming in 5s")
+                await asyncio.sleep(5)
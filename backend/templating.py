@@ -0,0 +1,100 @@
+"""Precompiled Jinja2 templates for emails and admin pages.
+
+All templates are compiled once when the renderer is created. HTML templates
+are autoescaped, so user input such as agency names or contact messages can
+no longer inject markup. Email templates have their <style> block inlined
+into style attributes while loading, so the inliner never runs per message.
+"""
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Tuple
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+STYLE_BLOCK = re.compile(r"<style[^>]*>(.*?)</style>\s*", re.S | re.I)
+CSS_RULE = re.compile(r"([^{}]+)\{([^{}]*)\}")
+START_TAG = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)(\s[^<>]*?)?(/?)>")
+CLASS_ATTR = re.compile(r'\sclass="([^"]*)"')
+STYLE_ATTR = re.compile(r'\sstyle="([^"]*)"')
+SIMPLE_SELECTOR = re.compile(r"^\.?[a-zA-Z][\w-]*$")
+
+
+def inline_css(html: str) -> str:
+    """Move the rules of the first <style> block into style attributes.
+
+    Only tag and single-class selectors are supported, which is all the email
+    templates use. Declarations already in a style attribute take precedence.
+    """
+    match = STYLE_BLOCK.search(html)
+    if not match:
+        return html
+
+    rules = {}
+    for selectors, body in CSS_RULE.findall(match.group(1)):
+        declarations = " ".join(body.split()).strip().rstrip(";")
+        for selector in selectors.split(","):
+            selector = selector.strip()
+            if SIMPLE_SELECTOR.match(selector):
+                rules[selector] = f"{rules[selector]}; {declarations}" if selector in rules else declarations
+
+    def apply(tag_match) -> str:
+        tag, attrs, self_closing = tag_match.group(1), tag_match.group(2) or "", tag_match.group(3)
+        class_attr = CLASS_ATTR.search(attrs)
+        selectors = [tag.lower()] + [f".{c}" for c in (class_attr.group(1).split() if class_attr else [])]
+        declarations = [rules[s] for s in selectors if s in rules]
+        if not declarations:
+            return tag_match.group(0)
+        style_attr = STYLE_ATTR.search(attrs)
+        if style_attr:
+            declarations.append(style_attr.group(1).strip().rstrip(";"))
+            attrs = attrs[:style_attr.start()] + attrs[style_attr.end():]
+        return f'<{tag}{attrs} style="{"; ".join(declarations)}"{self_closing}>'
+
+    html = html[:match.start()] + html[match.end():]
+    return START_TAG.sub(apply, html)
+
+
+class InliningLoader(FileSystemLoader):
+    """Loads templates from disk, inlining CSS of the HTML email templates"""
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = super().get_source(environment, template)
+        if template.startswith("emails/") and template.endswith(".html"):
+            source = inline_css(source)
+        return source, filename, uptodate
+
+
+def italian_date(value: str) -> str:
+    """'2026-03-05' -> '05/03/2026'"""
+    return f"{value[8:10]}/{value[5:7]}/{value[0:4]}"
+
+
+def local_datetime(value: datetime) -> str:
+    """Aware datetime -> '05/03/2026 14:30' in the server's local time"""
+    return value.astimezone().strftime("%d/%m/%Y %H:%M")
+
+
+class TemplateRenderer:
+    def __init__(self, directory: Path):
+        self.env = Environment(
+            loader=InliningLoader(str(directory)),
+            autoescape=select_autoescape(["html"]),
+            auto_reload=False,
+            cache_size=-1,
+        )
+        self.env.filters["italian_date"] = italian_date
+        self.env.filters["local_datetime"] = local_datetime
+        # Compile everything up front so requests only ever render
+        for name in self.env.list_templates():
+            self.env.get_template(name)
+
+    def render(self, name: str, **context) -> str:
+        return self.env.get_template(name).render(**context)
+
+    def render_email(self, name: str, **context) -> Tuple[str, str]:
+        """Render the HTML body and its plain-text alternative"""
+        return (
+            self.env.get_template(f"emails/{name}.html").render(**context),
+            self.env.get_template(f"emails/{name}.txt").render(**context),
+        )
@@ -0,0 +1,165 @@
+"""Travel-aware slot filtering for on-site appointments in Milan.
+
+Addresses are geocoded offline against a gazetteer CSV (``street,lat,lon``,
+one row per street or per street and house number) and travel times are
+estimated from the straight-line distance with a detour factor and an
+average urban speed. A visit takes ``visit_minutes`` of its slot; the rest of
+the slot, plus any free slots in between, is what the operator has to move
+from one address to the next. Slots an operator could not reach from their
+previous booking, or leave in time for their next one, are dropped.
+
+Everything for one day and operator is computed in a single numpy pass over
+that operator's bookings. Addresses the gazetteer doesn't know are treated as
+reachable, so a gap in the data never blocks a booking.
+"""
+import csv
+import logging
+import re
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from schedule import DaySchedule
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+
+Point = Tuple[float, float]
+
+ABBREVIATIONS = {
+    "v": "via", "v.le": "viale", "vle": "viale", "p.za": "piazza", "p.zza": "piazza", "pza": "piazza",
+    "p.le": "piazzale", "ple": "piazzale", "c.so": "corso", "cso": "corso", "l.go": "largo", "lgo": "largo",
+}
+# Trailing city, province and postcode noise: "..., 20121 Milano (MI)"
+CITY_NOISE = re.compile(r"\b(\d{5}|milano|milan|mi|italia|italy)\b")
+
+
+def normalize_address(address: str) -> str:
+    """'P.za del Duomo, 1 - 20122 Milano' -> 'piazza del duomo 1'"""
+    text = unicodedata.normalize("NFKD", address).encode("ascii", "ignore").decode().lower()
+    words = [ABBREVIATIONS.get(w, ABBREVIATIONS.get(w.rstrip("."), w)) for w in re.split(r"[\s,;()-]+", text) if w]
+    text = " ".join(w.strip(".") for w in words)
+    return " ".join(CITY_NOISE.sub(" ", text).split())
+
+
+def street_of(normalized: str) -> str:
+    """Drop house numbers: 'corso buenos aires 12a' -> 'corso buenos aires'"""
+    return " ".join(w for w in normalized.split() if not any(c.isdigit() for c in w))
+
+
+class Gazetteer:
+    def __init__(self, entries: Mapping[str, Point], cache_size: int = 4096):
+        self.entries: Dict[str, Point] = {normalize_address(k): v for k, v in entries.items()}
+        self.locate = lru_cache(maxsize=cache_size)(self._locate)
+
+    @classmethod
+    def load(cls, path: Path) -> "Gazetteer":
+        with open(path, newline="", encoding="utf-8") as f:
+            entries = {row["street"]: (float(row["lat"]), float(row["lon"])) for row in csv.DictReader(f)}
+        logger.info(f"Loaded {len(entries)} gazetteer entries from {path}")
+        return cls(entries)
+
+    def _locate(self, address: str) -> Optional[Point]:
+        """Exact street and number if listed, otherwise the street"""
+        normalized = normalize_address(address)
+        return self.entries.get(normalized) or self.entries.get(street_of(normalized))
+
+
+class TravelMatrix:
+    """Memoized travel-time estimates in minutes between gazetteer points"""
+
+    def __init__(self, speed_kmh: float = 20.0, detour_factor: float = 1.4, overhead_minutes: float = 5.0,
+                 max_entries: int = 100000):
+        self.speed_kmh = speed_kmh
+        self.detour_factor = detour_factor
+        self.overhead_minutes = overhead_minutes
+        self.max_entries = max_entries
+        self._memo: "OrderedDict[Tuple[Point, Point], float]" = OrderedDict()
+
+    def _estimate(self, origins: np.ndarray, destination: Point) -> np.ndarray:
+        """Vectorized haversine from every origin (n x 2, degrees) to one destination"""
+        lat1, lon1 = np.radians(origins[:, 0]), np.radians(origins[:, 1])
+        lat2, lon2 = np.radians(destination[0]), np.radians(destination[1])
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        km = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a)) * self.detour_factor
+        minutes = km / self.speed_kmh * 60 + self.overhead_minutes
+        # Same address: nothing to travel
+        return np.where(km > 0, minutes, 0.0)
+
+    def minutes(self, origins: Sequence[Point], destination: Point) -> np.ndarray:
+        """Travel time from each origin to the destination (symmetric), computing only unseen pairs"""
+        result = np.empty(len(origins))
+        missing = []
+        for i, origin in enumerate(origins):
+            cached = self._memo.get((origin, destination))
+            if cached is None:
+                missing.append(i)
+            else:
+                result[i] = cached
+        if missing:
+            computed = self._estimate(np.array([origins[i] for i in missing]), destination)
+            for i, value in zip(missing, computed):
+                result[i] = value
+                self._memo[(origins[i], destination)] = self._memo[(destination, origins[i])] = float(value)
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        return result
+
+
+class TravelPlanner:
+    def __init__(self, gazetteer: Gazetteer, matrix: TravelMatrix, visit_minutes: int):
+        self.gazetteer = gazetteer
+        self.matrix = matrix
+        self.visit_minutes = visit_minutes
+
+    @classmethod
+    def from_env(cls, env, slot_minutes: int) -> Optional["TravelPlanner"]:
+        """Enabled by TRAVEL_GAZETTEER_PATH; None when unset"""
+        path = env.get('TRAVEL_GAZETTEER_PATH')
+        if not path:
+            return None
+        return cls(
+            Gazetteer.load(Path(path)),
+            TravelMatrix(
+                speed_kmh=float(env.get('TRAVEL_SPEED_KMH', '20')),
+                detour_factor=float(env.get('TRAVEL_DETOUR_FACTOR', '1.4')),
+                overhead_minutes=float(env.get('TRAVEL_OVERHEAD_MINUTES', '5')),
+            ),
+            visit_minutes=int(env.get('TRAVEL_VISIT_MINUTES', str(max(slot_minutes - 15, 0)))),
+        )
+
+    def reachable(self, table: DaySchedule, booked: List[Tuple[int, str]], address: str) -> int:
+        """Slots an operator already holding ``booked`` (slot index, address) could serve at ``address``"""
+        destination = self.gazetteer.locate(address)
+        if destination is None:
+            return table.full_mask
+        located = [(i, self.gazetteer.locate(a)) for i, a in booked]
+        located = sorted((i, point) for i, point in located if point is not None)
+        if not located:
+            return table.full_mask
+
+        offsets = np.array(table.offsets, dtype=float)
+        booked_offsets = np.array([table.offsets[i] for i, _ in located], dtype=float)
+        travel = self.matrix.minutes([point for _, point in located], destination)
+
+        # For every slot: the operator's last booking before it and first booking after it
+        after = np.searchsorted(booked_offsets, offsets, side="right")
+        before = after - 1
+        has_before = before >= 0
+        has_after = after < len(located)
+        before_i = np.clip(before, 0, None)
+        after_i = np.clip(after, None, len(located) - 1)
+
+        ok_before = ~has_before | (
+            offsets - (booked_offsets[before_i] + self.visit_minutes) >= travel[before_i]
+        )
+        ok_after = ~has_after | (
+            booked_offsets[after_i] - (offsets + self.visit_minutes) >= travel[after_i]
+        )
+        ok = ok_before & ok_after
+        return sum(1 << int(i) for i in np.flatnonzero(ok))
@@ -0,0 +1,59 @@
+"""In-process TTL + LRU cache shared by the user and availability caches.
+
+Lookups, evictions and size are exported on /metrics, labelled with the
+cache's name.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from metrics import CACHE_ENTRIES, CACHE_EVICTIONS, CACHE_LOOKUPS
+
+
+class TTLCache:
+    """Bounded cache of values that go stale.
+
+    Entries expire after ``ttl_seconds``; once ``max_size`` entries are held the
+    least recently used one is evicted. ``get`` returns None for a missing or
+    expired key, so None itself can't be cached.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        CACHE_ENTRIES.set(0, cache=name)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < self.clock():
+            del self._entries[key]
+            CACHE_ENTRIES.set(len(self._entries), cache=self.name)
+            entry = None
+        if entry is None:
+            CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+            return None
+        self._entries.move_to_end(key)
+        CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (self.clock() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            CACHE_EVICTIONS.inc(cache=self.name)
+        CACHE_ENTRIES.set(len(self._entries), cache=self.name)
+
+    def invalidate(self, key: Hashable):
+        if self._entries.pop(key, None) is not None:
+            CACHE_ENTRIES.set(len(self._entries), cache=self.name)
+
+    def clear(self):
+        self._entries.clear()
+        CACHE_ENTRIES.set(0, cache=self.name)
@@ -0,0 +1,13 @@
+"""In-process TTL + LRU cache of authenticated users, keyed by user id."""
+from ttl_cache import TTLCache
+
+
+class UserCache(TTLCache):
+    """Bounded cache of resolved users.
+
+    Call ``invalidate`` whenever a user document changes so the next request
+    reloads it from MongoDB.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 60.0, **kwargs):
+        super().__init__("user", max_size, ttl_seconds, **kwargs)
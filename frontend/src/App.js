@@ -243,6 +243,7 @@ const BookingModal = ({ isOpen, onClose, user, onLogin, onLogout, onRegister, to
   const [selectedDate, setSelectedDate] = useState(null);
   const [currentMonth, setCurrentMonth] = useState(new Date());
   const [availability, setAvailability] = useState(null);
+  const [monthAvailability, setMonthAvailability] = useState({});
   const [myAppointments, setMyAppointments] = useState([]);
   const [loading, setLoading] = useState(false);
   const [selectedTime, setSelectedTime] = useState(null);
@@ -274,14 +275,70 @@ const BookingModal = ({ isOpen, onClose, user, onLogin, onLogout, onRegister, to
     }
   };
 
-  const fetchAvailability = async (date) => {
+  useEffect(() => {
+    if (user) fetchMonthAvailability(currentMonth);
+  }, [user, currentMonth]);
+
+  // Live slot changes: refresh the grid instead of polling or waiting for a booking conflict.
+  // The stream stays open for the whole session (the token travels in its URL, so no
+  // reconnecting on every click); events go through a ref to the month and day on screen now.
+  const refreshOnSlotChange = useRef(null);
+  refreshOnSlotChange.current = () => {
+    fetchMonthAvailability(currentMonth);
+    if (selectedDate) fetchAvailability(selectedDate, { refresh: true });
+  };
+
+  const signedIn = Boolean(user);
+  useEffect(() => {
+    if (!signedIn || !token) return;
+    const source = new EventSource(`${API}/appointments/stream?token=${encodeURIComponent(token)}`);
+    const refresh = () => refreshOnSlotChange.current();
+    source.addEventListener('slot_claimed', refresh);
+    source.addEventListener('slot_released', refresh);
+    return () => source.close();
+  }, [signedIn, token]);
+
+  const toLocalDateStr = (d) =>
+    `${d.getFullYear()}-${String(d.getMonth() + 1).padStart(2, '0')}-${String(d.getDate()).padStart(2, '0')}`;
+
+  // One request for the whole month grid instead of one per selected day
+  const fetchMonthAvailability = async (month) => {
+    if (!token) return;
+    try {
+      const res = await axios.get(`${API}/appointments/availability`, {
+        params: {
+          from: toLocalDateStr(new Date(month.getFullYear(), month.getMonth(), 1)),
+          to: toLocalDateStr(new Date(month.getFullYear(), month.getMonth() + 1, 0))
+        },
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      const byDate = {};
+      res.data.days.forEach(day => { byDate[day.date] = day; });
+      setMonthAvailability(byDate);
+    } catch (e) {
+      console.error(e);
+    }
+  };
+
+  // With an address the server also drops slots the operators can't reach in time
+  const fetchAvailability = async (date, { refresh = false, address = null } = {}) => {
     if (!token) return;
+    if (!refresh && !address && monthAvailability[date]) {
+      setAvailability(monthAvailability[date]);
+      return;
+    }
     setLoading(true);
     try {
       const res = await axios.get(`${API}/appointments/availability/${date}`, {
+        params: address ? { address } : undefined,
         headers: { Authorization: `Bearer ${token}` }
       });
       setAvailability(res.data);
+      const chosen = selectedTime && res.data.slots.find(slot => slot.time === selectedTime);
+      if (address && chosen && !chosen.available) {
+        toast.error("Orario non raggiungibile per questo indirizzo, scegline un altro");
+        setSelectedTime(null);
+      }
     } catch (e) {
       toast.error("Errore nel caricamento disponibilità");
     }
@@ -318,7 +375,8 @@ const BookingModal = ({ isOpen, onClose, user, onLogin, onLogout, onRegister, to
       toast.success("Slot bloccato! Riceverai una email di conferma a breve.");
       setBookingForm({ appointment_address: '', contact_person: '', contact_phone: '', intercom_name: '' });
       setSelectedTime(null);
-      fetchAvailability(selectedDate);
+      fetchMonthAvailability(currentMonth);
+      fetchAvailability(selectedDate, { refresh: true });
       fetchMyAppointments();
     } catch (e) {
       toast.error(e.response?.data?.detail || "Errore nella prenotazione");
@@ -334,7 +392,8 @@ const BookingModal = ({ isOpen, onClose, user, onLogin, onLogout, onRegister, to
       });
       toast.success("Appuntamento cancellato");
       fetchMyAppointments();
-      if (selectedDate) fetchAvailability(selectedDate);
+      fetchMonthAvailability(currentMonth);
+      if (selectedDate) fetchAvailability(selectedDate, { refresh: true });
     } catch (e) {
       toast.error("Errore nella cancellazione");
     }
@@ -741,6 +800,11 @@ const BookingModal = ({ isOpen, onClose, user, onLogin, onLogout, onRegister, to
                               <Input
                                 value={bookingForm.appointment_address}
                                 onChange={(e) => setBookingForm({...bookingForm, appointment_address: e.target.value})}
+                                onBlur={() => {
+                                  if (selectedDate && bookingForm.appointment_address.trim().length >= 5) {
+                                    fetchAvailability(selectedDate, { refresh: true, address: bookingForm.appointment_address });
+                                  }
+                                }}
                                 placeholder="Via, numero civico, città"
                                 className="bg-white"
                               />
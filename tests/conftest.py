@@ -0,0 +1,160 @@
+"""Shared fixtures.
+
+Tests run against mongomock-motor by default. Set MONGO_TEST_URL to run them
+against a real MongoDB instead (each test gets its own throwaway database);
+the query-plan tests only run there.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from datetime import date, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL")
+
+requires_mongo = pytest.mark.skipif(not MONGO_TEST_URL, reason="needs a real MongoDB (set MONGO_TEST_URL)")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeClock:
+    """A monotonic clock the test moves by hand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+# Operations that go to the server and back; the mock runs them without ever yielding
+ROUND_TRIPS = [
+    "insert_one", "insert_many", "find_one", "find_one_and_update", "update_one", "update_many",
+    "delete_one", "delete_many", "count_documents", "bulk_write",
+]
+
+
+def yielding(method):
+    async def round_trip(*args, **kwargs):
+        # Let other tasks run in between, as they would while a real request is in flight
+        await asyncio.sleep(0)
+        return await method(*args, **kwargs)
+    return round_trip
+
+
+def mock_client(monkeypatch):
+    from mongomock_motor import AsyncCursor, AsyncMongoMockClient
+
+    client = AsyncMongoMockClient(tz_aware=True)
+    collection = type(client["probe"]["probe"])
+    for name in ROUND_TRIPS:
+        monkeypatch.setattr(collection, name, yielding(getattr(collection, name)))
+    monkeypatch.setattr(AsyncCursor, "to_list", yielding(AsyncCursor.to_list))
+    return client
+
+
+@pytest.fixture
+async def blank_mongo(monkeypatch):
+    """An empty database, migrations not applied"""
+    if MONGO_TEST_URL:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(MONGO_TEST_URL, tz_aware=True)
+    else:
+        client = mock_client(monkeypatch)
+    name = f"test_{uuid.uuid4().hex[:12]}"
+    yield client[name]
+    await client.drop_database(name)
+    client.close()
+
+
+@pytest.fixture
+async def mongo(blank_mongo):
+    """An empty database with the migrations applied"""
+    from migrations import run_migrations
+
+    await run_migrations(blank_mongo)
+    return blank_mongo
+
+
+@pytest.fixture
+def app_db(mongo, monkeypatch):
+    """The server module bound to ``mongo``, with empty caches and an outbox that is never started"""
+    import server
+
+    monkeypatch.setattr(server.db, "_database", mongo)
+    monkeypatch.setattr(server, "email_outbox", server.create_email_outbox())
+    server.user_cache.clear()
+    server.availability_cache.clear()
+    yield server
+    server.user_cache.clear()
+    server.availability_cache.clear()
+
+
+def bookable_day(schedule, days_ahead: int = 7) -> str:
+    """The first open day at least ``days_ahead`` days from now, clear of the 24-hour notice"""
+    day = date.today() + timedelta(days=days_ahead)
+    while schedule.for_day(day) is None:
+        day += timedelta(days=1)
+    return day.isoformat()
+
+
+def make_user(server, n: int = 0):
+    """A verified CurrentUser that exists only in the request, not in the users collection"""
+    return server.CurrentUser.model_construct(
+        id=str(uuid.uuid4()), first_name="Giulia", last_name=f"Bianchi{n}", email=f"agency{n}@example.it",
+        agency_name="Immobiliare Navigli", agency_address="Via Vigevano 18, Milano",
+        username=f"agency{n}", is_verified=True,
+    )
+
+
+def booking(day: str, time: str):
+    """An AppointmentCreate for ``time`` on ``day``"""
+    import server
+    return server.AppointmentCreate(
+        date=day, time=time, appointment_address="Corso Buenos Aires 1, Milano",
+        contact_person="Marco Rossi", contact_phone="3381234567",
+    )
+
+
+@pytest.fixture
+async def api(app_db, monkeypatch):
+    """An HTTP client for the app, without its lifespan, with cheap password hashing and fresh rate limits"""
+    import httpx
+    from passlib.context import CryptContext
+    from rate_limit import MemoryBucketStore
+
+    monkeypatch.setattr(app_db.password_hasher, "context", CryptContext(schemes=["plaintext"]))
+    monkeypatch.setattr(app_db.rate_limiter, "store", MemoryBucketStore())
+    transport = httpx.ASGITransport(app=app_db.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+def user_payload(username: str, email: str = None) -> dict:
+    return {
+        "first_name": "Giulia", "last_name": "Bianchi", "email": email or f"{username}@example.it",
+        "agency_name": "Immobiliare Navigli", "agency_address": "Via Vigevano 18, 20144 Milano",
+        "partita_iva": "12345678901", "sede_legale": "Via Vigevano 18, 20144 Milano", "codice_univoco": "M5UXCR1",
+        "username": username, "password": "password123",
+    }
+
+
+async def signed_in(api, username: str) -> dict:
+    """Register ``username`` through the API and return its auth headers"""
+    (await api.post("/api/auth/register", json=user_payload(username))).raise_for_status()
+    response = await api.post("/api/auth/login", json={"username": username, "password": "password123"})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
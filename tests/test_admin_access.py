@@ -0,0 +1,94 @@
+import pytest
+
+import appointment_states
+from admin_users import list_admins, set_admin
+from tests.conftest import bookable_day, booking, make_user, requires_mongo, signed_in, user_payload
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_admin_routes_need_the_flag_not_the_name(api):
+    headers = await signed_in(api, "admin")
+    assert (await api.get("/api/admin/appointments", headers=headers)).status_code == 403
+
+
+async def test_registration_cannot_grant_admin(api, app_db):
+    response = await api.post("/api/auth/register", json={**user_payload("mallory"), "is_admin": True})
+    assert response.status_code == 200
+    assert await list_admins(app_db.db) == []
+
+
+async def test_granted_and_revoked_out_of_band(api, app_db):
+    headers = await signed_in(api, "backoffice")
+
+    assert await set_admin(app_db.db, "backoffice", True)
+    assert await list_admins(app_db.db) == ["backoffice"]
+    assert (await api.get("/api/admin/appointments", headers=headers)).status_code == 200
+
+    assert await set_admin(app_db.db, "backoffice", False)
+    assert (await api.get("/api/admin/appointments", headers=headers)).status_code == 403
+
+
+async def test_grant_needs_an_existing_account(app_db):
+    assert not await set_admin(app_db.db, "nobody", True)
+
+
+@pytest.mark.parametrize("path", ["/api/status", "/api/status/export", "/api/contacts", "/api/contacts/export"])
+async def test_listings_and_exports_are_admin_only(api, app_db, path):
+    assert (await api.get(path)).status_code in (401, 403)
+    headers = await signed_in(api, "backoffice")
+    assert (await api.get(path, headers=headers)).status_code == 403
+
+    await set_admin(app_db.db, "backoffice", True)
+    response = await api.get(path, headers=headers)
+    assert response.status_code == 200
+    if path.endswith("/export"):
+        assert response.headers["content-type"] == "application/x-ndjson"
+
+
+@pytest.fixture
+async def admin_headers(api, app_db):
+    headers = await signed_in(api, "backoffice")
+    await set_admin(app_db.db, "backoffice", True)
+    return headers
+
+
+async def test_review_refuses_an_id_both_confirmed_and_rejected(api, admin_headers):
+    response = await api.post(
+        "/api/admin/appointments/review", json={"confirm": ["apt-1"], "reject": ["apt-1"]}, headers=admin_headers
+    )
+    assert response.status_code == 400
+    empty = await api.post("/api/admin/appointments/review", json={}, headers=admin_headers)
+    assert empty.json() == {"changed": [], "already_handled": [], "not_found": []}
+
+
+@requires_mongo
+async def test_review_partitions_the_batch_and_emails_only_the_changed(api, app_db, admin_headers):
+    server = app_db
+    day = bookable_day(server.schedule)
+    to_confirm, to_reject, handled = [
+        await server.book_appointment(booking(day, time), make_user(server, n))
+        for n, time in enumerate(["09:00", "10:30", "12:00"], start=1)
+    ]
+    await appointment_states.transition(server.db.appointments, handled.id, "confirm", actor="admin:email")
+
+    response = await api.post("/api/admin/appointments/review", json={
+        "confirm": [to_confirm.id, handled.id, "missing"], "reject": [to_reject.id],
+    }, headers=admin_headers)
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "changed": [
+            {"id": to_confirm.id, "action": "confirm", "status": "confirmed"},
+            {"id": to_reject.id, "action": "reject", "status": "rejected"},
+        ],
+        "already_handled": [{"id": handled.id, "action": "confirm", "status": "confirmed"}],
+        "not_found": [{"id": "missing", "action": "confirm", "status": None}],
+    }
+    client_emails = await server.db.email_outbox.find({"to": {"$ne": server.ADMIN_EMAIL}}).to_list(None)
+    assert sorted((m["to"], m["subject"]) for m in client_emails) == [
+        ("agency1@example.it", "✓ Appuntamento Confermato - Spaziopratiche"),
+        ("agency2@example.it", "Appuntamento Non Disponibile - Spaziopratiche"),
+    ]
+    history = (await server.db.appointments.find_one({"id": to_confirm.id}))["history"]
+    assert history[-1]["actor"] == "admin:backoffice"
@@ -0,0 +1,100 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from schedule import ScheduleEngine
+from tests.conftest import bookable_day, booking, make_user, signed_in
+
+pytestmark = pytest.mark.anyio
+
+
+def two_open_days(schedule) -> date:
+    """An open day followed by another open day"""
+    days_ahead = 7
+    while True:
+        day = date.fromisoformat(bookable_day(schedule, days_ahead))
+        if schedule.for_day(day + timedelta(days=1)) is not None:
+            return day
+        days_ahead = (day - date.today()).days + 1
+
+
+@pytest.fixture
+def frozen_now(app_db, monkeypatch):
+    """Pin the server's clock to 10:00 on an open day followed by another open day"""
+    day = two_open_days(app_db.schedule)
+    now = datetime(day.year, day.month, day.day, 10, 0)
+
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now if tz is None else now.astimezone(tz)
+
+    monkeypatch.setattr(app_db, "datetime", FrozenDatetime)
+    return day
+
+
+@pytest.fixture
+async def headers(api):
+    return await signed_in(api, "navigli")
+
+
+async def availability(api, headers, start: date, end: date):
+    return await api.get(
+        "/api/appointments/availability", params={"from": start.isoformat(), "to": end.isoformat()}, headers=headers
+    )
+
+
+def bookable(day: dict) -> list:
+    return [slot["time"] for slot in day["slots"] if slot["available"]]
+
+
+async def test_range_is_capped_at_62_days(api, headers):
+    start = date.today()
+    assert (await availability(api, headers, start, start + timedelta(days=61))).status_code == 200
+    too_long = await availability(api, headers, start, start + timedelta(days=62))
+    assert too_long.status_code == 400 and "62" in too_long.json()["detail"]
+
+
+async def test_range_must_not_end_before_it_starts(api, headers):
+    start = date.today() + timedelta(days=10)
+    assert (await availability(api, headers, start, start - timedelta(days=1))).status_code == 400
+    params = {"from": "05/03/2026", "to": "2026-03-06"}
+    response = await api.get("/api/appointments/availability", params=params, headers=headers)
+    assert response.status_code == 400 and "YYYY-MM-DD" in response.json()["detail"]
+
+
+async def test_closed_days_have_no_slots(api, app_db, headers, monkeypatch):
+    start = date.today() + timedelta(days=14)
+    start += timedelta(days=-start.weekday())  # a Monday
+    monkeypatch.setattr(app_db, "schedule", ScheduleEngine(closed_dates=[start + timedelta(days=2)]))
+
+    days = (await availability(api, headers, start, start + timedelta(days=6))).json()["days"]
+
+    assert [d["date"] for d in days] == [(start + timedelta(days=n)).isoformat() for n in range(7)]
+    open_days = [d["date"] for d in days if d["slots"]]
+    expected = [start + timedelta(days=n) for n in (0, 1, 3, 4)]
+    assert open_days == [d.isoformat() for d in expected if app_db.schedule.for_day(d) is not None]
+    assert all(len(d["slots"]) == 12 for d in days if d["slots"])
+
+
+async def test_slots_within_24_hours_are_not_bookable(api, headers, frozen_now):
+    tomorrow = frozen_now + timedelta(days=1)
+    today, next_day = (await availability(api, headers, frozen_now, tomorrow)).json()["days"]
+
+    assert bookable(today) == []
+    # 10:00 tomorrow is exactly 24 hours away
+    assert bookable(next_day)[0] == "10:30"
+    assert [slot["remaining"] for slot in next_day["slots"][:3]] == [0, 0, 1]
+
+
+async def test_range_agrees_with_the_single_day_endpoint(api, app_db, headers):
+    start = date.fromisoformat(bookable_day(app_db.schedule))
+    await app_db.book_appointment(booking(start.isoformat(), "10:30"), make_user(app_db))
+
+    days = (await availability(api, headers, start, start + timedelta(days=9))).json()["days"]
+
+    for day in days:
+        single = await api.get(f"/api/appointments/availability/{day['date']}", headers=headers)
+        assert single.json() == day
+    booked = next(slot for slot in days[0]["slots"] if slot["time"] == "10:30")
+    assert booked == {"time": "10:30", "available": False, "remaining": 0}
@@ -0,0 +1,377 @@
+import asyncio
+import base64
+from datetime import date, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import appointment_states
+from action_tokens import ActionTokenSigner, InvalidActionToken
+from appointment_states import TransitionRejected
+from schedule import Operator, ScheduleEngine
+from tests.conftest import bookable_day, booking, make_user, requires_mongo
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def two_operators(app_db, monkeypatch):
+    monkeypatch.setattr(app_db, "schedule", ScheduleEngine(operators=[Operator("anna"), Operator("bruno")]))
+    return app_db
+
+
+async def test_user_cannot_book_a_time_they_hold_on_another_operator(two_operators):
+    server = two_operators
+    day = bookable_day(server.schedule)
+    user = make_user(server)
+    await server.book_appointment(booking(day, "09:45"), user)
+    await server.book_appointment(booking(day, "10:30"), user)
+
+    with pytest.raises(HTTPException) as e:
+        await server.book_appointment(booking(day, "10:30"), user)
+    assert e.value.status_code == 400
+    assert await server.db.appointments.count_documents({"user_id": user.id, "date": day}) == 2
+
+
+async def test_concurrent_submits_by_one_user_claim_one_operator(two_operators):
+    server = two_operators
+    day = bookable_day(server.schedule)
+    user = make_user(server)
+
+    results = await asyncio.gather(
+        *(server.book_appointment(booking(day, "09:00"), user) for _ in range(10)), return_exceptions=True
+    )
+
+    booked = [r for r in results if not isinstance(r, Exception)]
+    assert len(booked) == 1
+    assert all(isinstance(r, HTTPException) and r.status_code == 400 for r in results if r not in booked)
+    assert await server.db.appointments.count_documents({"user_id": user.id, "date": day}) == 1
+
+
+async def test_other_users_still_get_the_second_operator(two_operators):
+    server = two_operators
+    day = bookable_day(server.schedule)
+    first = await server.book_appointment(booking(day, "09:00"), make_user(server, 1))
+    second = await server.book_appointment(booking(day, "09:00"), make_user(server, 2))
+    assert {first.operator_id, second.operator_id} == {"anna", "bruno"}
+
+
+async def test_hundreds_of_parallel_bookings_of_one_slot_claim_it_once(app_db):
+    server = app_db
+    day = bookable_day(server.schedule)
+
+    results = await asyncio.gather(
+        *(server.book_appointment(booking(day, "11:15"), make_user(server, n)) for n in range(300)),
+        return_exceptions=True,
+    )
+
+    booked = [r for r in results if isinstance(r, server.Appointment)]
+    refused = [r for r in results if isinstance(r, HTTPException)]
+    assert len(booked) == 1
+    assert len(refused) == 299
+    assert {e.detail for e in refused} == {"Questo slot è già prenotato"}
+    assert await server.db.appointments.count_documents({"date": day, "time": "11:15"}) == 1
+    # The winner's admin notification, and nobody else's
+    assert await server.db.email_outbox.count_documents({}) == 1
+
+
+def block_booking(day: str, time: str, slot_count: int, repeat_weeks: int):
+    import server
+    return server.BlockBookingCreate(
+        **booking(day, time).model_dump(), slot_count=slot_count, repeat_weeks=repeat_weeks
+    )
+
+
+def open_two_weeks_running(schedule) -> str:
+    """A bookable day whose weekday a week later is open too"""
+    day = bookable_day(schedule)
+    while schedule.for_day(date.fromisoformat(day) + timedelta(weeks=1)) is None:
+        day = bookable_day(schedule, (date.fromisoformat(day) - date.today()).days + 1)
+    return day
+
+
+def taken_after_capacity_read(server, monkeypatch, day: str, time: str):
+    """Have another user book ``time`` on ``day`` right after the block reads free capacity"""
+    read_capacity = server.free_capacity
+    raced = []
+
+    async def racing_free_capacity(days, fresh=False):
+        capacity = await read_capacity(days, fresh)
+        monkeypatch.setattr(server, "free_capacity", read_capacity)
+        raced.append(await server.book_appointment(booking(day, time), make_user(server, 99)))
+        return capacity
+    monkeypatch.setattr(server, "free_capacity", racing_free_capacity)
+    return raced
+
+
+async def test_block_with_a_slot_taken_meanwhile_leaves_nothing_behind(app_db, monkeypatch):
+    server = app_db
+    day = open_two_weeks_running(server.schedule)
+    second_week = (date.fromisoformat(day) + timedelta(weeks=1)).isoformat()
+    user = make_user(server)
+    raced = taken_after_capacity_read(server, monkeypatch, second_week, "09:45")
+
+    with pytest.raises(HTTPException) as e:
+        await server.book_block(block_booking(day, "09:00", slot_count=2, repeat_weeks=2), user)
+
+    assert e.value.detail == "Uno o più slot richiesti sono già prenotati"
+    # The first week was claimed, then released with the rest of the block
+    assert await server.db.appointments.count_documents({"user_id": user.id}) == 0
+    assert await server.db.appointments.count_documents({"block_id": {"$ne": None}}) == 0
+    assert [apt["id"] async for apt in server.db.appointments.find()] == [raced[0].id]
+
+
+async def test_block_occurrence_falls_back_to_the_next_operator(two_operators, monkeypatch):
+    server = two_operators
+    day = open_two_weeks_running(server.schedule)
+    second_week = (date.fromisoformat(day) + timedelta(weeks=1)).isoformat()
+    raced = taken_after_capacity_read(server, monkeypatch, second_week, "09:45")
+
+    result = await server.book_block(block_booking(day, "09:00", slot_count=2, repeat_weeks=2), make_user(server))
+
+    assert raced[0].operator_id == "anna"
+    assert [(apt.date, apt.time, apt.operator_id) for apt in result.appointments] == [
+        (day, "09:00", "anna"), (day, "09:45", "anna"),
+        (second_week, "09:00", "bruno"), (second_week, "09:45", "bruno"),
+    ]
+    assert await server.db.appointments.count_documents({"block_id": result.block_id}) == 4
+
+
+# The state machine's pipeline updates ($unset stage, "$status" in $set) don't run on mongomock
+
+async def attempt(coro):
+    """The transition's result, or the TransitionRejected it raised"""
+    try:
+        return await coro
+    except TransitionRejected as e:
+        return e
+
+
+def assert_history_is_a_chain(doc: dict):
+    history = doc["history"]
+    for before, after in zip(history, history[1:]):
+        assert after["from"] == before["to"]
+    assert history[-1]["to"] == doc["status"]
+
+
+@requires_mongo
+async def test_double_confirm_changes_the_appointment_once(app_db):
+    server = app_db
+    apt = await server.book_appointment(booking(bookable_day(server.schedule), "09:00"), make_user(server))
+
+    results = await asyncio.gather(*(
+        attempt(appointment_states.transition(server.db.appointments, apt.id, "confirm", actor="admin:email"))
+        for _ in range(2)
+    ))
+
+    assert len([r for r in results if isinstance(r, dict)]) == 1
+    assert [r.status for r in results if isinstance(r, TransitionRejected)] == ["confirmed"]
+    doc = await server.db.appointments.find_one({"id": apt.id})
+    assert [(h["from"], h["to"], h["action"]) for h in doc["history"]] == [
+        (None, "pending", "create"), ("pending", "confirmed", "confirm"),
+    ]
+
+
+@requires_mongo
+async def test_confirm_racing_reject_has_one_winner(app_db):
+    server = app_db
+    apt = await server.book_appointment(booking(bookable_day(server.schedule), "09:00"), make_user(server))
+
+    confirmed, rejected = await asyncio.gather(
+        attempt(appointment_states.transition(server.db.appointments, apt.id, "confirm", actor="admin:email")),
+        attempt(appointment_states.transition(server.db.appointments, apt.id, "reject", actor="admin:panel")),
+    )
+
+    winner, loser = (confirmed, rejected) if isinstance(confirmed, dict) else (rejected, confirmed)
+    assert isinstance(winner, dict) and isinstance(loser, TransitionRejected)
+    assert loser.status == winner["status"]
+    doc = await server.db.appointments.find_one({"id": apt.id})
+    assert doc["status"] == winner["status"] and len(doc["history"]) == 2
+
+
+@requires_mongo
+async def test_confirm_racing_cancel_leaves_a_cancelled_appointment_and_one_history(app_db):
+    server = app_db
+    user = make_user(server)
+    apt = await server.book_appointment(booking(bookable_day(server.schedule), "09:00"), user)
+
+    confirmed, cancelled = await asyncio.gather(
+        attempt(appointment_states.transition(server.db.appointments, apt.id, "confirm", actor="admin:email")),
+        attempt(appointment_states.transition(
+            server.db.appointments, apt.id, "cancel", actor=f"user:{user.id}", extra_filter={"user_id": user.id}
+        )),
+    )
+
+    # Cancelling a confirmed appointment is allowed, so the confirm may land first; a confirm after the cancel may not
+    assert isinstance(cancelled, dict)
+    doc = await server.db.appointments.find_one({"id": apt.id})
+    assert doc["status"] == "cancelled"
+    assert "slot_key" not in doc and "user_slot_key" not in doc
+    assert_history_is_a_chain(doc)
+    if isinstance(confirmed, TransitionRejected):
+        assert confirmed.status == "cancelled"
+        assert [h["action"] for h in doc["history"]] == ["create", "cancel"]
+    else:
+        assert [h["action"] for h in doc["history"]] == ["create", "confirm", "cancel"]
+
+
+@requires_mongo
+async def test_refused_transition_tells_not_found_from_already_handled(app_db):
+    server = app_db
+    user = make_user(server)
+    apt = await server.book_appointment(booking(bookable_day(server.schedule), "09:00"), user)
+    await appointment_states.transition(server.db.appointments, apt.id, "reject", actor="admin:email")
+
+    with pytest.raises(TransitionRejected) as handled:
+        await appointment_states.transition(server.db.appointments, apt.id, "confirm", actor="admin:email")
+    assert handled.value.status == "rejected"
+
+    with pytest.raises(TransitionRejected) as missing:
+        await appointment_states.transition(server.db.appointments, "no-such-id", "confirm", actor="admin:email")
+    assert missing.value.status is None
+
+    # Someone else's appointment is "not found" to the user, whatever its state
+    with pytest.raises(TransitionRejected) as foreign:
+        await appointment_states.transition(
+            server.db.appointments, apt.id, "cancel", actor="user:other", extra_filter={"user_id": "other"}
+        )
+    assert foreign.value.status is None
+
+    doc = await server.db.appointments.find_one({"id": apt.id})
+    assert doc["status"] == "rejected" and len(doc["history"]) == 2
+
+
+@requires_mongo
+@pytest.mark.parametrize("action", ["cancel", "expire"])
+async def test_released_slot_can_be_booked_again(app_db, action):
+    server = app_db
+    day = bookable_day(server.schedule)
+    user = make_user(server)
+    apt = await server.book_appointment(booking(day, "09:00"), user)
+
+    released = await appointment_states.transition(server.db.appointments, apt.id, action, actor="test")
+    assert released["status"] == "cancelled"
+    assert "slot_key" not in released and "user_slot_key" not in released
+    assert released["history"][-1]["from"] == "pending" and released["history"][-1]["action"] == action
+
+    # Both keys are free again: the same user and another one can each take the time
+    again = await server.book_appointment(booking(day, "09:00"), user)
+    assert again.id != apt.id
+    await appointment_states.transition(server.db.appointments, again.id, action, actor="test")
+    assert (await server.book_appointment(booking(day, "09:00"), make_user(server, 1))).time == "09:00"
+
+
+@requires_mongo
+async def test_cancel_handler_frees_the_slot_in_availability(app_db):
+    server = app_db
+    day = bookable_day(server.schedule)
+    user = make_user(server)
+    apt = await server.book_appointment(booking(day, "09:00"), user)
+
+    assert await server.cancel_appointment(apt.id, user) == {"success": True, "message": "Appuntamento cancellato"}
+    # Cancelling twice is not an error
+    assert (await server.cancel_appointment(apt.id, user))["success"]
+    with pytest.raises(HTTPException) as e:
+        await server.cancel_appointment(apt.id, make_user(server, 1))
+    assert e.value.status_code == 404
+
+    table = server.schedule.for_day(date.fromisoformat(day))
+    capacity = await server.free_capacity([(day, table)])
+    assert capacity[day][server.schedule.primary.id] & table.mask_of(["09:00"])
+
+
+# ---------------------
+# Admin email links
+# ---------------------
+
+def test_action_token_authorizes_one_action_on_one_appointment():
+    signer = ActionTokenSigner("secret", ttl_seconds=3600)
+    token = signer.sign("apt-1", "confirm", now=1000)
+    signer.verify(token, "apt-1", "confirm", now=1000 + 3600)
+
+    for appointment_id, action in [("apt-1", "reject"), ("apt-2", "confirm")]:
+        with pytest.raises(InvalidActionToken):
+            signer.verify(token, appointment_id, action, now=1000)
+    with pytest.raises(InvalidActionToken, match="expired"):
+        signer.verify(token, "apt-1", "confirm", now=1000 + 3601)
+
+
+@pytest.mark.parametrize("forge", [
+    # Signed with another secret
+    lambda token: ActionTokenSigner("guess", ttl_seconds=3600).sign("apt-1", "confirm"),
+    # Payload swapped for one without a valid signature
+    lambda token: ActionTokenSigner("secret", ttl_seconds=3600).sign("apt-2", "confirm").split(".")[0]
+    + "." + token.split(".")[1],
+    # Expiry pushed far into the future
+    lambda token: base64.urlsafe_b64encode(b"apt-1|confirm|99999999999").decode().rstrip("=") + "." + token.split(".")[1],
+    lambda token: "",
+    lambda token: "no-signature",
+    lambda token: token + ".extra",
+    lambda token: "è." + token.split(".")[1],
+])
+def test_forged_or_malformed_tokens_are_refused(forge):
+    signer = ActionTokenSigner("secret", ttl_seconds=3600)
+    with pytest.raises(InvalidActionToken):
+        signer.verify(forge(signer.sign("apt-1", "confirm")), "apt-1", "confirm")
+
+
+@pytest.fixture
+async def pending(app_db):
+    """A pending appointment, as the admin email links find it"""
+    return await app_db.book_appointment(booking(bookable_day(app_db.schedule), "09:00"), make_user(app_db))
+
+
+async def status_of(server, appointment_id: str) -> str:
+    return (await server.db.appointments.find_one({"id": appointment_id}))["status"]
+
+
+@pytest.mark.parametrize("action", ["confirm", "reject"])
+async def test_link_opens_a_prompt_that_changes_nothing(api, app_db, pending, action):
+    token = app_db.action_tokens.sign(pending.id, action)
+    response = await api.get(f"/api/appointments/{pending.id}/{action}", params={"token": token})
+
+    assert response.status_code == 200
+    assert '<form method="post"' in response.text and f'value="{token}"' in response.text
+    assert await status_of(app_db, pending.id) == "pending"
+
+
+@pytest.mark.parametrize("method", ["GET", "POST"])
+async def test_bad_tokens_get_the_invalid_link_page_and_change_nothing(api, app_db, pending, method):
+    tokens = {
+        "forged": ActionTokenSigner("guess", ttl_seconds=3600).sign(pending.id, "confirm"),
+        "for reject": app_db.action_tokens.sign(pending.id, "reject"),
+        "other appointment": app_db.action_tokens.sign("other", "confirm"),
+        "expired": app_db.action_tokens.sign(pending.id, "confirm", now=1000),
+        "missing": "",
+    }
+    for name, token in tokens.items():
+        url = f"/api/appointments/{pending.id}/confirm"
+        if method == "GET":
+            response = await api.get(url, params={"token": token})
+        else:
+            response = await api.post(url, data={"token": token})
+        assert response.status_code == 403, name
+        assert "Link non valido" in response.text
+    assert await status_of(app_db, pending.id) == "pending"
+    assert await app_db.db.email_outbox.count_documents({"to": "agency0@example.it"}) == 0
+
+
+@requires_mongo
+@pytest.mark.parametrize("action, status, subject", [
+    ("confirm", "confirmed", "Confermato"), ("reject", "rejected", "Non Disponibile"),
+])
+async def test_post_with_a_valid_token_applies_the_action_once(api, app_db, pending, action, status, subject):
+    url = f"/api/appointments/{pending.id}/{action}"
+    token = app_db.action_tokens.sign(pending.id, action)
+
+    response = await api.post(url, data={"token": token})
+    assert response.status_code == 200
+    assert await status_of(app_db, pending.id) == status
+    doc = await app_db.db.appointments.find_one({"id": pending.id})
+    assert doc["history"][-1]["actor"] == "admin:email"
+
+    # The link still verifies, but the appointment has been handled
+    again = await api.post(url, data={"token": token})
+    assert again.status_code == 200 and "Già" in again.text
+    emails = await app_db.db.email_outbox.find({"to": "agency0@example.it"}).to_list(None)
+    assert len(emails) == 1 and subject in emails[0]["subject"]
@@ -0,0 +1,71 @@
+from availability_cache import AvailabilityCache
+from metrics import CACHE_ENTRIES, CACHE_EVICTIONS, CACHE_LOOKUPS
+from ttl_cache import TTLCache
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = TTLCache("test_expiry", max_size=10, ttl_seconds=60, clock=clock)
+    cache.set("u1", "giulia")
+    clock.now += 59
+    assert cache.get("u1") == "giulia"
+    clock.now += 2
+    assert cache.get("u1") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache("test_lru", max_size=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert CACHE_EVICTIONS.value(cache="test_lru") == 1
+
+
+def test_lookups_and_size_are_exported():
+    cache = TTLCache("test_metrics", max_size=10, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    assert CACHE_LOOKUPS.value(cache="test_metrics", result="hit") == 1
+    assert CACHE_LOOKUPS.value(cache="test_metrics", result="miss") == 1
+    assert CACHE_ENTRIES.value(cache="test_metrics") == 1
+    cache.invalidate("a")
+    assert CACHE_ENTRIES.value(cache="test_metrics") == 0
+
+
+def test_load_started_before_an_invalidation_is_not_stored():
+    cache = AvailabilityCache(today=lambda: "2026-03-01")
+    generation = cache.generation("2026-03-05")
+    cache.invalidate("2026-03-05")
+    cache.set("2026-03-05", {"default": 0b1}, generation)
+    assert cache.get("2026-03-05") is None
+
+    cache.set("2026-03-05", {"default": 0b1}, cache.generation("2026-03-05"))
+    assert cache.get("2026-03-05") == {"default": 0b1}
+
+
+def test_generations_of_past_dates_are_pruned_once_a_day():
+    today = ["2026-03-01"]
+    cache = AvailabilityCache(today=lambda: today[0])
+    cache.invalidate(*(f"2026-03-{d:02d}" for d in range(1, 31)))
+    assert len(cache._generations) == 30
+
+    today[0] = "2026-03-20"
+    cache.invalidate("2026-03-25")
+    assert sorted(cache._generations) == [f"2026-03-{d:02d}" for d in range(20, 31)]
+
+
+def test_load_in_flight_across_a_prune_is_not_stored():
+    today = ["2026-03-01"]
+    cache = AvailabilityCache(today=lambda: today[0])
+    cache.invalidate("2026-03-02")
+    in_flight = {d: cache.generation(d) for d in ("2026-03-02", "2026-03-09")}
+
+    today[0] = "2026-03-05"
+    cache.invalidate("2026-03-06")
+    for day, generation in in_flight.items():
+        cache.set(day, {"default": 0}, generation)
+        assert cache.get(day) is None
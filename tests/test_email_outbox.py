@@ -0,0 +1,38 @@
+import httpx
+import pytest
+
+from email_outbox import STATUS_FAILED, STATUS_SENT, EmailOutbox
+
+pytestmark = pytest.mark.anyio
+
+
+def outbox(mongo, status_code: int) -> EmailOutbox:
+    box = EmailOutbox(mongo.email_outbox, api_url="https://resend.test/emails", api_key="k",
+                      from_email="noreply@example.it", max_attempts=1)
+    box._client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(status_code)))
+    return box
+
+
+async def deliver_one(box: EmailOutbox) -> dict:
+    await box.enqueue("giulia@example.it", "Oggetto", "<p>html</p>", "text")
+    # Read rather than _claim(): mongomock's ReturnDocument.AFTER re-applies the filter the claim just falsified
+    job = await box.collection.find_one({}, {"_id": 0})
+    await box._deliver({**job, "attempts": 1})
+    return await box.collection.find_one({})
+
+
+async def test_sent_messages_drop_their_bodies(mongo):
+    doc = await deliver_one(outbox(mongo, 200))
+    assert doc["status"] == STATUS_SENT and doc["sent_at"] is not None
+    assert "html" not in doc and "text" not in doc
+
+
+async def test_failed_messages_keep_their_bodies(mongo):
+    doc = await deliver_one(outbox(mongo, 422))
+    assert doc["status"] == STATUS_FAILED
+    assert doc["html"] == "<p>html</p>" and doc["text"] == "text"
+
+
+async def test_sent_messages_expire(mongo):
+    indexes = await mongo.email_outbox.index_information()
+    assert indexes["email_outbox_sent_at_ttl"]["expireAfterSeconds"] == 30 * 86400
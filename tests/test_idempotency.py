@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from idempotency import DONE, IN_PROGRESS, IdempotencyConflict, IdempotencyInProgress, IdempotencyStore
+from tests.conftest import signed_in
+
+pytestmark = pytest.mark.anyio
+
+
+class Handler:
+    """Counts its runs; returns ``result`` or raises it, optionally only once ``release`` is set"""
+
+    def __init__(self, result=None, blocked: bool = False):
+        self.result = result if result is not None else {"id": "apt-1"}
+        self.calls = 0
+        self.release = asyncio.Event()
+        if not blocked:
+            self.release.set()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+@pytest.fixture
+def store(mongo):
+    return IdempotencyStore(mongo.idempotency_keys, wait_seconds=0.5, poll_interval=0.01)
+
+
+async def test_retry_gets_the_stored_response(store):
+    handler = Handler()
+    assert await store.execute("k", "body", handler) == ((200, {"id": "apt-1"}), False)
+    assert await store.execute("k", "body", handler) == ((200, {"id": "apt-1"}), True)
+    assert handler.calls == 1
+
+
+async def test_key_reused_with_another_body_conflicts(store):
+    await store.execute("k", "body", Handler())
+    with pytest.raises(IdempotencyConflict):
+        await store.execute("k", "other body", Handler())
+
+
+async def test_client_errors_are_stored_and_replayed(store):
+    handler = Handler(HTTPException(status_code=400, detail="Orario non valido"))
+    with pytest.raises(HTTPException):
+        await store.execute("k", "body", handler)
+    assert await store.execute("k", "body", handler) == ((400, {"detail": "Orario non valido"}), True)
+    assert handler.calls == 1
+
+
+@pytest.mark.parametrize("error", [HTTPException(status_code=503, detail="busy"), ConnectionError("mongo down")])
+async def test_server_errors_drop_the_record_so_the_retry_runs_again(store, error):
+    handler = Handler(error)
+    with pytest.raises(type(error)):
+        await store.execute("k", "body", handler)
+    assert await store.collection.find_one({"_id": "k"}) is None
+
+    handler.result = {"id": "apt-1"}
+    assert await store.execute("k", "body", handler) == ((200, {"id": "apt-1"}), False)
+    assert handler.calls == 2
+
+
+async def test_duplicate_in_the_same_process_waits_for_the_first(store):
+    handler = Handler(blocked=True)
+    first = asyncio.create_task(store.execute("k", "body", handler))
+    second = asyncio.create_task(store.execute("k", "body", handler))
+    await asyncio.sleep(0.05)
+    handler.release.set()
+
+    assert await first == ((200, {"id": "apt-1"}), False)
+    assert await second == ((200, {"id": "apt-1"}), True)
+    assert handler.calls == 1
+
+
+async def test_duplicate_on_another_replica_polls_for_the_result(mongo):
+    replica_a = IdempotencyStore(mongo.idempotency_keys, poll_interval=0.01)
+    replica_b = IdempotencyStore(mongo.idempotency_keys, poll_interval=0.01)
+    handler = Handler(blocked=True)
+    first = asyncio.create_task(replica_a.execute("k", "body", handler))
+    await asyncio.sleep(0.05)
+    second = asyncio.create_task(replica_b.execute("k", "body", handler))
+    await asyncio.sleep(0.05)
+    handler.release.set()
+
+    assert (await first)[1] is False
+    assert await second == ((200, {"id": "apt-1"}), True)
+    assert handler.calls == 1
+
+
+async def test_duplicate_gives_up_once_the_wait_is_over(mongo):
+    assert IdempotencyStore(mongo.idempotency_keys).wait_seconds == 10
+    replica_a = IdempotencyStore(mongo.idempotency_keys)
+    replica_b = IdempotencyStore(mongo.idempotency_keys, wait_seconds=0.05, poll_interval=0.01)
+    handler = Handler(blocked=True)
+    first = asyncio.create_task(replica_a.execute("k", "body", handler))
+    await asyncio.sleep(0.02)
+
+    with pytest.raises(IdempotencyInProgress):
+        await replica_b.execute("k", "body", handler)
+    handler.release.set()
+    await first
+
+
+async def test_stale_lock_of_a_crashed_request_is_taken_over(store):
+    now = datetime.now(timezone.utc)
+    await store.collection.insert_one({
+        "_id": "k", "fingerprint": "body", "status": IN_PROGRESS, "locked_until": now - timedelta(seconds=1),
+        "created_at": now - timedelta(seconds=31), "expires_at": now + timedelta(days=1),
+    })
+    handler = Handler()
+
+    assert await store.execute("k", "body", handler) == ((200, {"id": "apt-1"}), False)
+    assert (await store.collection.find_one({"_id": "k"}))["status"] == DONE
+    assert handler.calls == 1
+
+
+async def test_live_lock_is_not_taken_over(store):
+    now = datetime.now(timezone.utc)
+    await store.collection.insert_one({
+        "_id": "k", "fingerprint": "body", "status": IN_PROGRESS, "locked_until": now + timedelta(seconds=30),
+        "created_at": now, "expires_at": now + timedelta(days=1),
+    })
+    handler = Handler()
+    with pytest.raises(IdempotencyInProgress):
+        await store.execute("k", "body", handler)
+    assert handler.calls == 0
+
+
+# ---------------------
+# Through the endpoints
+# ---------------------
+
+@pytest.fixture
+def server_store(app_db, store, monkeypatch):
+    monkeypatch.setattr(app_db, "idempotency_store", store)
+    return store
+
+
+CONTACT = {"name": "Luca Verdi", "email": "luca@example.it", "service": "visura", "message": "Vorrei un preventivo"}
+
+
+async def test_replayed_contact_is_saved_once(api, app_db, server_store):
+    headers = {"Idempotency-Key": "contact-1"}
+    first = await api.post("/api/contact", json=CONTACT, headers=headers)
+    again = await api.post("/api/contact", json=CONTACT, headers=headers)
+
+    assert first.status_code == again.status_code == 200
+    assert "Idempotent-Replayed" not in first.headers
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert again.json() == first.json()
+    assert await app_db.db.contact_requests.count_documents({}) == 1
+    assert await app_db.db.email_outbox.count_documents({}) == 1
+
+
+async def test_key_reused_for_another_contact_is_422(api, server_store):
+    headers = {"Idempotency-Key": "contact-1"}
+    await api.post("/api/contact", json=CONTACT, headers=headers)
+    response = await api.post("/api/contact", json={**CONTACT, "name": "Anna Neri"}, headers=headers)
+    assert response.status_code == 422
+
+
+async def test_refused_booking_is_replayed(api, app_db, server_store):
+    headers = {**await signed_in(api, "navigli"), "Idempotency-Key": "apt-1"}
+    body = {
+        "date": "2020-01-01", "time": "09:00", "appointment_address": "Corso Buenos Aires 1, Milano",
+        "contact_person": "Marco Rossi", "contact_phone": "3381234567",
+    }
+    first = await api.post("/api/appointments", json=body, headers=headers)
+    again = await api.post("/api/appointments", json=body, headers=headers)
+
+    assert first.status_code == again.status_code == 400
+    assert again.json() == first.json()
+    assert again.headers["Idempotent-Replayed"] == "true"
+
+
+async def test_request_still_running_elsewhere_is_409_with_retry_after(api, app_db, server_store):
+    # What another replica, still running the same submission, has written
+    now = datetime.now(timezone.utc)
+    fingerprint = hashlib.sha256(app_db.ContactRequestCreate(**CONTACT).model_dump_json().encode()).hexdigest()
+    await server_store.collection.insert_one({
+        "_id": "contact:contact-1", "fingerprint": fingerprint, "status": IN_PROGRESS,
+        "locked_until": now + timedelta(seconds=30), "created_at": now, "expires_at": now + timedelta(days=1),
+    })
+    response = await api.post("/api/contact", json=CONTACT, headers={"Idempotency-Key": "contact-1"})
+    assert response.status_code == 409
+    assert response.headers["Retry-After"] == "1"
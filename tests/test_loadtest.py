@@ -0,0 +1,43 @@
+import httpx
+import pytest
+
+import metrics
+from loadtest import LOOP_LAG_METRIC, histogram_delta, scrape_histogram
+from metrics import Histogram
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    # Keep the histograms made here out of the app's /metrics
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+
+
+def metrics_client(histogram: Histogram) -> httpx.AsyncClient:
+    def handler(request):
+        return httpx.Response(200, text="\n".join(histogram.render()) + "\n")
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://server")
+
+
+async def test_loop_lag_is_the_difference_between_two_scrapes():
+    lag = Histogram(LOOP_LAG_METRIC, "lag", buckets=(0.001, 0.01, 0.1, 1.0))
+    lag.observe(0.0005)
+    async with metrics_client(lag) as client:
+        before = await scrape_histogram(client, LOOP_LAG_METRIC)
+        for value in [0.0005] * 97 + [0.05, 0.5, 2.0]:
+            lag.observe(value)
+        delta = histogram_delta(before, await scrape_histogram(client, LOOP_LAG_METRIC))
+
+    assert delta["count"] == 100
+    assert delta["mean_ms"] == pytest.approx((0.0005 * 97 + 2.55) / 100 * 1000, abs=1e-3)
+    assert delta["p50_le_ms"] == 1.0
+    assert delta["p99_le_ms"] == 1000.0
+    assert delta["max_le_ms"] is None
+
+
+async def test_no_samples_yet():
+    lag = Histogram(LOOP_LAG_METRIC, "lag")
+    async with metrics_client(lag) as client:
+        before = await scrape_histogram(client, LOOP_LAG_METRIC)
+        assert histogram_delta(before, await scrape_histogram(client, LOOP_LAG_METRIC)) == {"count": 0}
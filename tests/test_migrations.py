@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from migrations import MIGRATIONS, check_query_plans, run_migrations
+from tests.conftest import requires_mongo, user_payload
+
+pytestmark = pytest.mark.anyio
+
+
+def legacy_user(id: str, username: str, email: str, verified: bool) -> dict:
+    return {"id": id, "username": username, "email": email, "is_verified": verified, "hashed_password": "x"}
+
+
+async def test_duplicate_users_are_set_aside_before_the_unique_indexes(blank_mongo):
+    await blank_mongo.users.insert_many([
+        legacy_user("u1", "navigli", "navigli@example.it", False),
+        legacy_user("u2", "navigli", "other@example.it", True),
+        legacy_user("u3", "brera", "brera@example.it", False),
+        legacy_user("u4", "brera_2", "brera@example.it", False),
+    ])
+
+    await run_migrations(blank_mongo)
+
+    kept = [u["id"] async for u in blank_mongo.users.find({}, {"id": 1}).sort("id", 1)]
+    assert kept == ["u2", "u3"]
+    moved = {u["id"]: u async for u in blank_mongo.users_duplicates.find()}
+    assert moved["u1"]["duplicate_of"] == "u2" and moved["u1"]["duplicate_field"] == "username"
+    assert moved["u4"]["duplicate_of"] == "u3" and moved["u4"]["duplicate_field"] == "email"
+    assert len(await blank_mongo.schema_migrations.find().to_list(None)) == len(MIGRATIONS)
+
+
+async def test_concurrent_registrations_of_one_username(api):
+    responses = await asyncio.gather(*(
+        api.post("/api/auth/register", json=user_payload("navigli", email=f"agent{n}@example.it"))
+        for n in range(5)
+    ))
+    assert sorted(r.status_code for r in responses) == [200, 400, 400, 400, 400]
+    assert {r.json()["detail"] for r in responses if r.status_code == 400} == {"Username già in uso"}
+
+
+async def test_concurrent_registrations_of_one_email(api):
+    responses = await asyncio.gather(*(
+        api.post("/api/auth/register", json=user_payload(f"agent{n}", email="navigli@example.it"))
+        for n in range(5)
+    ))
+    assert sorted(r.status_code for r in responses) == [200, 400, 400, 400, 400]
+    assert {r.json()["detail"] for r in responses if r.status_code == 400} == {"Email già registrata"}
+
+
+@requires_mongo
+async def test_hot_queries_use_an_index(mongo):
+    assert await check_query_plans(mongo) == []
+
+
+async def test_unparseable_dates_are_skipped_not_the_rest(mongo):
+    from migrations import convert_string_dates
+
+    # A whole first batch of junk used to end the conversion early
+    await mongo.status_checks.insert_many(
+        [{"id": f"bad{n}", "timestamp": "not a date"} for n in range(3)]
+        + [{"id": f"ok{n}", "timestamp": f"2025-03-0{n + 1}T10:00:00"} for n in range(3)]
+    )
+
+    await convert_string_dates(mongo, batch_size=2)
+
+    converted = await mongo.status_checks.count_documents({"timestamp": {"$type": "date"}})
+    left = [d["timestamp"] async for d in mongo.status_checks.find({"timestamp": {"$type": "string"}})]
+    assert converted == 3
+    assert left == ["not a date"] * 3
@@ -0,0 +1,51 @@
+import base64
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from admin_users import set_admin
+from pagination import decode_cursor, encode_cursor
+from tests.conftest import signed_in
+
+pytestmark = pytest.mark.anyio
+
+
+def raw_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def test_cursor_round_trip():
+    at = datetime(2026, 3, 5, 9, 30, tzinfo=timezone.utc)
+    assert decode_cursor(encode_cursor({"created_at": at, "id": "c1"}, "created_at")) == (at, "c1")
+    assert decode_cursor(encode_cursor({"name": "Rossi", "id": "c2"}, "name")) == ("Rossi", "c2")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64 !",
+    raw_cursor({"$ne": None}),
+    raw_cursor([{"$ne": None}, "zzzz"]),
+    raw_cursor([["a"], "zzzz"]),
+    raw_cursor([True, "zzzz"]),
+    raw_cursor(["2026-03-05", {"$gt": ""}]),
+    raw_cursor([{"$gt": ""}, "zzzz", "date"]),
+    raw_cursor(["yesterday", "zzzz", "date"]),
+    raw_cursor(["2026-03-05", "zzzz", "other"]),
+    raw_cursor(["2026-03-05"]),
+])
+def test_malformed_or_hostile_cursors_are_refused(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+async def test_hostile_cursor_is_a_bad_request(api, app_db):
+    await app_db.db.contact_requests.insert_one({
+        "id": "c1", "name": "Luca", "email": "luca@example.it", "service": "visura",
+        "message": "Vorrei un preventivo", "status": "new", "created_at": datetime.now(timezone.utc),
+    })
+    headers = await signed_in(api, "backoffice")
+    await set_admin(app_db.db, "backoffice", True)
+
+    response = await api.get("/api/contacts", params={"cursor": raw_cursor([{"$ne": None}, "zzzz"])}, headers=headers)
+    assert response.status_code == 400
+    assert (await api.get("/api/contacts", headers=headers)).json()[0]["id"] == "c1"
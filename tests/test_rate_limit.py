@@ -0,0 +1,98 @@
+import pytest
+
+from rate_limit import MemoryBucketStore, RateLimited, RateLimiter, RateLimitMiddleware, client_ip, parse_rate
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def limiter(clock):
+    return RateLimiter(MemoryBucketStore(clock=clock))
+
+
+def test_parse_rate():
+    assert parse_rate("login", "10/minute") == ("login", 10, 60)
+    assert parse_rate("login", "3/30").period == 30
+    with pytest.raises(ValueError):
+        parse_rate("login", "0/minute")
+
+
+async def test_burst_up_to_the_limit_then_refused(limiter):
+    rate = parse_rate("login", "3/minute")
+    for _ in range(3):
+        await limiter.hit("1.2.3.4", rate)
+    with pytest.raises(RateLimited) as e:
+        await limiter.hit("1.2.3.4", rate)
+    assert e.value.retry_after == pytest.approx(20)
+    assert e.value.retry_after_header == "20"
+
+
+async def test_tokens_refill_with_time(limiter, clock):
+    rate = parse_rate("login", "3/minute")
+    for _ in range(3):
+        await limiter.hit("1.2.3.4", rate)
+    clock.now += 20
+    await limiter.hit("1.2.3.4", rate)
+    with pytest.raises(RateLimited):
+        await limiter.hit("1.2.3.4", rate)
+    # A full period refills the bucket, but never above the limit
+    clock.now += 3600
+    for _ in range(3):
+        await limiter.hit("1.2.3.4", rate)
+    with pytest.raises(RateLimited):
+        await limiter.hit("1.2.3.4", rate)
+
+
+async def test_keys_and_rates_have_separate_buckets(limiter):
+    login, register = parse_rate("login", "1/minute"), parse_rate("register", "1/minute")
+    await limiter.hit("1.2.3.4", login)
+    await limiter.hit("5.6.7.8", login)
+    await limiter.hit("1.2.3.4", register)
+    with pytest.raises(RateLimited):
+        await limiter.hit("1.2.3.4", login)
+
+
+async def test_least_recently_used_key_is_dropped_when_full(clock):
+    store = MemoryBucketStore(max_keys=2, clock=clock)
+    rate = parse_rate("login", "1/minute")
+    for key in ("a", "b", "c"):
+        assert await store.take(key, rate) == 0
+    # "a" was evicted, so it starts again with a full bucket; "c" was kept and is empty
+    assert await store.take("a", rate) == 0
+    assert await store.take("c", rate) > 0
+
+
+async def test_broken_store_allows_the_request():
+    class BrokenStore:
+        async def take(self, key, rate):
+            raise ConnectionError("redis down")
+
+    await RateLimiter(BrokenStore()).hit("1.2.3.4", parse_rate("login", "1/minute"))
+
+
+def test_client_ip_trusts_the_last_forwarded_hop_only_when_asked():
+    scope = {"client": ("10.0.0.1", 1234), "headers": [(b"x-forwarded-for", b"6.6.6.6, 1.2.3.4")]}
+    assert client_ip(scope) == "10.0.0.1"
+    assert client_ip(scope, trust_forwarded=True) == "1.2.3.4"
+
+
+async def test_middleware_answers_429_with_retry_after(limiter):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    middleware = RateLimitMiddleware(app, limiter, {("POST", "/api/auth/login"): [parse_rate("login_ip", "1/minute")]})
+    scope = {"type": "http", "method": "POST", "path": "/api/auth/login", "client": ("1.2.3.4", 1), "headers": []}
+
+    async def call():
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+        await middleware(scope, None, send)
+        return sent[0]
+
+    assert (await call())["status"] == 200
+    refused = await call()
+    assert refused["status"] == 429
+    assert (b"retry-after", b"60") in refused["headers"]
@@ -0,0 +1,115 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from schedule import DaySchedule, Operator, ScheduleEngine, easter_sunday, italian_holidays, parse_hhmm
+
+
+def baseline_slots():
+    """generate_time_slots() as server.py had it before the schedule engine"""
+    slots = []
+    current = datetime.strptime("9:00", "%H:%M")
+    end = datetime.strptime("18:00", "%H:%M")
+    while current < end:
+        if current + timedelta(minutes=45) <= end:
+            slots.append(current.strftime("%H:%M"))
+        current = current + timedelta(minutes=45)
+    return slots
+
+
+@pytest.mark.parametrize("year, easter", [
+    (2000, date(2000, 4, 23)), (2019, date(2019, 4, 21)), (2024, date(2024, 3, 31)),
+    (2025, date(2025, 4, 20)), (2026, date(2026, 4, 5)),
+    # The earliest and latest possible dates
+    (2285, date(2285, 3, 22)), (2038, date(2038, 4, 25)),
+])
+def test_easter_sunday(year, easter):
+    assert easter_sunday(year) == easter
+
+
+def test_italian_holidays():
+    holidays = italian_holidays(2026)
+    assert date(2026, 4, 6) in holidays  # Lunedì dell'Angelo
+    assert date(2026, 4, 5) not in holidays  # Easter itself is a Sunday anyway
+    assert {date(2026, 1, 1), date(2026, 4, 25), date(2026, 6, 2), date(2026, 12, 8), date(2026, 12, 26)} <= holidays
+    assert len(holidays) == 11
+    assert date(2025, 4, 21) in italian_holidays(2025)
+
+
+def test_default_engine_matches_the_old_grid():
+    engine = ScheduleEngine()
+    table = engine.for_day(date(2026, 3, 5))
+    assert table.times == baseline_slots()
+    assert table.times[0] == "09:00" and table.times[-1] == "17:15" and len(table.times) == 12
+    assert table.offsets == [parse_hhmm(t) for t in table.times]
+
+
+def test_weekends_and_holidays_are_closed():
+    engine = ScheduleEngine()
+    assert engine.for_day(date(2026, 3, 7)) is None  # Saturday
+    assert engine.for_day(date(2026, 3, 8)) is None  # Sunday
+    assert engine.for_day(date(2026, 4, 6)) is None  # Easter Monday
+    assert engine.for_day(date(2026, 4, 7)) is engine.default
+    assert ScheduleEngine(national_holidays=False).for_day(date(2026, 4, 6)) is not None
+
+
+def test_breaks_remove_slots_and_adjacency():
+    table = DaySchedule(9 * 60, 18 * 60, 45, breaks=[(13 * 60, 14 * 60)])
+    # 12:45-13:30 would overlap the break: the day resumes at 14:00
+    assert "12:45" not in table.times
+    assert table.times[4:6] == ["12:00", "14:00"]
+    assert table.times[-1] == "17:00"
+
+    before, after = table.index["12:00"], table.index["14:00"]
+    assert after == before + 1
+    assert not table.is_adjacent(1 << before, after)
+    assert table.run(before, 2) is None
+    assert table.run(before - 1, 2) == 0b11 << (before - 1)
+    assert not table.touches(table.mask_of(["12:00"]), table.mask_of(["14:00"]))
+    assert table.touches(table.mask_of(["12:00"]), table.mask_of(["11:15"]))
+
+
+def test_run_stops_at_closing():
+    table = ScheduleEngine().default
+    last = len(table.times) - 1
+    assert table.run(last, 1) == 1 << last
+    assert table.run(last, 2) is None
+    assert table.run(0, 3) == 0b111
+
+
+def test_touches_either_side_only():
+    table = ScheduleEngine().default
+    held = table.mask_of(["10:30"])
+    assert table.touches(held, table.mask_of(["09:45"]))
+    assert table.touches(held, table.mask_of(["11:15", "12:00"]))
+    assert not table.touches(held, table.mask_of(["12:00"]))
+
+
+def test_env_settings():
+    engine = ScheduleEngine.from_env({
+        "SCHEDULE_BREAKS": "13:00-14:00",
+        "SCHEDULE_CLOSED_DATES": "2026-08-10, 2026-08-11",
+        "SCHEDULE_OVERRIDES": "2026-12-24=09:00-12:00; 2026-03-05=closed; 2026-03-07=10:00-13:00",
+        "SCHEDULE_OPERATORS": "anna; marco=09:00-13:00@mon,wed",
+    })
+    assert engine.for_day(date(2026, 8, 10)) is None
+    assert engine.for_day(date(2026, 8, 12)) is engine.default
+    assert engine.for_day(date(2026, 12, 24)).times == ["09:00", "09:45", "10:30", "11:15"]
+    assert engine.for_day(date(2026, 3, 5)) is None
+    # An override opens a day that would be closed (a Saturday here)
+    assert engine.for_day(date(2026, 3, 7)).times[0] == "10:00"
+    assert "12:45" not in engine.default.times
+
+    anna, marco = engine.operators
+    assert engine.primary is anna
+    monday, tuesday = date(2026, 3, 9), date(2026, 3, 10)
+    assert [op.id for op, _ in engine.staff(tuesday, engine.default)] == ["anna"]
+    marco_slots = [t for t, works in engine.default.slots(marco.working_mask(engine.default, monday)) if works]
+    assert marco_slots == ["09:00", "09:45", "10:30", "11:15", "12:00"]
+
+
+def test_unconfigured_engine_has_one_operator_working_every_slot():
+    engine = ScheduleEngine.from_env({})
+    table = engine.for_day(date(2026, 3, 5))
+    assert [(op.id, mask) for op, mask in engine.staff(date(2026, 3, 5), table)] == [("default", table.full_mask)]
+    assert Operator.parse("luca=14:00-18:00@fri").weekdays == frozenset({4})
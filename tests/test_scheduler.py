@@ -0,0 +1,169 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from appointment_states import DueTimes
+from scheduler import Job, JobScheduler, LeaderLease
+from tests.conftest import bookable_day, booking, make_user, requires_mongo
+
+pytestmark = pytest.mark.anyio
+
+PAST = datetime.now(timezone.utc) - timedelta(minutes=1)
+
+
+# ---------------------
+# Lease and scheduler
+# ---------------------
+
+async def test_lease_is_not_taken_while_held(mongo):
+    first = LeaderLease(mongo.scheduler_leases, "jobs", owner="replica-1")
+    second = LeaderLease(mongo.scheduler_leases, "jobs", owner="replica-2")
+
+    assert await first.acquire()
+    assert not await second.acquire()
+    # The holder renews
+    assert await first.acquire()
+    assert not second.held
+
+
+async def test_lapsed_lease_is_taken_over(mongo):
+    first = LeaderLease(mongo.scheduler_leases, "jobs", owner="replica-1")
+    second = LeaderLease(mongo.scheduler_leases, "jobs", owner="replica-2")
+    await first.acquire()
+
+    # replica-1 stops renewing
+    await mongo.scheduler_leases.update_one({"_id": "jobs"}, {"$set": {"expires_at": PAST}})
+    assert await second.acquire()
+    assert not await first.acquire()
+    assert (await mongo.scheduler_leases.find_one({"_id": "jobs"}))["owner"] == "replica-2"
+
+
+async def test_released_lease_is_free_at_once(mongo):
+    first = LeaderLease(mongo.scheduler_leases, "jobs", owner="replica-1")
+    second = LeaderLease(mongo.scheduler_leases, "jobs", owner="replica-2")
+    await first.acquire()
+    await first.release()
+    assert await second.acquire()
+
+
+async def test_only_the_leader_runs_jobs(mongo):
+    runs = []
+
+    def scheduler(owner: str) -> JobScheduler:
+        async def job() -> int:
+            runs.append(owner)
+            return 0
+        return JobScheduler(LeaderLease(mongo.scheduler_leases, "jobs", owner=owner), [Job("job", job, 60)])
+
+    first, second = scheduler("replica-1"), scheduler("replica-2")
+    await first.tick()
+    await second.tick()
+    # Not due again until its interval has passed
+    await first.tick()
+    assert runs == ["replica-1"]
+
+
+async def test_failing_job_does_not_stop_the_others(mongo):
+    ran = []
+
+    async def broken() -> int:
+        raise RuntimeError("boom")
+
+    async def working() -> int:
+        ran.append(True)
+        return 1
+
+    jobs = [Job("broken", broken, 60), Job("working", working, 60)]
+    await JobScheduler(LeaderLease(mongo.scheduler_leases, "jobs"), jobs).tick()
+    assert ran == [True]
+
+
+async def test_zero_hours_turns_a_job_off(app_db, monkeypatch):
+    server = app_db
+    monkeypatch.setattr(server, "due_times", DueTimes(reminder_lead_hours=0, admin_reping_hours=12, pending_hold_hours=0))
+    assert [job.name for job in server.create_job_scheduler().jobs] == ["remind_admin_of_pending"]
+
+    due = server.due_times.for_appointment("2026-03-05", "09:00", datetime.now(timezone.utc))
+    assert set(due) == {"admin_ping_at"}
+
+
+# ---------------------
+# Jobs (claims and transitions are pipeline updates, which mongomock doesn't run)
+# ---------------------
+
+async def booked(server, n: int = 0, time: str = "09:00", **due) -> dict:
+    """A pending appointment whose due fields are overridden with ``due``"""
+    apt = await server.book_appointment(booking(bookable_day(server.schedule), time), make_user(server, n))
+    if due:
+        await server.db.appointments.update_one({"id": apt.id}, {"$set": due})
+    return await server.db.appointments.find_one({"id": apt.id}, {"_id": 0})
+
+
+async def emails(server, subject_part: str) -> list:
+    return [m async for m in server.db.email_outbox.find({"subject": {"$regex": subject_part}})]
+
+
+@requires_mongo
+async def test_expired_hold_is_cancelled_and_frees_its_slot(app_db):
+    server = app_db
+    expired = await booked(server, 1, expires_at=PAST)
+    waiting = await booked(server, 2, time="10:30")
+
+    assert await server.expire_pending_holds() == 1
+    doc = await server.db.appointments.find_one({"id": expired["id"]})
+    assert doc["status"] == "cancelled" and "slot_key" not in doc
+    assert doc["history"][-1]["action"] == "expire" and doc["history"][-1]["actor"] == "scheduler"
+    assert (await server.db.appointments.find_one({"id": waiting["id"]}))["status"] == "pending"
+    assert len(await emails(server, "scaduta")) == 1
+
+    again = await server.book_appointment(booking(expired["date"], expired["time"]), make_user(server, 3))
+    assert again.time == expired["time"]
+    assert await server.expire_pending_holds() == 0
+
+
+@requires_mongo
+async def test_concurrent_claims_take_each_item_once(app_db, monkeypatch):
+    server = app_db
+    monkeypatch.setattr(server, "SCHEDULER_BATCH_SIZE", 4)
+    times = server.schedule.for_day(date.fromisoformat(bookable_day(server.schedule))).times[:10]
+    ids = {(await booked(server, n, time, admin_ping_at=PAST))["id"] for n, time in enumerate(times)}
+    later = {"$set": {"admin_ping_at": datetime.now(timezone.utc) + timedelta(hours=12)}}
+
+    async def drain() -> list:
+        claimed = []
+        while batch := await server.claim_due({"status": "pending"}, later, "admin_ping_at"):
+            claimed.extend(apt["id"] for apt in batch)
+        return claimed
+
+    first, second = await asyncio.gather(drain(), drain())
+    assert not set(first) & set(second)
+    assert sorted(first + second) == sorted(ids)
+
+
+@requires_mongo
+async def test_reminders_go_out_once_and_only_before_the_appointment(app_db):
+    server = app_db
+    upcoming = await booked(server, 1, status="confirmed", reminder_at=PAST)
+    await server.db.appointments.insert_one({
+        **upcoming, "id": "started", "date": "2020-03-05", "slot_key": "started", "user_slot_key": "started",
+    })
+
+    assert await server.send_due_reminders() == 1
+    assert await server.send_due_reminders() == 0
+    reminders = await emails(server, "Promemoria")
+    assert [m["to"] for m in reminders] == [upcoming["user_email"]]
+    assert await server.db.appointments.count_documents({"reminder_at": {"$exists": True}, "status": "confirmed"}) == 0
+
+
+@requires_mongo
+async def test_admin_is_pinged_once_per_interval_with_every_pending_request(app_db):
+    server = app_db
+    await booked(server, 1, admin_ping_at=PAST)
+    await booked(server, 2, time="10:30", admin_ping_at=PAST)
+    await booked(server, 3, time="11:15")
+
+    assert await server.remind_admin_of_pending() == 2
+    assert await server.remind_admin_of_pending() == 0
+    pings = await emails(server, "in attesa")
+    assert len(pings) == 1 and pings[0]["subject"].startswith("⏳ 2 richieste")
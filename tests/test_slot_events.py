@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+from slot_events import SLOT_CLAIMED, SLOT_RELEASED, SlotEventBroker
+
+pytestmark = pytest.mark.anyio
+
+
+class ConnectedRequest:
+    async def is_disconnected(self) -> bool:
+        return False
+
+
+class FakeChangeStream:
+    """Yields the given changes once; later watches wait forever"""
+
+    def __init__(self, changes):
+        self.changes = changes
+
+    def watch(self, pipeline, **kwargs):
+        changes, self.changes = self.changes, None
+        return FakeStream(changes)
+
+
+class FakeStream:
+    def __init__(self, changes):
+        self.changes = changes
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def __aiter__(self):
+        if self.changes is None:
+            await asyncio.Event().wait()
+        for change in self.changes:
+            yield change
+
+
+def insert(_id: ObjectId, time: str) -> dict:
+    return {
+        "_id": {"token": str(_id)}, "operationType": "insert", "documentKey": {"_id": _id},
+        "fullDocument": {"_id": _id, "id": f"apt-{time}", "date": "2026-03-05", "time": time, "agency_name": "Navigli"},
+    }
+
+
+def delete(_id: ObjectId) -> dict:
+    return {"_id": {"token": f"del-{_id}"}, "operationType": "delete", "documentKey": {"_id": _id}}
+
+
+async def events(broker: SlotEventBroker, changes, count: int) -> list:
+    stream = broker.stream(ConnectedRequest())
+    assert await stream.__anext__() == "retry: 3000\n\n"
+    watcher = asyncio.create_task(broker.watch_change_stream(FakeChangeStream(changes)))
+    try:
+        return [await asyncio.wait_for(stream.__anext__(), timeout=1) for _ in range(count)]
+    finally:
+        watcher.cancel()
+        await stream.aclose()
+
+
+async def test_rolled_back_block_is_released_after_being_claimed():
+    first, second = ObjectId(), ObjectId()
+    received = await events(
+        SlotEventBroker(source="changestream"),
+        [insert(first, "09:00"), insert(second, "09:45"), delete(first), delete(second)],
+        count=4,
+    )
+
+    assert [line.split("\n")[0] for line in received] == [f"event: {SLOT_CLAIMED}"] * 2 + [f"event: {SLOT_RELEASED}"] * 2
+    assert '"time": "09:45"' in received[3] and '"appointment_id": "apt-09:45"' in received[3]
+    assert all("Navigli" not in line for line in received)
+
+
+async def test_delete_of_an_appointment_never_seen_inserted_is_ignored():
+    known = ObjectId()
+    received = await events(
+        SlotEventBroker(source="changestream"), [delete(ObjectId()), insert(known, "09:00"), delete(known)], count=2
+    )
+    assert [line.split("\n")[0] for line in received] == [f"event: {SLOT_CLAIMED}", f"event: {SLOT_RELEASED}"]
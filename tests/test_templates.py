@@ -0,0 +1,52 @@
+"""Golden-file tests: every template rendered with render_bench's samples.
+
+After an intended template change, regenerate the files and review the diff:
+
+    UPDATE_GOLDEN=1 python -m pytest tests/test_templates.py
+"""
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from render_bench import TEMPLATES_DIR, samples
+from templating import TemplateRenderer
+
+GOLDEN_DIR = Path(__file__).parent / "golden"
+UPDATE_GOLDEN = os.environ.get("UPDATE_GOLDEN") == "1"
+
+
+@pytest.fixture(scope="module")
+def renderer():
+    # local_datetime renders in the server's timezone
+    previous = os.environ.get("TZ")
+    os.environ["TZ"] = "Europe/Rome"
+    time.tzset()
+    yield TemplateRenderer(TEMPLATES_DIR)
+    if previous is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = previous
+    time.tzset()
+
+
+def test_every_template_has_a_sample(renderer):
+    assert sorted(samples()) == sorted(renderer.env.list_templates())
+
+
+@pytest.mark.parametrize("name", sorted(samples()))
+def test_template_matches_golden_file(renderer, name):
+    rendered = renderer.render(name, **samples()[name])
+    golden = GOLDEN_DIR / name
+    if UPDATE_GOLDEN:
+        golden.parent.mkdir(parents=True, exist_ok=True)
+        golden.write_text(rendered)
+    assert rendered == golden.read_text(), f"{name} differs from {golden}; UPDATE_GOLDEN=1 if intended"
+
+
+def test_user_input_is_escaped_in_html_only(renderer):
+    context = samples()["emails/contact_request.html"]
+    html, text = renderer.render_email("contact_request", **context)
+    assert "<script>" not in html and "&lt;script&gt;" in html
+    assert "<script>" in text
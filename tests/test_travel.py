@@ -0,0 +1,121 @@
+import pytest
+
+from schedule import ScheduleEngine
+from travel import Gazetteer, TravelMatrix, TravelPlanner, normalize_address, street_of
+
+# 0.1 degrees of latitude is 11.12 km
+DUOMO = (45.4642, 9.1900)
+DUOMO_1 = (45.4641, 9.1919)
+NORTH = (45.5642, 9.1900)
+
+GAZETTEER = {
+    "Piazza del Duomo": DUOMO,
+    "Piazza del Duomo 1": DUOMO_1,
+    "Viale Fulvio Testi": NORTH,
+}
+
+
+@pytest.fixture
+def gazetteer():
+    return Gazetteer(GAZETTEER)
+
+
+@pytest.fixture
+def planner(gazetteer):
+    # Plain kilometres at 30 km/h: DUOMO to NORTH is 22 minutes
+    matrix = TravelMatrix(speed_kmh=30, detour_factor=1.0, overhead_minutes=0)
+    return TravelPlanner(gazetteer, matrix, visit_minutes=30)
+
+
+@pytest.mark.parametrize("address, normalized", [
+    ("P.za del Duomo, 1 - 20122 Milano", "piazza del duomo 1"),
+    ("C.so Buenos Aires 12a, Milano (MI)", "corso buenos aires 12a"),
+    ("V.le Fulvio Testi", "viale fulvio testi"),
+    ("Via Università", "via universita"),
+])
+def test_normalize_address(address, normalized):
+    assert normalize_address(address) == normalized
+
+
+def test_street_of_drops_house_numbers():
+    assert street_of("corso buenos aires 12a") == "corso buenos aires"
+
+
+@pytest.mark.parametrize("address, point", [
+    ("P.za del Duomo, 1 - 20122 Milano", DUOMO_1),
+    # Unlisted house number: the street
+    ("Piazza del Duomo 7, Milano", DUOMO),
+    ("v.le fulvio testi 300", NORTH),
+    ("Via Inesistente 3", None),
+])
+def test_locate(gazetteer, address, point):
+    assert gazetteer.locate(address) == point
+
+
+def test_load_reads_the_csv(tmp_path):
+    path = tmp_path / "gazetteer.csv"
+    path.write_text("street,lat,lon\nPiazza del Duomo,45.4642,9.19\n", encoding="utf-8")
+    assert Gazetteer.load(path).locate("piazza del duomo 3") == DUOMO
+
+
+def test_travel_minutes():
+    matrix = TravelMatrix(speed_kmh=30, detour_factor=1.0, overhead_minutes=0)
+    assert matrix.minutes([NORTH], DUOMO)[0] == pytest.approx(11.1195 * 2, rel=1e-4)
+
+    detoured = TravelMatrix(speed_kmh=20, detour_factor=1.4, overhead_minutes=5)
+    assert detoured.minutes([NORTH], DUOMO)[0] == pytest.approx(11.1195 * 1.4 * 3 + 5, rel=1e-4)
+    # No overhead for staying put
+    assert list(detoured.minutes([DUOMO, NORTH], DUOMO)) == [0.0, pytest.approx(51.7, abs=0.1)]
+
+
+def test_travel_minutes_are_memoized_both_ways():
+    matrix = TravelMatrix(max_entries=2)
+    forward = matrix.minutes([NORTH], DUOMO)[0]
+    assert matrix._memo[(DUOMO, NORTH)] == matrix._memo[(NORTH, DUOMO)] == forward
+    assert matrix.minutes([DUOMO], NORTH)[0] == forward
+
+    matrix.minutes([DUOMO_1], DUOMO)
+    assert len(matrix._memo) == 2 and (NORTH, DUOMO) not in matrix._memo
+
+
+def test_reachable_mask(planner):
+    table = ScheduleEngine().default
+    noon = table.index["12:00"]
+    booked = [(noon, "Piazza del Duomo")]
+
+    # 15 minutes between one visit and the next slot: not enough for a 22-minute trip
+    far = planner.reachable(table, booked, "Viale Fulvio Testi 10")
+    unreachable = [t for t, free in table.slots(far) if not free]
+    assert unreachable == ["11:15", "12:00", "12:45"]
+
+    # Next door: only the booked slot itself is out
+    near = planner.reachable(table, booked, "Piazza del Duomo")
+    assert near == table.full_mask & ~(1 << noon)
+
+
+def test_reachable_checks_the_bookings_on_both_sides(planner):
+    table = ScheduleEngine().default
+    booked = [(table.index["09:45"], "Piazza del Duomo"), (table.index["12:00"], "Piazza del Duomo")]
+    mask = planner.reachable(table, booked, "Viale Fulvio Testi")
+    # 10:30 is too soon after the first visit, 11:15 too close to the second
+    unreachable = [t for t, free in table.slots(mask) if not free]
+    assert unreachable == ["09:00", "09:45", "10:30", "11:15", "12:00", "12:45"]
+
+
+def test_unknown_addresses_count_as_reachable(planner):
+    table = ScheduleEngine().default
+    booked = [(table.index["12:00"], "Piazza del Duomo")]
+    assert planner.reachable(table, booked, "Via Inesistente 3") == table.full_mask
+    # A booking at an unknown address doesn't constrain the others
+    unknown_booking = [(table.index["12:00"], "Via Inesistente 3")]
+    assert planner.reachable(table, unknown_booking, "Viale Fulvio Testi") == table.full_mask
+
+
+def test_from_env(tmp_path):
+    assert TravelPlanner.from_env({}, 45) is None
+
+    path = tmp_path / "gazetteer.csv"
+    path.write_text("street,lat,lon\nPiazza del Duomo,45.4642,9.19\n", encoding="utf-8")
+    planner = TravelPlanner.from_env({"TRAVEL_GAZETTEER_PATH": str(path), "TRAVEL_SPEED_KMH": "15"}, 45)
+    assert planner.visit_minutes == 30
+    assert planner.matrix.speed_kmh == 15 and planner.matrix.detour_factor == 1.4